@@ -0,0 +1,112 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+import db
+import events
+import reservation_store
+
+
+def to_ordinal(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, date):
+        return value.toordinal()
+    return date.fromisoformat(str(value)[:10]).toordinal()
+
+
+class AvailabilityIndex:
+    # Per-room sorted CheckIn and Checkout day ordinals, as NumPy arrays. For a stay [a, b) the number
+    # of overlapping reservations is #(CheckIn < b) - #(Checkout <= a), two searchsorteds per room.
+    # The check-ins are reservation_store.RoomStays' own arrays; the sorted checkouts are derived per
+    # room and rebuilt when that room's version moves on.
+    def __init__(self, stays=None):
+        self.rooms = {}  # RoomCode -> (RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor)
+        # A standalone index (bulk.py's pending bookings) keeps its own stays
+        self.stays = stays if stays is not None else reservation_store.RoomStays()
+        self._checkouts = {}  # RoomCode -> (RoomStays version, sorted checkouts)
+        self.syncs = 0  # RoomStays.syncs when the rooms were read
+        self._lock = threading.RLock()
+
+    def load(self, cursor):
+        # (Re)read the rooms; get_index() calls it again once the store has caught up with the table
+        cursor.execute("SELECT RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor FROM lab7_rooms")
+        rooms = {room[0]: tuple(room) for room in cursor.fetchall()}
+        with self._lock:
+            self.rooms = rooms
+            self.syncs = self.stays.syncs
+        return self
+
+    def use(self, stays):
+        # The stays were reloaded (reservation_store.reset()); start over from the new ones
+        with self._lock:
+            self.stays = stays
+            self._checkouts.clear()
+
+    def add_room(self, room):
+        with self._lock:
+            self.rooms[room[0]] = tuple(room)
+
+    def add_reservation(self, code, room, checkin, checkout):
+        self.stays.add(code, room, checkin, checkout)
+
+    def remove_reservation(self, code):
+        self.stays.remove(code)
+
+    def _sorted(self, room):
+        version = self.stays.versions.get(room, 0)
+        _, checkins, checkouts = self.stays.get(room)
+        with self._lock:
+            built = self._checkouts.get(room)
+            if built is None or built[0] != version:
+                built = self._checkouts[room] = (version, np.sort(checkouts))
+        return checkins, built[1]
+
+    def overlapping(self, room, checkin, checkout):
+        checkin, checkout = to_ordinal(checkin), to_ordinal(checkout)
+        checkins, checkouts = self._sorted(room)
+        return int(np.searchsorted(checkins, checkout)) - int(np.searchsorted(checkouts, checkin, side="right"))
+
+    def is_free(self, room, checkin, checkout):
+        return self.overlapping(room, checkin, checkout) == 0
+
+    def free_rooms(self, checkin, checkout, bed_type="Any", min_occupancy=0, room_code="Any"):
+        # Same filters as the old AvailableRooms CTE (MySQL compares these case-insensitively)
+        any_room = room_code.lower() == "any"
+        any_bed = bed_type.lower() == "any"
+        checkin, checkout = to_ordinal(checkin), to_ordinal(checkout)
+        with self._lock:
+            candidates = [
+                room for code, room in self.rooms.items()
+                if (any_room or code.lower() == room_code.lower())
+                and (any_bed or room[3].lower() == bed_type.lower())
+                and room[4] >= min_occupancy
+            ]
+            free = [room for room in candidates if self.overlapping(room[0], checkin, checkout) == 0]
+        return sorted(free, key=lambda room: room[0])
+
+
+def get_index(cursor):
+    # Build the current database's index on first use; later calls reuse it
+    stays = reservation_store.get_room_stays(cursor)
+    index = db.pool_cached("availability", lambda: AvailabilityIndex(stays).load(cursor))
+    if index.stays is not stays:
+        index.use(stays)
+    if index.syncs != stays.syncs:
+        index.load(cursor)
+    return index
+
+
+def loaded_index():
+    # The index if it has been built, without touching the database (None otherwise)
+    return db.pool_state().get("availability")
+
+
+def reset():
+    # Drop the index so the next get_index() reloads it from the database
+    db.pool_state().pop("availability", None)
+
+
+# Bookings and cancellations reach the index through reservation_store.RoomStays
+events.subscribe(reset=reset)
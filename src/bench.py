@@ -0,0 +1,159 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from itertools import islice
+
+import db
+import datagen
+import events
+import service
+
+# Times every menu path through the service layer at several data scales. Each scale gets its
+# own SQLite file under --workdir (generated once and reused). Results are appended as JSON lines
+# tagged with the current git commit, so runs from different versions can be compared.
+
+def _version():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    if len(samples) > 1:
+        cuts = statistics.quantiles(samples, n=100, method="inclusive")
+        p50, p95, p99 = cuts[49], cuts[94], cuts[98]
+    else:
+        p50 = p95 = p99 = samples[0]
+    total = sum(samples)
+    return {
+        "count": len(samples),
+        "p50_ms": round(p50 * 1000, 3),
+        "p95_ms": round(p95 * 1000, 3),
+        "p99_ms": round(p99 * 1000, 3),
+        "throughput_per_s": round(len(samples) / total, 1) if total else None,
+    }
+
+
+def _time(func, iterations):
+    samples = []
+    for i in range(iterations):
+        began = time.perf_counter()
+        func(i)
+        samples.append(time.perf_counter() - began)
+    return samples
+
+
+def prepare(path, reservations, seed):
+    db.configure(db.SQLiteBackend(path))
+    if not os.path.exists(path):
+        conn = db.get_db_connection()
+        try:
+            datagen.generate(conn, reservations, seed=seed)
+        finally:
+            conn.close()
+    events.reset()
+
+
+def run_scale(reservations, iterations, workdir, seed=0):
+    path = os.path.join(workdir, f"bench_{reservations}.db")
+    prepare(path, reservations, seed)
+    rng = random.Random(seed)
+    year = date.today().year
+    results = {}
+
+    # First calls pay for loading the in-process indexes; reported separately from the warm numbers
+    began = time.perf_counter()
+    rooms = [row["RoomCode"] for row in service.list_rooms()]
+    service.find_rooms(date(year, 6, 1), date(year, 6, 3))
+    next(service.search(last_name="SMITH"), None)
+    results["warmup"] = summarize([time.perf_counter() - began])
+
+    def random_stay():
+        checkin = date(year, 1, 1) + timedelta(days=rng.randrange(365))
+        return checkin, checkin + timedelta(days=rng.randint(1, 5))
+
+    results["list_rooms"] = _time(lambda i: service.list_rooms(date(year, 1, 1) + timedelta(days=i % 365)), iterations)
+    results["availability"] = _time(lambda i: service.find_rooms(*random_stay(), guests=rng.randint(1, 4)), iterations)
+
+    booked = []
+
+    def book(i):
+        checkin, checkout = random_stay()
+        try:
+            booked.append(service.reserve("BENCH", "BENCH", rng.choice(rooms), checkin, checkout)["CODE"])
+        except service.Conflict:
+            pass
+
+    results["booking"] = _time(book, iterations)
+    results["cancellation"] = _time(lambda i: service.cancel(booked[i]), len(booked))
+    results["detailed_search"] = _time(
+        lambda i: list(islice(service.search(last_name=rng.choice(datagen.LAST_NAMES)[:2] + "*", checkin=date(year, 3, 1), checkout=date(year, 4, 1)), 50)),
+        iterations,
+    )
+    results["revenue"] = _time(lambda i: service.revenue(date(year, 1, 1), date(year + 1, 1, 1)), max(1, iterations // 10))
+    return {op: summary if isinstance(summary, dict) else summarize(summary) for op, summary in results.items() if summary}
+
+
+def compare(previous_path, current):
+    # Latest earlier result for each (scale, operation) from a different version
+    baseline = {}
+    with open(previous_path) as previous:
+        for line in previous:
+            record = json.loads(line)
+            if record["version"] != current[0]["version"]:
+                baseline[(record["reservations"], record["operation"])] = record
+    for record in current:
+        before = baseline.get((record["reservations"], record["operation"]))
+        if before:
+            change = (record["p50_ms"] - before["p50_ms"]) / before["p50_ms"] * 100 if before["p50_ms"] else 0.0
+            print(f"{record['reservations']:<12}{record['operation']:<17}{before['version']:>9} {before['p50_ms']:>10.3f} -> {record['p50_ms']:>10.3f} ms  {change:+.1f}%")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every menu path at several data scales")
+    parser.add_argument("--scales", default="1e3,1e4,1e5", help="comma-separated reservation counts (tested up to 1e6)")
+    parser.add_argument("--iterations", type=int, default=200, help="timed calls per operation")
+    parser.add_argument("--workdir", default=os.path.join(os.getcwd(), "bench_data"), help="where the generated databases live")
+    parser.add_argument("--results", default="bench_results.jsonl", help="JSON lines file the results are appended to")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    os.makedirs(args.workdir, exist_ok=True)
+    version, stamp = _version(), datetime.now().isoformat(timespec="seconds")
+    records = []
+    print(f"{'Reservations':<14}{'Operation':<17}{'Count':>7}{'p50 ms':>11}{'p95 ms':>11}{'p99 ms':>11}{'ops/s':>11}")
+    print("=" * 82)
+    for scale in args.scales.split(","):
+        reservations = int(float(scale))
+        try:
+            summaries = run_scale(reservations, args.iterations, args.workdir, args.seed)
+        except (db.PoolError, service.ServiceError, *db.Error) as err:
+            print(f"Error at {reservations} reservations: {err}", file=sys.stderr)
+            return 1
+        for operation, summary in summaries.items():
+            print(f"{reservations:<14}{operation:<17}{summary['count']:>7}{summary['p50_ms']:>11.3f}{summary['p95_ms']:>11.3f}{summary['p99_ms']:>11.3f}{summary['throughput_per_s'] or 0:>11.1f}")
+            records.append(dict(version=version, timestamp=stamp, reservations=reservations, operation=operation, **summary))
+
+    previous = os.path.exists(args.results)
+    if previous:
+        print("\nChange in p50 against the last run of another version:")
+        compare(args.results, records)
+    with open(args.results, "a") as out:
+        for record in records:
+            out.write(json.dumps(record) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
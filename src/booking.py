@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+
+import db
+import events
+import statements
+
+MAX_RETRIES = 5
+BACKOFF = 0.01  # seconds; doubled on every retry, with jitter
+
+
+class RoomUnavailable(Exception):
+    pass
+
+
+class InvalidStay(ValueError):
+    pass
+
+
+def check_stay(checkin, checkout):
+    # Overlap checks only look back statements.MAX_STAY_NIGHTS, so a longer stay must never be stored
+    nights = (statements.to_date(checkout) - statements.to_date(checkin)).days
+    if nights <= 0:
+        raise InvalidStay("Checkout must be after check-in")
+    if nights > statements.MAX_STAY_NIGHTS:
+        raise InvalidStay(f"A stay can be at most {statements.MAX_STAY_NIGHTS} nights")
+
+
+_room_locks = {}
+_room_locks_guard = threading.Lock()
+
+
+def room_lock(room):
+    # Threads in this process queue on a per-room lock before touching the database,
+    # so same-room bookings don't pile up as lock waits on the server
+    with _room_locks_guard:
+        return _room_locks.setdefault(room, threading.Lock())
+
+
+def book(conn, room, checkin, checkout, rate, last_name, first_name, adults, kids, max_retries=MAX_RETRIES):
+    # Check and insert under a per-room database lock, retrying deadlocks and lock timeouts.
+    # Returns (reservation code, retries); raises RoomUnavailable if the stay overlaps another and
+    # InvalidStay if it is empty or too long.
+    check_stay(checkin, checkout)
+    backend = conn.backend
+    retries = 0
+    with room_lock(room):
+        while True:
+            cursor = conn.cursor()
+            try:
+                # Callers read on this connection first (the index, MAX(maxOcc)); on MySQL's REPEATABLE
+                # READ that pins a snapshot, and find_conflict, a plain read, would not see a stay
+                # committed since. Start a fresh transaction so the check reads after the room lock.
+                conn.rollback()
+                backend.lock_room(cursor, room)
+                if statements.execute(conn, "find_conflict", (room,) + statements.overlap_params(checkin, checkout)).fetchall():
+                    conn.rollback()
+                    # Whoever booked it first may be another process; re-read this room's stays
+                    events.room_changed(room)
+                    raise RoomUnavailable(f"Room {room} is already booked between {checkin} and {checkout}")
+                code = statements.execute(
+                    conn, "insert_reservation", (room, checkin, checkout, rate, last_name, first_name, adults, kids),
+                ).lastrowid
+                conn.commit()
+                break
+            except db.Error as e:
+                conn.rollback()
+                if retries >= max_retries or not backend.is_retryable(e):
+                    raise
+                retries += 1
+                time.sleep(random.uniform(0, BACKOFF * 2 ** retries))
+            finally:
+                cursor.close()
+    events.reservation_added(code, room, checkin, checkout)
+    return code, retries
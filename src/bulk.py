@@ -0,0 +1,196 @@
+import argparse
+import json
+import sys
+from datetime import date
+
+import db
+import availability
+import events
+import pricing
+import statements
+
+# One booking request per line, e.g.
+# {"request_id": "r1", "first_name": "Ann", "last_name": "Lee", "room": "AOB", "bed_type": "Any",
+#  "checkin": "2024-06-01", "checkout": "2024-06-04", "adults": 2, "kids": 0}
+# "room" may be "Any" (the default), in which case the first free room matching bed_type is booked.
+
+class Rejected(Exception):
+    pass
+
+
+def parse_request(line):
+    try:
+        request = json.loads(line)
+    except ValueError as e:
+        raise Rejected(f"invalid JSON: {e}")
+    if not isinstance(request, dict):
+        raise Rejected("request must be a JSON object")
+    try:
+        booking = {
+            "request_id": request.get("request_id"),
+            "first_name": str(request["first_name"]),
+            "last_name": str(request["last_name"]),
+            "room": str(request.get("room", "Any")),
+            "bed_type": str(request.get("bed_type", "Any")),
+            "checkin": date.fromisoformat(request["checkin"]),
+            "checkout": date.fromisoformat(request["checkout"]),
+            "adults": int(request.get("adults", 1)),
+            "kids": int(request.get("kids", 0)),
+        }
+    except KeyError as e:
+        raise Rejected(f"missing field {e}")
+    except (TypeError, ValueError) as e:
+        raise Rejected(f"invalid field: {e}")
+    if booking["checkout"] <= booking["checkin"]:
+        raise Rejected("checkout must be after checkin")
+    if (booking["checkout"] - booking["checkin"]).days > statements.MAX_STAY_NIGHTS:
+        raise Rejected(f"a stay can be at most {statements.MAX_STAY_NIGHTS} nights")
+    if booking["adults"] < 0 or booking["kids"] < 0 or booking["adults"] + booking["kids"] == 0:
+        raise Rejected("invalid number of guests")
+    return booking
+
+
+def choose_room(index, pending, booking):
+    # Check against committed reservations (index) and against requests accepted earlier in this batch (pending)
+    guests = booking["adults"] + booking["kids"]
+    if booking["room"].lower() != "any":
+        # Room codes compare case-insensitively, as they do in MySQL
+        room = next((room for code, room in index.rooms.items() if code.lower() == booking["room"].lower()), None)
+        if room is None:
+            raise Rejected(f"unknown room {booking['room']}")
+        if room[4] < guests:
+            raise Rejected(f"room {room[0]} holds at most {room[4]} guests")
+        candidates = [room] if index.is_free(room[0], booking["checkin"], booking["checkout"]) else []
+    else:
+        candidates = index.free_rooms(booking["checkin"], booking["checkout"], booking["bed_type"], guests)
+    for room in candidates:
+        if pending.is_free(room[0], booking["checkin"], booking["checkout"]):
+            return room
+    raise Rejected("no room available for the requested dates")
+
+
+def process_batch(conn, index, batch):
+    # batch: [(line number, booking or Rejected)] -> result dicts in input order
+    cursor = conn.cursor()
+    pending = availability.AvailabilityIndex()
+    results, accepted = [], []
+    for number, booking in batch:
+        result = {"line": number}
+        if isinstance(booking, Rejected):
+            results.append(dict(result, status="rejected", reason=str(booking)))
+            continue
+        result["request_id"] = booking["request_id"]
+        try:
+            room = choose_room(index, pending, booking)
+        except Rejected as e:
+            results.append(dict(result, status="rejected", reason=str(e)))
+            continue
+        pending.add_reservation(number, room[0], booking["checkin"], booking["checkout"])
+        accepted.append((result, booking, room))
+        results.append(result)
+
+    if accepted:
+        costs = pricing.quote_batch(
+            [booking["checkin"] for _, booking, _ in accepted],
+            [booking["checkout"] for _, booking, _ in accepted],
+            [room[5] for _, _, room in accepted],
+        )
+        rows = [
+            (room[0], booking["checkin"], booking["checkout"], float(cost), booking["last_name"], booking["first_name"], booking["adults"], booking["kids"])
+            for (_, booking, room), cost in zip(accepted, costs)
+        ]
+        # One multi-row INSERT and one commit for the whole batch. The index only knows this process's
+        # bookings, so with the batch's rooms locked each stay is re-checked against the table first,
+        # in a fresh transaction: the index was read on this connection, and on MySQL that snapshot
+        # would hide stays committed since (see booking.book)
+        try:
+            conn.rollback()
+            conn.backend.lock_rooms(cursor, [room[0] for _, _, room in accepted])
+            kept = []
+            for (result, booking, room), row in zip(accepted, rows):
+                if statements.execute(conn, "overlapping_stays", (room[0],) + statements.overlap_params(booking["checkin"], booking["checkout"])).fetchall():
+                    result.update(status="rejected", reason=f"room {room[0]} was just booked for those dates")
+                else:
+                    kept.append(((result, booking, room), row))
+            lost = {room[0] for result, _, room in accepted if result.get("status") == "rejected"}
+            accepted, rows = [item for item, _ in kept], [row for _, row in kept]
+            codes = []
+            if rows:
+                cursor.executemany(statements.SQL["insert_reservation"], rows)
+                codes = conn.backend.inserted_ids(cursor, len(rows))
+            conn.commit()
+        except db.Error as e:
+            conn.rollback()
+            for result, _, _ in accepted:
+                result.update(status="rejected", reason=f"database error: {e}")
+            cursor.close()
+            return results
+        for (result, booking, room), row, code in zip(accepted, rows, codes):
+            result.update(status="booked", reservation_code=code, room=room[0], total_cost=row[3])
+            events.reservation_added(code, room[0], booking["checkin"], booking["checkout"])
+        # Rooms another process booked under us
+        for room in sorted(lost):
+            events.room_changed(room)
+    cursor.close()
+    return results
+
+
+def run(source, sink, batch_size=1000):
+    conn = db.get_db_connection()
+    if conn is None:
+        raise db.PoolError("Failed to connect to the database.")
+    counts = {"booked": 0, "rejected": 0}
+    try:
+        # Start from the current database state rather than whatever this process cached earlier
+        events.reset()
+        index = availability.get_index(conn.cursor())
+        batch = []
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                batch.append((number, parse_request(line)))
+            except Rejected as e:
+                batch.append((number, e))
+            if len(batch) >= batch_size:
+                _write(sink, process_batch(conn, index, batch), counts)
+                batch = []
+        if batch:
+            _write(sink, process_batch(conn, index, batch), counts)
+    finally:
+        conn.close()
+    return counts
+
+
+def _write(sink, results, counts):
+    for result in results:
+        counts[result["status"]] += 1
+        sink.write(json.dumps(result) + "\n")
+    sink.flush()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Book reservations in bulk from a JSONL file")
+    parser.add_argument("input", nargs="?", default="-", help="JSONL booking requests ('-' for stdin)")
+    parser.add_argument("-o", "--output", default="-", help="where to write JSONL results ('-' for stdout)")
+    parser.add_argument("--batch-size", type=int, default=1000, help="requests per transaction")
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == "-" else open(args.input)
+    sink = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        counts = run(source, sink, args.batch_size)
+        print(f"Booked {counts['booked']}, rejected {counts['rejected']}", file=sys.stderr)
+    except (db.PoolError, *db.Error) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
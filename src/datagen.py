@@ -0,0 +1,153 @@
+import argparse
+import math
+import random
+import sys
+from datetime import date, timedelta
+
+import db
+import events
+import migrations
+
+# Fills lab7_rooms and lab7_reservations with synthetic but plausible data: every room gets a
+# non-overlapping sequence of stays (mostly short, some long, busier on weekends) spread over
+# `years` of history, with guest names drawn from common first/last names.
+
+FIRST_NAMES = [
+    "JAMES", "MARY", "JOHN", "PATRICIA", "ROBERT", "JENNIFER", "MICHAEL", "LINDA", "WILLIAM", "ELIZABETH",
+    "DAVID", "BARBARA", "RICHARD", "SUSAN", "JOSEPH", "JESSICA", "THOMAS", "SARAH", "CHARLES", "KAREN",
+    "DANIEL", "NANCY", "MATTHEW", "LISA", "ANTHONY", "BETTY", "MARK", "MARGARET", "DONALD", "SANDRA",
+    "STEVEN", "ASHLEY", "PAUL", "KIMBERLY", "ANDREW", "EMILY", "JOSHUA", "DONNA", "KENNETH", "MICHELLE",
+]
+LAST_NAMES = [
+    "SMITH", "JOHNSON", "WILLIAMS", "BROWN", "JONES", "GARCIA", "MILLER", "DAVIS", "RODRIGUEZ", "MARTINEZ",
+    "HERNANDEZ", "LOPEZ", "GONZALEZ", "WILSON", "ANDERSON", "THOMAS", "TAYLOR", "MOORE", "JACKSON", "MARTIN",
+    "LEE", "PEREZ", "THOMPSON", "WHITE", "HARRIS", "SANCHEZ", "CLARK", "RAMIREZ", "LEWIS", "ROBINSON",
+    "WALKER", "YOUNG", "ALLEN", "KING", "WRIGHT", "SCOTT", "TORRES", "NGUYEN", "HILL", "FLORES",
+]
+BED_TYPES = [("Queen", 0.45), ("King", 0.35), ("Double", 0.2)]
+DECORS = ["modern", "traditional", "rustic", "bohemian"]
+STAY_LENGTHS = [1, 2, 3, 4, 5, 6, 7, 10, 14]
+STAY_WEIGHTS = [22, 25, 18, 11, 7, 5, 7, 3, 2]
+
+AVERAGE_CYCLE_DAYS = 6  # mean stay plus mean gap between stays, used to size the room count
+
+
+def room_code(number):
+    # R0001 ... then base-36 once four decimal digits run out; always fits CHAR(5)
+    digits = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    if number < 10000:
+        return f"R{number:04d}"
+    code = ""
+    while number:
+        number, digit = divmod(number, 36)
+        code = digits[digit] + code
+    return "X" + code.rjust(4, "0")
+
+
+def make_rooms(count, rng):
+    rooms = []
+    for number in range(1, count + 1):
+        bed_type = rng.choices([name for name, _ in BED_TYPES], [weight for _, weight in BED_TYPES])[0]
+        beds = rng.choice([1, 2, 2, 3])
+        base_price = rng.choice([75, 100, 125, 150, 175, 200, 250, 300])
+        rooms.append((room_code(number), f"Room {number} {rng.choice(DECORS).title()}", beds, bed_type, beds * 2, base_price, rng.choice(DECORS)))
+    return rooms
+
+
+def stays_for_room(room, start, end, rng):
+    # Walk the room's calendar: an idle gap, then a stay, until the history window is used up
+    day = start + timedelta(days=rng.randint(0, 3))
+    while True:
+        gap = int(rng.expovariate(1 / 2.5))
+        day += timedelta(days=gap)
+        if day.weekday() in (3, 4) and rng.random() < 0.3:
+            day += timedelta(days=(5 - day.weekday()) % 7)  # nudge toward weekend arrivals
+        nights = rng.choices(STAY_LENGTHS, STAY_WEIGHTS)[0]
+        checkout = day + timedelta(days=nights)
+        if checkout > end:
+            return
+        adults = rng.randint(1, max(1, room[4] - 1))
+        kids = rng.randint(0, room[4] - adults)
+        rate = round(float(room[5]) * rng.choice([0.85, 0.9, 1.0, 1.0, 1.1, 1.25]), 2)
+        yield (room[0], day, checkout, rate, rng.choice(LAST_NAMES), rng.choice(FIRST_NAMES), adults, kids)
+        day = checkout
+
+
+def generate(conn, reservations=1000, rooms=None, years=5, end=None, seed=0, chunk_size=10000, reset=True):
+    # Returns (rooms created, reservations inserted). Inserts are committed chunk by chunk, so memory
+    # doesn't grow with the row count (about 50 MB at 10^6 rows, the largest run tested).
+    rng = random.Random(seed)
+    end = end or date(date.today().year + 1, 1, 1)
+    start = end - timedelta(days=365 * years)
+    if rooms is None:
+        rooms = max(10, math.ceil(reservations * AVERAGE_CYCLE_DAYS / (365 * years)))
+    migrations.migrate(conn)
+    cursor = conn.cursor()
+    if reset:
+        cursor.execute("DELETE FROM lab7_reservations")
+        cursor.execute("DELETE FROM lab7_rooms")
+    room_rows = make_rooms(rooms, rng)
+    cursor.executemany(
+        "INSERT INTO lab7_rooms (RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor) VALUES (%s, %s, %s, %s, %s, %s, %s)",
+        room_rows,
+    )
+    conn.commit()
+
+    # Interleave rooms so the table is not clustered by room, and stop at the requested count
+    streams = [stays_for_room(room, start, end, rng) for room in room_rows]
+    inserted, chunk = 0, []
+    while streams and inserted + len(chunk) < reservations:
+        for stream in list(streams):
+            stay = next(stream, None)
+            if stay is None:
+                streams.remove(stream)
+                continue
+            chunk.append(stay)
+            if inserted + len(chunk) >= reservations:
+                break
+        if len(chunk) >= chunk_size:
+            inserted += _insert(conn, cursor, chunk)
+            chunk = []
+    if chunk:
+        inserted += _insert(conn, cursor, chunk)
+    cursor.close()
+    events.reset()
+    return len(room_rows), inserted
+
+
+def _insert(conn, cursor, rows):
+    cursor.executemany(
+        "INSERT INTO lab7_reservations (Room, CheckIn, Checkout, Rate, LastName, FirstName, Adults, Kids) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+        rows,
+    )
+    conn.commit()
+    return len(rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill lab7_rooms and lab7_reservations with synthetic data (replaces existing rows)")
+    parser.add_argument("--reservations", type=float, default=1000, help="number of reservations, e.g. 1e5")
+    parser.add_argument("--rooms", type=int, help="number of rooms (default: enough for the history to span --years)")
+    parser.add_argument("--years", type=int, default=5, help="years of history ending next January 1st")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--db", help="SQLite file to fill (default: the configured INN_DB_BACKEND)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(db.SQLiteBackend(args.db))
+    conn = db.get_db_connection()
+    if conn is None:
+        return 1
+    try:
+        rooms, reservations = generate(conn, int(args.reservations), args.rooms, args.years, seed=args.seed)
+    except db.Error as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"Generated {rooms} rooms and {reservations} reservations", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
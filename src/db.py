@@ -1,22 +1,672 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import date, datetime
+
 import mysql.connector
-from mysql.connector import Error
+from mysql.connector import Error as MySQLError, errorcode
 from dotenv import load_dotenv
-import os
+
+import events
 
 # Load environment variables from .env file
 load_dotenv()
 
-def get_db_connection():
-    try:
-        connection = mysql.connector.connect(
-            host="db.labthreesixfive.com",
-            user=os.getenv("HP_JDBC_USER"),
-            password=os.getenv("HP_JDBC_PW"),
-            database=os.getenv("HP_JDBC_USER")
-        )
+# Errors raised by either backend, so callers can catch them in one place
+Error = (MySQLError, sqlite3.Error)
+# Errors caused by the row being written (bad value, missing room...) rather than the connection
+IntegrityError = (mysql.connector.IntegrityError, mysql.connector.DataError, sqlite3.IntegrityError)
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "inn.db")
+
+
+class PoolError(Exception):
+    pass
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class MySQLBackend:
+    name = "mysql"
+    explain_prefix = "EXPLAIN "
+
+    def __init__(self, host=None, user=None, password=None, database=None):
+        self.params = {
+            "host": host or os.getenv("HP_DB_HOST", "db.labthreesixfive.com"),
+            "user": user or os.getenv("HP_JDBC_USER"),
+            "password": password or os.getenv("HP_JDBC_PW"),
+            "database": database or os.getenv("HP_JDBC_USER"),
+        }
+
+    def connect(self):
+        connection = mysql.connector.connect(**self.params)
         if connection.is_connected():
             print("Connected to MySQL database")
         return connection
-    except Error as e:
+
+    def inserted_ids(self, cursor, count):
+        # A multi-row INSERT reports its first id; InnoDB gives one statement consecutive ids
+        first = cursor.lastrowid
+        return list(range(first, first + count))
+
+    def lock_room(self, cursor, room):
+        # Row lock on the room: bookings for the same room queue up, other rooms are unaffected
+        cursor.execute("SELECT RoomCode FROM lab7_rooms WHERE RoomCode = %s FOR UPDATE", (room,))
+        cursor.fetchall()
+
+    def lock_rooms(self, cursor, rooms):
+        # Several rooms for one transaction, always locked in the same order so writers can't deadlock
+        rooms = sorted(set(rooms))
+        if rooms:
+            placeholders = ", ".join(["%s"] * len(rooms))
+            cursor.execute(f"SELECT RoomCode FROM lab7_rooms WHERE RoomCode IN ({placeholders}) ORDER BY RoomCode FOR UPDATE", rooms)
+            cursor.fetchall()
+
+    def prepared_cursor(self, connection):
+        # Server-side prepared statement: parsed once, then only the parameters travel on each execute
+        return connection.cursor(prepared=True)
+
+    def is_retryable(self, error):
+        return getattr(error, "errno", None) in (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT)
+
+    def is_alive(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except MySQLError:
+            return False
+
+
+# SQLite stores dates as ISO text; convert them back so both backends hand out datetime.date
+sqlite3.register_adapter(date, lambda d: d.isoformat())
+sqlite3.register_adapter(datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("DATE", lambda b: date.fromisoformat(b.decode()[:10]))
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if value is None or isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def _datediff(a, b):
+    if a is None or b is None:
+        return None
+    return (_to_date(a) - _to_date(b)).days
+
+
+def _least(*args):
+    return None if None in args else min(args)
+
+
+def _greatest(*args):
+    return None if None in args else max(args)
+
+
+class SQLiteCursor(sqlite3.Cursor):
+    # The application SQL uses the MySQL %s paramstyle; SQLite wants ?
+    def execute(self, sql, params=()):
+        return super().execute(sql.replace("%s", "?"), params)
+
+    def executemany(self, sql, seq_of_params):
+        return super().executemany(sql.replace("%s", "?"), seq_of_params)
+
+
+class SQLiteConnection(sqlite3.Connection):
+    def cursor(self, factory=SQLiteCursor, **kwargs):
+        return super().cursor(factory)
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    explain_prefix = "EXPLAIN QUERY PLAN "
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("INN_SQLITE_PATH", DEFAULT_SQLITE_PATH)
+
+    def connect(self):
+        connection = sqlite3.connect(
+            self.path,
+            timeout=30,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,
+            factory=SQLiteConnection,
+            cached_statements=256,
+        )
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA foreign_keys = ON")
+        # MySQL functions used by the queries in main.py
+        connection.create_function("DATEDIFF", 2, _datediff, deterministic=True)
+        connection.create_function("LEAST", -1, _least, deterministic=True)
+        connection.create_function("GREATEST", -1, _greatest, deterministic=True)
+        connection.create_function("YEAR", 1, lambda d: None if d is None else _to_date(d).year, deterministic=True)
+        connection.create_function("CURDATE", 0, lambda: date.today().isoformat())
+        return connection
+
+    def inserted_ids(self, cursor, count):
+        # executemany inserts row by row while holding the write lock, so the ids end at last_insert_rowid()
+        cursor.execute("SELECT last_insert_rowid()")
+        last = cursor.fetchone()[0]
+        return list(range(last - count + 1, last + 1))
+
+    def prepared_cursor(self, connection):
+        # sqlite3 keeps compiled statements in a per-connection cache keyed by SQL text, so reusing
+        # the same parameterized text on a dedicated cursor is the SQLite equivalent
+        return connection.cursor()
+
+    def lock_room(self, cursor, room):
+        # SQLite has no row locks; take the database write lock up front so the check and insert are atomic
+        cursor.execute("BEGIN IMMEDIATE")
+
+    def lock_rooms(self, cursor, rooms):
+        cursor.execute("BEGIN IMMEDIATE")
+
+    def is_retryable(self, error):
+        return isinstance(error, sqlite3.OperationalError) and ("locked" in str(error) or "busy" in str(error))
+
+    def is_alive(self, connection):
+        try:
+            connection.execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+
+BACKENDS = {"mysql": MySQLBackend, "sqlite": SQLiteBackend}
+
+
+def get_backend(name=None):
+    name = (name or os.getenv("INN_DB_BACKEND", "mysql")).lower()
+    if name not in BACKENDS:
+        raise PoolError(f"Unknown database backend '{name}' (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]()
+
+
+_WRITE = re.compile(r"\s*(?:INSERT(?:\s+IGNORE)?\s+INTO|REPLACE\s+INTO|UPDATE|DELETE\s+FROM)\s+[`\"]?(\w+)", re.IGNORECASE)
+_READS = re.compile(r"\b(?:FROM|JOIN)\s+[`\"]?(\w+)", re.IGNORECASE)
+_SPACES = re.compile(r"\s+")
+
+
+class ResultCache:
+    # Read-through cache of query results, keyed by normalized SQL plus parameters. Each entry
+    # remembers the version of every table it read; a write bumps the table's version, which makes
+    # exactly the entries that read it stale. Bounded by entry count and total rows (LRU), plus a
+    # TTL for changes made by other processes, which this one never hears about.
+    def __init__(self, max_entries=256, ttl=60, max_rows=200000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._entries = OrderedDict()  # key -> (rows, {table: version}, expires)
+        self._versions = {}
+        self._rows = 0
+        self.hits = self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(sql, params):
+        return _SPACES.sub(" ", sql).strip(), tuple(params)
+
+    @staticmethod
+    def tables(sql):
+        return {table.lower() for table in _READS.findall(sql)}
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                rows, versions, expires = entry
+                if time.monotonic() < expires and all(self._versions.get(table, 0) == version for table, version in versions.items()):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return rows
+                self._drop(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, rows, versions):
+        # versions: table versions from before the rows were read, so a write racing the read leaves the entry stale
+        if len(rows) > self.max_rows:
+            return
+        tables = self.tables(key[0])
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (rows, {table: versions.get(table, 0) for table in tables}, time.monotonic() + self.ttl)
+            self._rows += len(rows)
+            while self._entries and (len(self._entries) > self.max_entries or self._rows > self.max_rows):
+                self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        rows, _, _ = self._entries.pop(key)
+        self._rows -= len(rows)
+
+    def invalidate(self, tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "rows": self._rows, "hits": self.hits, "misses": self.misses}
+
+
+class _TrackedCursor:
+    # Notices writes so the pool's result cache drops what they change
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=()):
+        self._connection._wrote(sql)
+        return self._cursor.execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        self._connection._wrote(sql)
+        return self._cursor.executemany(sql, seq_of_params)
+
+
+class _RenamedCursor:
+    # Points the application's fixed table names at a pool's own table set (see ConnectionPool.tables)
+    def __init__(self, cursor, rename):
+        self._cursor = cursor
+        self._rename = rename
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, sql, params=()):
+        return self._cursor.execute(self._rename(sql), params)
+
+    def executemany(self, sql, seq_of_params):
+        return self._cursor.executemany(self._rename(sql), seq_of_params)
+
+
+_cursor_wrapper = None
+PREPARED_PER_CONNECTION = 64
+_prepared = weakref.WeakKeyDictionary()  # raw connection -> OrderedDict(sql -> prepared cursor)
+
+
+def set_cursor_wrapper(wrapper):
+    # wrapper(cursor, pooled_connection) -> cursor-like object; used by metrics.py. None turns it off.
+    global _cursor_wrapper
+    _cursor_wrapper = wrapper
+
+
+class PooledConnection:
+    # Checked-out connection; close() hands it back to the pool instead of disconnecting
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+        self._dirty = set()  # tables written in the open transaction
+        # Table versions when the transaction began; results read later may be no newer than this
+        self._versions = pool.cache.versions() if pool.cache else None
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            raise PoolError("Connection has already been returned to the pool")
+        return self._raw
+
+    @property
+    def backend(self):
+        return self._pool.backend
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+    def _wrap(self, cursor):
+        if self._pool.tables:
+            cursor = _RenamedCursor(cursor, self._pool.rename)
+        if self._pool.cache is not None:
+            cursor = _TrackedCursor(cursor, self)
+        return cursor if _cursor_wrapper is None else _cursor_wrapper(cursor, self)
+
+    def cursor(self, *args, **kwargs):
+        return self._wrap(self.raw.cursor(*args, **kwargs))
+
+    def rename(self, sql):
+        # SQL as this connection's database sees it (for callers that bypass the wrapped cursors)
+        return self._pool.rename(sql)
+
+    def _wrote(self, sql):
+        match = _WRITE.match(sql)
+        if match:
+            table = match.group(1).lower()
+            self._dirty.add(table)
+            self._pool.cache.invalidate((table,))
+
+    def _end_transaction(self):
+        # Invalidate again at commit/rollback: a read between the write and the commit may have
+        # cached rows from before it
+        cache = self._pool.cache
+        if cache is not None:
+            if self._dirty:
+                cache.invalidate(self._dirty)
+                self._dirty = set()
+            self._versions = cache.versions()
+
+    def commit(self):
+        self.raw.commit()
+        self._end_transaction()
+
+    def rollback(self):
+        self.raw.rollback()
+        self._end_transaction()
+
+    def query(self, sql, params=(), cache=True):
+        # All rows of a read-only statement, from the result cache when an unchanged copy is there.
+        # Runs as a prepared statement on a miss. The cache is skipped while this transaction has written.
+        pool_cache = self._pool.cache
+        if not cache or pool_cache is None or self._dirty:
+            cursor = self.prepared(sql)
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+        key = pool_cache.key(sql, params)
+        rows = pool_cache.get(key)
+        if rows is None:
+            cursor = self.prepared(sql)
+            cursor.execute(sql, params)
+            rows = [tuple(row) for row in cursor.fetchall()]
+            pool_cache.put(key, rows, self._versions)
+        return list(rows)
+
+    def prepared(self, sql):
+        # Cursor with `sql` prepared on this physical connection; kept for the connection's lifetime
+        # and shared by every checkout, so read its results fully and don't close it
+        raw = self.raw
+        cursors = _prepared.get(raw)
+        if cursors is None:
+            cursors = _prepared[raw] = OrderedDict()
+        cursor = cursors.get(sql)
+        if cursor is None:
+            cursor = cursors[sql] = self.backend.prepared_cursor(raw)
+            if len(cursors) > PREPARED_PER_CONNECTION:
+                _, evicted = cursors.popitem(last=False)
+                evicted.close()
+        else:
+            cursors.move_to_end(sql)
+        return self._wrap(cursor)
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw)
+            self._end_transaction()
+
+    def discard(self):
+        # Drop a connection that is known to be broken rather than reusing it
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.release(raw, broken=True)
+            self._end_transaction()
+
+    def __del__(self):
+        # Safety net for callers that bail out early without closing
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+_TABLES = re.compile(r"\blab7_(?:rooms|reservations)\b", re.IGNORECASE)
+
+
+class ConnectionPool:
+    def __init__(self, backend, max_size=5, idle_timeout=300, health_check_interval=30, checkout_timeout=10, cache=None, name=None, tables=None):
+        self.backend = backend
+        self.cache = cache  # ResultCache shared by this pool's connections, or None
+        self.name = name  # shard name, None for the single-database setup
+        # {"lab7_rooms": ..., "lab7_reservations": ...} when this database keeps its data under other table names
+        self.tables = {table.lower(): renamed for table, renamed in (tables or {}).items()}
+        # In-process caches built from this database (availability index, room stats, ...), see pool_cached()
+        self.state = {}
+        self.state_lock = threading.RLock()
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_interval = health_check_interval
+        self.checkout_timeout = checkout_timeout
+        self._idle = deque()  # (connection, returned_at), most recently returned on the right
+        self._size = 0  # physical connections open, idle or checked out
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def get(self, timeout=None):
+        timeout = self.checkout_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        stale = []
+        raw = None
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolError("Connection pool is closed")
+                    stale.extend(self._evict_idle())
+                    if self._idle:
+                        raw, returned_at = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise PoolTimeout(f"No database connection available after {timeout}s (pool size {self.max_size})")
+                    self._cond.wait(remaining)
+        finally:
+            for connection in stale:
+                self._close_quietly(connection)
+
+        # Only ping connections that have sat idle for a while; a round trip per checkout would defeat the pool
+        if raw is not None and time.monotonic() - returned_at >= self.health_check_interval:
+            if not self.backend.is_alive(raw):
+                self._close_quietly(raw)
+                raw = None
+        if raw is None:
+            try:
+                raw = self.backend.connect()
+            except BaseException:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+        return PooledConnection(self, raw)
+
+    def release(self, raw, broken=False):
+        if not broken:
+            try:
+                # End any open transaction so the next borrower gets a fresh snapshot and no held locks
+                raw.rollback()
+            except Error:
+                broken = True
+        with self._cond:
+            if broken or self._closed:
+                self._size -= 1
+            else:
+                self._idle.append((raw, time.monotonic()))
+            self._cond.notify()
+        if broken or self._closed:
+            self._close_quietly(raw)
+
+    def _evict_idle(self):
+        evicted = []
+        now = time.monotonic()
+        while self._idle and now - self._idle[0][1] > self.idle_timeout:
+            evicted.append(self._idle.popleft()[0])
+            self._size -= 1
+        return evicted
+
+    def rename(self, sql):
+        if not self.tables:
+            return sql
+        return _TABLES.sub(lambda match: self.tables.get(match.group(0).lower(), match.group(0)), sql)
+
+    def stats(self):
+        with self._cond:
+            return {"size": self._size, "idle": len(self._idle), "in_use": self._size - len(self._idle), "max_size": self.max_size}
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle = [connection for connection, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for connection in idle:
+            self._close_quietly(connection)
+
+    @staticmethod
+    def _close_quietly(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def new_pool(backend=None, **pool_options):
+    # Pool with the INN_DB_* settings; backend is a backend object or name (default INN_DB_BACKEND)
+    if isinstance(backend, str) or backend is None:
+        backend = get_backend(backend)
+    pool_options.setdefault("max_size", int(os.getenv("INN_DB_POOL_SIZE", "5")))
+    if "cache" not in pool_options:
+        entries = int(os.getenv("INN_DB_CACHE_SIZE", "256"))
+        pool_options["cache"] = ResultCache(entries, float(os.getenv("INN_DB_CACHE_TTL", "60"))) if entries > 0 else None
+    return ConnectionPool(backend, **pool_options)
+
+
+def configure(backend=None, **pool_options):
+    # Replace the process-wide pool, e.g. to point the app at a SQLite file
+    global _pool
+    pool = new_pool(backend, **pool_options)
+    with _pool_lock:
+        old, _pool = _pool, pool
+    if old is not None:
+        old.close()
+    return pool
+
+
+# Pool selected by using() for the current thread/task, ahead of the process-wide one
+_current = ContextVar("inn_pool", default=None)
+
+
+def get_pool():
+    global _pool
+    pool = _current.get()
+    if pool is not None:
+        return pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = new_pool()
+        return _pool
+
+
+@contextmanager
+def using(pool):
+    # Run a block against another database (a shard): get_db_connection(), get_pool() and the
+    # in-process caches keyed by pool_state() all follow it
+    token = _current.set(pool)
+    try:
+        yield pool
+    finally:
+        _current.reset(token)
+
+
+def pool_state():
+    # Where the in-process caches keep what they built from the current database, so every shard
+    # gets its own availability index, room stats, ... and configure() starts them afresh
+    return get_pool().state
+
+
+def pool_cached(name, build):
+    # The current database's `name` cache, built by build() on first use. Builds for one database
+    # run one at a time (and may nest); different databases build in parallel.
+    pool = get_pool()
+    with pool.state_lock:
+        value = pool.state.get(name)
+        if value is None:
+            value = pool.state[name] = build()
+        return value
+
+
+def _forget_pool_after_fork():
+    # Connections must not be shared with a forked child; it builds its own pool on first use
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+    _current.set(None)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
+def _active_pool():
+    # Current pool without creating one
+    return _current.get() or _pool
+
+
+def cache_stats():
+    # Result cache counters for the current pool, None when there is no pool or no cache
+    pool = _active_pool()
+    return pool.cache.stats() if pool is not None and pool.cache is not None else None
+
+
+def _clear_cache(*args, **kwargs):
+    pool = _active_pool()
+    if pool is not None and pool.cache is not None:
+        pool.cache.clear()
+
+
+def _reservations_changed(*args, **kwargs):
+    # Writes through this process are already tracked at the cursor; this covers the rest
+    pool = _active_pool()
+    if pool is not None and pool.cache is not None:
+        pool.cache.invalidate(("lab7_reservations",))
+
+
+# events.reset() means another process changed the data behind our back
+events.subscribe(_reservations_changed, _reservations_changed, _clear_cache, _reservations_changed)
+
+
+def get_db_connection():
+    try:
+        return get_pool().get()
+    except (MySQLError, sqlite3.Error, PoolError) as e:
         print(f"Error: {e}")
         return None
@@ -0,0 +1,39 @@
+import threading
+
+# In-process caches (availability index, room statistics, ...) subscribe here so every write
+# path only has to announce a booking or cancellation once.
+_listeners = []
+_lock = threading.Lock()
+
+
+def _ignore(*args):
+    pass
+
+
+def subscribe(added=_ignore, removed=_ignore, reset=_ignore, room_changed=_ignore):
+    # Each callback is optional; a listener only passes the announcements it acts on
+    with _lock:
+        _listeners.append((added, removed, reset, room_changed))
+
+
+def reservation_added(code, room, checkin, checkout):
+    for added, _, _, _ in list(_listeners):
+        added(code, room, checkin, checkout)
+
+
+def reservation_removed(code):
+    for _, removed, _, _ in list(_listeners):
+        removed(code)
+
+
+def reset():
+    # Another process changed the reservations; drop caches so they reload on next use
+    for _, _, drop, _ in list(_listeners):
+        drop()
+
+
+def room_changed(room):
+    # Another process booked or cancelled in this room (we lost a booking race, say); only what is
+    # cached for that room has to be read again
+    for _, _, _, changed in list(_listeners):
+        changed(room)
@@ -0,0 +1,340 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+import db
+import availability
+import booking
+import events
+import statements
+
+try:
+    import fcntl
+except ImportError:  # Windows: no advisory lock, run one desk process per journal file
+    fcntl = None
+
+# Local write-ahead journal for bookings and cancellations (INN_JOURNAL=1). A write is appended to a
+# SQLite file next to the app and fsynced, and the desk gets a journal reference (J<id>) right away.
+# A background flusher applies pending entries to the main database in order, many per transaction,
+# and records the reservation code (or why the booking was rejected). Entries left pending by a
+# crash are applied on the next start. Replays are idempotent: a booking whose stay is already in
+# the database for the same guest is taken as applied, and deleting a missing code is a no-op.
+
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal.db")
+FLUSH_INTERVAL = float(os.getenv("INN_JOURNAL_INTERVAL_MS", "50")) / 1000
+BATCH_SIZE = 200
+MAX_BACKOFF = 5.0  # seconds between attempts while the database is unreachable
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,                       -- 'book' or 'cancel'
+    payload TEXT NOT NULL,                    -- JSON
+    status TEXT NOT NULL DEFAULT 'pending',   -- pending, applied, rejected
+    code INTEGER,                             -- reservation code once applied
+    detail TEXT,
+    created TEXT NOT NULL,
+    applied TEXT
+)
+"""
+
+
+def enabled():
+    return os.getenv("INN_JOURNAL", "").lower() in ("1", "true", "yes")
+
+
+class Journal:
+    def __init__(self, path=None):
+        self.path = path or os.getenv("INN_JOURNAL_PATH", DEFAULT_PATH)
+        self._lock_file = open(self.path + ".lock", "w")
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                self._lock_file.close()
+                raise RuntimeError(f"Journal {self.path} is in use by another process")
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = FULL")  # a confirmed entry survives power loss
+        self._conn.execute(SCHEMA)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS journal_status ON journal (status, id)")
+        self._lock = threading.RLock()
+        self.wake = threading.Event()
+        # Pending bookings by room, so the desk can't double-book a room before the flusher catches up,
+        # and pending cancellations by room, so it can rebook their stays before the flusher deletes them
+        self._pending_stays = {}
+        self._cancelled_stays = {}
+        for entry in self.pending():
+            if entry["kind"] == "book":
+                self._hold(entry["id"], entry["payload"])
+            else:
+                self._release(entry["id"], entry["payload"])
+
+    def _hold(self, entry_id, payload):
+        self._pending_stays.setdefault(payload["room"], {})[entry_id] = (payload["checkin"], payload["checkout"])
+
+    def _release(self, entry_id, payload):
+        # A cancelled booking still in the journal stops holding its room; a cancelled reservation's
+        # stay is taken off what the index reports until the flusher has deleted it
+        if "room" not in payload:
+            return
+        held = self._pending_stays.get(payload["room"], {})
+        if payload["entry"] in held:
+            del held[payload["entry"]]
+        else:
+            self._cancelled_stays.setdefault(payload["room"], {})[entry_id] = (payload["checkin"], payload["checkout"])
+
+    def _append(self, kind, payload):
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO journal (kind, payload, created) VALUES (?, ?, ?)",
+                (kind, json.dumps(payload), datetime.now().isoformat(timespec="seconds")),
+            )
+            entry_id = cursor.lastrowid
+            if kind == "book":
+                self._hold(entry_id, payload)
+            else:
+                self._release(entry_id, payload)
+        self.wake.set()
+        return entry_id
+
+    def book(self, room, checkin, checkout, rate, last_name, first_name, adults, kids):
+        # Journal a booking and return its entry id. Raises booking.RoomUnavailable if the stay overlaps
+        # a reservation this process knows about and hasn't journaled a cancellation of; the flusher
+        # re-checks against the database.
+        checkin, checkout = str(checkin)[:10], str(checkout)[:10]
+        booking.check_stay(checkin, checkout)
+        index = availability.loaded_index()
+        with self._lock:
+            held = self._pending_stays.get(room, {}).values()
+            cancelled = sum(
+                other_in < checkout and other_out > checkin for other_in, other_out in self._cancelled_stays.get(room, {}).values()
+            )
+            if any(other_in < checkout and other_out > checkin for other_in, other_out in held) or (
+                index is not None and index.overlapping(room, checkin, checkout) > cancelled
+            ):
+                raise booking.RoomUnavailable(f"Room {room} is already booked between {checkin} and {checkout}")
+            return self._append("book", {
+                "room": room, "checkin": checkin, "checkout": checkout, "rate": float(rate),
+                "last_name": last_name, "first_name": first_name, "adults": int(adults), "kids": int(kids),
+            })
+
+    def cancel(self, code=None, entry=None, stay=None):
+        # Journal a cancellation of a reservation code, or of a journaled booking (by entry id). stay is
+        # the reservation's (room, checkin, checkout), read from the booking entry when not given;
+        # with it the room can be rebooked for those dates before the flusher applies the cancellation.
+        payload = {"code": None if code is None else int(code), "entry": entry}
+        if stay is None and entry is not None:
+            booked = self.entry(entry)
+            if booked is not None:
+                stay = (booked["payload"]["room"], booked["payload"]["checkin"], booked["payload"]["checkout"])
+        if stay is not None:
+            payload.update(room=stay[0], checkin=str(stay[1])[:10], checkout=str(stay[2])[:10])
+        return self._append("cancel", payload)
+
+    def _row(self, row):
+        entry_id, kind, payload, status, code, detail, created, applied = row
+        return {
+            "id": entry_id, "kind": kind, "payload": json.loads(payload), "status": status, "code": code,
+            "detail": detail, "created": created, "applied": applied,
+        }
+
+    def entry(self, entry_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM journal WHERE id = ?", (entry_id,)).fetchone()
+        return None if row is None else self._row(row)
+
+    def pending(self, limit=None):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM journal WHERE status = 'pending' ORDER BY id LIMIT ?", (-1 if limit is None else limit,),
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def mark(self, results):
+        # results: [(entry id, status, code, detail)], written in one journal transaction
+        now = datetime.now().isoformat(timespec="seconds")
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "UPDATE journal SET status = ?, code = ?, detail = ?, applied = ? WHERE id = ?",
+                [(status, code, detail, now, entry_id) for entry_id, status, code, detail in results],
+            )
+            self._conn.execute("COMMIT")
+            for stays in (*self._pending_stays.values(), *self._cancelled_stays.values()):
+                for entry_id, _, _, _ in results:
+                    stays.pop(entry_id, None)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        self._lock_file.close()
+
+
+def apply_batch(conn, journal, entries):
+    # Apply journal entries in order inside one database transaction. Each entry gets a savepoint so
+    # a row the database refuses, or a payload that can't be read, only rejects that entry. If the
+    # connection itself is gone, rolling back to the savepoint fails too and the whole batch is retried.
+    # Returns the (id, status, code, detail) results.
+    cursor = conn.cursor()
+    results, added, removed = [], [], []
+    codes = {}  # entry id -> reservation code, for cancellations of bookings in this batch
+    try:
+        conn.backend.lock_rooms(cursor, [entry["payload"]["room"] for entry in entries if entry["kind"] == "book"])
+        for entry in entries:
+            payload = entry["payload"]
+            cursor.execute("SAVEPOINT journal_entry")
+            try:
+                if entry["kind"] == "book":
+                    result = _apply_booking(conn, entry["id"], payload)
+                    if result[1] == "applied":
+                        codes[entry["id"]] = result[2]
+                        added.append((result[2], payload))
+                else:
+                    code = payload["code"]
+                    if code is None:
+                        code = codes.get(payload["entry"])
+                        if code is None:
+                            booked = journal.entry(payload["entry"])
+                            code = booked["code"] if booked else None
+                    if code is None:
+                        result = (entry["id"], "rejected", None, "booking was never applied")
+                    else:
+                        deleted = statements.execute(conn, "delete_reservation", (code,)).rowcount
+                        result = (entry["id"], "applied", code, None if deleted else "reservation not found")
+                        removed.append(code)
+                cursor.execute("RELEASE SAVEPOINT journal_entry")
+            except db.Error as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT journal_entry")
+                cursor.execute("RELEASE SAVEPOINT journal_entry")
+                result = (entry["id"], "rejected", None, f"database error: {e}")
+            except (KeyError, TypeError, ValueError) as e:
+                cursor.execute("ROLLBACK TO SAVEPOINT journal_entry")
+                cursor.execute("RELEASE SAVEPOINT journal_entry")
+                result = (entry["id"], "rejected", None, f"invalid entry: {e!r}")
+            results.append(result)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    journal.mark(results)
+    for code, payload in added:
+        events.reservation_added(code, payload["room"], date.fromisoformat(payload["checkin"]), date.fromisoformat(payload["checkout"]))
+    for code in removed:
+        events.reservation_removed(code)
+    return results
+
+
+def _apply_booking(conn, entry_id, payload):
+    checkin, checkout = date.fromisoformat(payload["checkin"]), date.fromisoformat(payload["checkout"])
+    overlapping = statements.execute(conn, "overlapping_stays", (payload["room"],) + statements.overlap_params(checkin, checkout)).fetchall()
+    for code, other_in, other_out, last_name, first_name in overlapping:
+        if (str(other_in)[:10], str(other_out)[:10], last_name, first_name) == (
+            payload["checkin"], payload["checkout"], payload["last_name"], payload["first_name"],
+        ):
+            return entry_id, "applied", code, "already in the database (replayed)"
+    if overlapping:
+        return entry_id, "rejected", None, f"room {payload['room']} was booked by reservation {overlapping[0][0]} first"
+    code = statements.execute(conn, "insert_reservation", (
+        payload["room"], checkin, checkout, payload["rate"], payload["last_name"], payload["first_name"],
+        payload["adults"], payload["kids"],
+    )).lastrowid
+    return entry_id, "applied", code, None
+
+
+class Flusher(threading.Thread):
+    # Group commit: wakes on new entries (or every interval), then drains the journal in batches
+    def __init__(self, journal, interval=FLUSH_INTERVAL, batch_size=BATCH_SIZE):
+        super().__init__(name="journal-flusher", daemon=True)
+        self.journal = journal
+        self.interval = interval
+        self.batch_size = batch_size
+        self.last_error = None
+        self._stopping = threading.Event()
+
+    def flush(self):
+        # Apply everything pending; returns the number of entries handled. Raises on database errors.
+        handled = 0
+        while True:
+            entries = self.journal.pending(self.batch_size)
+            if not entries:
+                return handled
+            conn = db.get_pool().get()
+            try:
+                apply_batch(conn, self.journal, entries)
+            except BaseException:
+                conn.discard()
+                raise
+            else:
+                conn.close()
+            handled += len(entries)
+
+    def run(self):
+        backoff = self.interval
+        while not self._stopping.is_set():
+            self.journal.wake.wait(backoff)
+            self.journal.wake.clear()
+            # Let a few more writes arrive so they share the transaction
+            time.sleep(self.interval)
+            try:
+                self.flush()
+                self.last_error, backoff = None, self.interval
+            except Exception as e:
+                # Anything else (a listener, the journal file) is logged and retried as well, so the
+                # thread never dies and leaves entries pending with nobody to apply them
+                if self.last_error is None or type(e) is not type(self.last_error):
+                    print(f"Error: journal flush failed, will retry: {e!r}")
+                self.last_error = e
+                backoff = min(MAX_BACKOFF, max(backoff * 2, 0.1))
+
+    def stop(self, timeout=10):
+        # Stop the thread and make a last attempt to drain; entries still pending stay in the journal
+        self._stopping.set()
+        self.journal.wake.set()
+        self.join(timeout)
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Error: {len(self.journal.pending())} journal entries left pending: {e!r}")
+
+
+_journal = None
+_flusher = None
+_journal_lock = threading.Lock()
+
+
+def get_journal():
+    # Open the journal and start its flusher on first use; pending entries from a crash replay then
+    global _journal, _flusher
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal()
+            _flusher = Flusher(_journal)
+            _flusher.start()
+        return _journal
+
+
+def stop():
+    global _journal, _flusher
+    with _journal_lock:
+        journal, flusher, _journal, _flusher = _journal, _flusher, None, None
+    if journal is not None:
+        flusher.stop()
+        journal.close()
+
+
+def reference(entry_id):
+    return f"J{entry_id}"
+
+
+def parse_reference(value):
+    # "J12" -> 12, anything else -> None
+    value = str(value).strip()
+    if value[:1].upper() == "J" and value[1:].isdigit():
+        return int(value[1:])
+    return None
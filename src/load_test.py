@@ -0,0 +1,162 @@
+import argparse
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, timedelta
+
+import db
+import booking
+import statements
+
+# Reservations in the same room whose stays overlap
+COUNT_DOUBLE_BOOKINGS = """
+SELECT COUNT(*)
+FROM lab7_reservations a
+JOIN lab7_reservations b ON a.Room = b.Room AND a.CODE < b.CODE AND a.CheckIn < b.Checkout AND b.CheckIn < a.Checkout
+"""
+
+
+def count_double_bookings():
+    conn = db.get_db_connection()
+    if conn is None:
+        raise db.PoolError("Failed to connect to the database.")
+    try:
+        cursor = conn.cursor()
+        cursor.execute(COUNT_DOUBLE_BOOKINGS)
+        return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def room_codes():
+    conn = db.get_db_connection()
+    if conn is None:
+        raise db.PoolError("Failed to connect to the database.")
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT RoomCode FROM lab7_rooms ORDER BY RoomCode")
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def naive_book(conn, room, checkin, checkout, rate, last_name, first_name, adults, kids):
+    # The old make_reservation sequence: check, then insert in a separate step. Used with --unsafe for comparison.
+    cursor = conn.cursor()
+    cursor.execute(statements.SQL["find_conflict"], (room,) + statements.overlap_params(checkin, checkout))
+    if cursor.fetchone() is not None:
+        raise booking.RoomUnavailable(room)
+    time.sleep(0.001)  # think time between the two steps, as a human at the prompt would have
+    cursor.execute(statements.SQL["insert_reservation"], (room, checkin, checkout, rate, last_name, first_name, adults, kids))
+    code = cursor.lastrowid
+    conn.commit()
+    cursor.close()
+    return code, 0
+
+
+def look_then_book(book, conn, room, checkin, checkout, *args):
+    # The menu's sequence on one connection: read the room's stays, think, then book. On MySQL the read
+    # pins a REPEATABLE READ snapshot that the booking must not check against.
+    if statements.execute(conn, "overlapping_stays", (room,) + statements.overlap_params(checkin, checkout)).fetchall():
+        raise booking.RoomUnavailable(room)
+    time.sleep(0.005)
+    return book(conn, room, checkin, checkout, *args)
+
+
+def client(client_id, rooms, attempts, start, days, unsafe, seed, hold=False):
+    # One simulated front-desk client making `attempts` random bookings; with `hold` it keeps one
+    # connection for all of them and looks before it books, like a desk at the menu
+    rng = random.Random(seed + client_id)
+    book = naive_book if unsafe else booking.book
+    stats = {"attempts": 0, "booked": 0, "unavailable": 0, "retries": 0, "errors": 0}
+    held = db.get_db_connection() if hold else None
+    try:
+        for _ in range(attempts):
+            checkin = start + timedelta(days=rng.randrange(days))
+            checkout = checkin + timedelta(days=rng.randint(1, 5))
+            stats["attempts"] += 1
+            conn = held or db.get_db_connection()
+            if conn is None:
+                stats["errors"] += 1
+                continue
+            try:
+                args = (conn, rng.choice(rooms), checkin, checkout, 100.0, f"Load{client_id}", "Test", 1, 0)
+                _, retries = look_then_book(book, *args) if hold else book(*args)
+                stats["booked"] += 1
+                stats["retries"] += retries
+            except booking.RoomUnavailable:
+                stats["unavailable"] += 1
+            except db.Error:
+                stats["errors"] += 1
+            finally:
+                if conn is not held:
+                    conn.close()
+    finally:
+        if held is not None:
+            held.close()
+    return stats
+
+
+def _process_worker(first_client, clients, rooms, attempts, start, days, unsafe, seed, pool_size, hold):
+    # Each worker process runs a slice of the clients on its own threads and connection pool
+    db.configure(max_size=pool_size, checkout_timeout=60)
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        futures = [executor.submit(client, first_client + i, rooms, attempts, start, days, unsafe, seed, hold) for i in range(clients)]
+        return [future.result() for future in futures]
+
+
+def run(clients=200, attempts=10, processes=0, pool_size=20, rooms=None, start=None, days=60, unsafe=False, seed=0, hold=False):
+    db.configure(max_size=pool_size, checkout_timeout=60)
+    rooms = rooms or room_codes()
+    start = start or date.today() + timedelta(days=365)
+    before = count_double_bookings()
+
+    began = time.perf_counter()
+    if processes:
+        per_process = [clients // processes + (i < clients % processes) for i in range(processes)]
+        firsts = [sum(per_process[:i]) for i in range(processes)]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [
+                executor.submit(_process_worker, first, count, rooms, attempts, start, days, unsafe, seed, pool_size, hold)
+                for first, count in zip(firsts, per_process)
+            ]
+            results = [stats for future in futures for stats in future.result()]
+    else:
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            futures = [executor.submit(client, i, rooms, attempts, start, days, unsafe, seed, hold) for i in range(clients)]
+            results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - began
+
+    totals = {key: sum(stats[key] for stats in results) for key in results[0]} if results else {}
+    totals["seconds"] = round(elapsed, 3)
+    totals["throughput"] = round(totals.get("attempts", 0) / elapsed, 1) if elapsed else 0.0
+    totals["retry_rate"] = round(totals["retries"] / totals["booked"], 4) if totals.get("booked") else 0.0
+    totals["double_bookings"] = count_double_bookings() - before
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive concurrent simulated booking clients against the database (inserts test reservations; use a scratch database)")
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--attempts", type=int, default=10, help="bookings attempted per client")
+    parser.add_argument("--processes", type=int, default=0, help="spread clients over this many processes (0 = threads only)")
+    parser.add_argument("--pool-size", type=int, default=20, help="connection pool size per process")
+    parser.add_argument("--days", type=int, default=60, help="width of the date window bookings are drawn from")
+    parser.add_argument("--unsafe", action="store_true", help="use the old check-then-insert sequence for comparison")
+    parser.add_argument("--hold", action="store_true", help="each client keeps one connection and reads the room before booking it, like the menu")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    try:
+        totals = run(args.clients, args.attempts, args.processes, args.pool_size, days=args.days, unsafe=args.unsafe, seed=args.seed, hold=args.hold)
+    except (db.PoolError, *db.Error) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    for key, value in totals.items():
+        print(f"{key:<16}{value}")
+    return 1 if totals["double_bookings"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
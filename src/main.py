@@ -1,100 +1,73 @@
 import db
-from datetime import datetime, timedelta
-import mysql.connector
-
-def list_rooms():
+import availability
+import occupancy
+import revenue_engine
+import pricing
+import room_stats
+import events
+import booking
+import search
+import shards
+import journal
+import metrics
+import statements
+import os
+from datetime import date, datetime
+
+@metrics.operation("list_rooms")
+def list_rooms(as_of=None):
     try:
-        conn = db.get_db_connection()
-        if conn is None:
-            print("Failed to connect to the database.")
-            return
+        as_of = as_of or date.today()
+        sharded = shards.enabled()
+        if sharded:
+            # The same statistics from every shard at once, combined per room of each property
+            rooms = shards.room_table(as_of)
+        else:
+            conn = db.get_db_connection()
+            if conn is None:
+                print("Failed to connect to the database.")
+                return
 
-        cursor = conn.cursor()
-
-        # Query to calculate room popularity, next available check-in date, and length of the most recent completed stay
-        query = """
-        WITH Occupancy AS (
-            SELECT
-                Room,
-                SUM(DATEDIFF(LEAST(Checkout, '2024-06-01'), GREATEST(CheckIn, DATE_SUB('2024-06-01', INTERVAL 180 DAY)))) AS occupied_days
-            FROM lab7_reservations
-            WHERE Checkout > DATE_SUB('2024-06-01', INTERVAL 180 DAY)
-            GROUP BY Room
-        ),
-        NextAvailableDate AS (
-            SELECT
-                Room,
-                MIN(CheckIn) AS next_available
-            FROM lab7_reservations
-            WHERE Checkout > '2024-06-01'
-            GROUP BY Room
-        ),
-        RecentStay AS (
-            SELECT
-                Room,
-                DATEDIFF(MAX(Checkout), MAX(CheckIn)) AS recent_stay_length
-            FROM lab7_reservations
-            WHERE Checkout <= '2024-06-01'
-            GROUP BY Room
-        )
-        SELECT
-            r.RoomCode,
-            r.RoomName,
-            r.Beds,
-            r.bedType,
-            r.maxOcc,
-            r.basePrice,
-            r.decor,
-            ROUND(IFNULL(o.occupied_days, 0) / 180, 2) AS popularity_score,
-            IFNULL(n.next_available, '2024-06-01') AS next_available_checkin,
-            IFNULL(rs.recent_stay_length, 0) AS recent_stay_length
-        FROM
-            lab7_rooms r
-            LEFT JOIN Occupancy o ON r.RoomCode = o.Room
-            LEFT JOIN NextAvailableDate n ON r.RoomCode = n.Room
-            LEFT JOIN RecentStay rs ON r.RoomCode = rs.Room
-        ORDER BY
-            popularity_score DESC;
-        """
-
-        cursor.execute(query)
-        rooms = cursor.fetchall()
+            cursor = conn.cursor()
 
+            # Room popularity (last 180 nights), next available check-in date and length of the most recent
+            # completed stay, read from incrementally maintained per-room statistics
+            rooms = room_stats.get_stats(cursor).table(as_of)
+            cursor.close()
+            conn.close()
+
+        print(f"{'Property':<16}" if sharded else "", end="")
         print(f"{'RoomCode':<10}{'RoomName':<30}{'Beds':<5}{'BedType':<10}{'MaxOcc':<7}{'BasePrice':<10}{'Decor':<15}{'Popularity':<12}{'NextCheckIn':<15}{'LastStayLength'}")
-        print("="*140)
+        print("="*(156 if sharded else 140))
         for room in rooms:
-            print(f"{room[0]:<10}{room[1]:<30}{room[2]:<5}{room[3]:<10}{room[4]:<7}{room[5]:<10}{room[6]:<15}{room[7]:<12}{room[8]:<15}{room[9]}")
-
-        cursor.close()
-        conn.close()
-    except mysql.connector.Error as err:
+            if sharded:
+                print(f"{room[10] or '':<16}", end="")
+            print(f"{room[0]:<10}{room[1]:<30}{room[2]:<5}{room[3]:<10}{room[4]:<7}{room[5]:<10}{room[6]:<15}{room[7]:<12}{str(room[8]):<15}{room[9]}")
+    except db.Error as err:
         print(f"Error: {err}")
     except Exception as e:
         print(f"Unexpected error: {e}")
 
-def calculate_total_cost(begin_date, end_date, base_rate):
-    begin_date = datetime.strptime(begin_date, "%Y-%m-%d")
-    end_date = datetime.strptime(end_date, "%Y-%m-%d")
-    total_cost = 0.0
-    current_date = begin_date
-    base_rate = float(base_rate)  # Convert base_rate to float
-
-    while current_date < end_date:
-        if current_date.weekday() < 5:  # Weekday
-            total_cost += base_rate
-        else:  # Weekend
-            total_cost += base_rate * 1.1
-        current_date += timedelta(days=1)
+def close_connection(conn, cursor):
+    # Sharded runs (INN_SHARDS) work through the shards' own connections and have none to close
+    if conn is not None:
+        cursor.close()
+        conn.close()
 
-    return round(total_cost, 2)
+def calculate_total_cost(begin_date, end_date, base_rate):
+    # Weekday and weekend nights are counted arithmetically; weekends cost 10% more
+    return pricing.stay_cost(begin_date, end_date, base_rate)
 
+@metrics.operation("make_reservation")
 def make_reservation():
     try:
-        conn = db.get_db_connection()
-        if conn is None:
+        # With shards every lookup fans out and the booking goes to the shard that owns the room
+        sharded = shards.enabled()
+        conn = None if sharded else db.get_db_connection()
+        if conn is None and not sharded:
             print("Failed to connect to the database.")
             return
-        cursor = conn.cursor()
+        cursor = None if sharded else conn.cursor()
 
         first_name = input("Enter first name: ")
         last_name = input("Enter last name: ")
@@ -104,147 +77,91 @@ def make_reservation():
         end_date = input("Enter end date of stay (YYYY-MM-DD): ")
         num_children = int(input("Enter number of children: "))
         num_adults = int(input("Enter number of adults: "))
+        try:
+            booking.check_stay(begin_date, end_date)
+        except booking.InvalidStay as e:
+            print(f"Error: {e}.")
+            close_connection(conn, cursor)
+            return
 
         total_guests = num_children + num_adults
 
         # Check if the requested person count exceeds the maximum capacity of any room
-        cursor.execute("SELECT MAX(maxOcc) FROM lab7_rooms")
-        max_capacity = cursor.fetchone()[0]
+        max_capacity = shards.max_occupancy() if sharded else statements.fetch(conn, "max_occupancy")[0][0]
         if total_guests > max_capacity:
             print("No suitable rooms are available for the requested number of guests.")
+            close_connection(conn, cursor)
             return
 
-        # Query to find available rooms based on user input
-        query = f"""
-        WITH InputParameters AS (
-            SELECT
-                '{begin_date}' AS user_checkin,
-                '{end_date}' AS user_checkout,
-                '{bed_type}' AS user_bedtype,
-                {total_guests} AS user_max_occ,
-                {num_adults} AS user_adults,
-                {num_children} AS user_children
-        ),
-        AvailableRooms AS (
-            SELECT
-                r.RoomCode,
-                r.RoomName,
-                r.Beds,
-                r.bedType,
-                r.maxOcc,
-                r.basePrice,
-                r.decor
-            FROM
-                lab7_rooms r
-            LEFT JOIN
-                lab7_reservations res
-            ON
-                r.RoomCode = res.Room
-            AND (
-                (res.CheckIn <= (SELECT user_checkin FROM InputParameters) AND res.Checkout > (SELECT user_checkin FROM InputParameters)) OR
-                (res.CheckIn < (SELECT user_checkout FROM InputParameters) AND res.Checkout >= (SELECT user_checkout FROM InputParameters)) OR
-                (res.CheckIn >= (SELECT user_checkin FROM InputParameters) AND res.Checkout <= (SELECT user_checkout FROM InputParameters))
-            )
-            WHERE
-                res.Room IS NULL
-                AND (r.RoomCode = '{room_code}' OR '{room_code}' = 'Any')
-                AND (r.bedType = (SELECT user_bedtype FROM InputParameters) OR '{bed_type}' = 'Any')
-                AND r.maxOcc >= (SELECT user_max_occ FROM InputParameters)
-        )
-        SELECT
-            ROW_NUMBER() OVER (ORDER BY RoomCode) AS RoomNumber,
-            RoomCode,
-            RoomName,
-            Beds,
-            bedType,
-            maxOcc,
-            basePrice,
-            decor
-        FROM
-            AvailableRooms;
-        """
-
-        cursor.execute(query)
-        rooms = cursor.fetchall()
+        # Find available rooms from the in-memory interval index instead of scanning lab7_reservations
+        if sharded:
+            available = shards.free_rooms(begin_date, end_date, bed_type, total_guests, room_code)
+        else:
+            available = availability.get_index(cursor).free_rooms(begin_date, end_date, bed_type, total_guests, room_code)
+        rooms = [(number,) + room for number, room in enumerate(available, 1)]
+
+        stays = [(begin_date, end_date)] * len(rooms)
 
         if not rooms:
-            # Suggest alternative rooms if no exact match is found
+            # Suggest rooms that hold the party on the requested dates or the nearest free dates within a week,
+            # read from the in-memory occupancy bitmap
             print("No exact matches found. Suggesting 5 alternatives...")
-            alternative_query = f"""
-            WITH InputParameters AS (
-                SELECT
-                    '{begin_date}' AS user_checkin,
-                    '{end_date}' AS user_checkout,
-                    '{bed_type}' AS user_bedtype,
-                    {total_guests} AS user_max_occ,
-                    {num_adults} AS user_adults,
-                    {num_children} AS user_children
-            ),
-            AlternativeRooms AS (
-                SELECT
-                    r.RoomCode,
-                    r.RoomName,
-                    r.Beds,
-                    r.bedType,
-                    r.maxOcc,
-                    r.basePrice,
-                    r.decor,
-                    LEAST(ABS(r.maxOcc - (SELECT user_max_occ FROM InputParameters)), ABS(r.Beds - (SELECT user_max_occ FROM InputParameters))) AS similarity
-                FROM
-                    lab7_rooms r
-                WHERE
-                    r.maxOcc >= (SELECT user_max_occ FROM InputParameters)
-                ORDER BY
-                    similarity ASC
-                LIMIT 5
-            )
-            SELECT
-                ROW_NUMBER() OVER (ORDER BY RoomCode) AS RoomNumber,
-                RoomCode,
-                RoomName,
-                Beds,
-                bedType,
-                maxOcc,
-                basePrice,
-                decor
-            FROM
-                AlternativeRooms;
-            """
-
-            cursor.execute(alternative_query)
-            rooms = cursor.fetchall()
-
-        print(f"{'No':<5}{'RoomCode':<10}{'RoomName':<30}{'Beds':<5}{'BedType':<10}{'MaxOcc':<7}{'BasePrice':<10}{'Decor'}")
-        print("="*90)
-        for room in rooms:
-            print(f"{room[0]:<5}{room[1]:<10}{room[2]:<30}{room[3]:<5}{room[4]:<10}{room[5]:<7}{room[6]:<10}{room[7]}")
+            if sharded:
+                suggestions = shards.suggest(begin_date, end_date, total_guests, bed_type, earliest=date.today())
+            else:
+                suggestions = occupancy.get_matrix(cursor).suggest(begin_date, end_date, total_guests, bed_type, earliest=date.today())
+            rooms = [(number,) + room for number, (room, _, _) in enumerate(suggestions, 1)]
+            stays = [(checkin, checkout) for _, checkin, checkout in suggestions]
+
+        # Quote the whole stay for every candidate room in one pass
+        quotes = pricing.quote_batch([stay[0] for stay in stays], [stay[1] for stay in stays], [room[6] for room in rooms]) if rooms else []
+
+        # Sharded rooms carry their property: two properties may both have the RoomCode
+        print(f"{'No':<5}" + (f"{'Property':<16}" if sharded else ""), end="")
+        print(f"{'RoomCode':<10}{'RoomName':<30}{'Beds':<5}{'BedType':<10}{'MaxOcc':<7}{'BasePrice':<10}{'CheckIn':<12}{'CheckOut':<12}{'TotalCost':<11}{'Decor'}")
+        print("="*(141 if sharded else 125))
+        for room, stay, quote in zip(rooms, stays, quotes):
+            print(f"{room[0]:<5}" + (f"{room[8] or '':<16}" if sharded else ""), end="")
+            print(f"{room[1]:<10}{room[2]:<30}{room[3]:<5}{room[4]:<10}{room[5]:<7}{room[6]:<10}{str(stay[0]):<12}{str(stay[1]):<12}{quote:<11.2f}{room[7]}")
 
         if rooms:
             choice = input("Enter the number of the room you want to book or 'cancel' to return to the main menu: ")
             if choice.lower() == 'cancel':
+                close_connection(conn, cursor)
                 return
 
             selected_room = rooms[int(choice) - 1]
-
-            # Calculate the total cost of the stay
-            total_cost = calculate_total_cost(begin_date, end_date, selected_room[6])
-
-            # Insert the reservation into the database
-            cursor.execute("""
-            INSERT INTO lab7_reservations (Room, CheckIn, Checkout, Rate, LastName, FirstName, Adults, Kids)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (selected_room[1], begin_date, end_date, total_cost, last_name, first_name, num_adults, num_children))
-
-            conn.commit()
-
-            # Get the reservation code of the newly inserted reservation
-            reservation_code = cursor.lastrowid
+            begin_date, end_date = stays[int(choice) - 1]
+            total_cost = float(quotes[int(choice) - 1])
+
+            # Book under a per-room lock; the index only knows this process's bookings, so the room is re-checked.
+            # With the local journal the booking is confirmed once it is on disk and reaches the database shortly after.
+            try:
+                if sharded:
+                    shard, code = shards.book(selected_room[1], begin_date, end_date, total_cost, last_name, first_name, num_adults, num_children, selected_room[8])
+                    reservation_code = shards.format_code(shard, code)
+                elif journal.enabled():
+                    entry_id = journal.get_journal().book(selected_room[1], begin_date, end_date, total_cost, last_name, first_name, num_adults, num_children)
+                    reservation_code = f"{journal.reference(entry_id)} (pending; use it to cancel until the reservation code is assigned)"
+                else:
+                    reservation_code, _ = booking.book(conn, selected_room[1], begin_date, end_date, total_cost, last_name, first_name, num_adults, num_children)
+            except booking.RoomUnavailable:
+                print("Sorry, that room was just booked for those dates. Please try again.")
+                close_connection(conn, cursor)
+                return
+            except LookupError as e:
+                # Sharded: no shard of the property holds the room for that year any more
+                print(f"Error: {e}.")
+                close_connection(conn, cursor)
+                return
 
             # Confirmation screen
             print("\nReservation Confirmation:")
             print(f"Reservation code: {reservation_code}")
             print(f"First name: {first_name}")
             print(f"Last name: {last_name}")
+            if sharded and selected_room[8]:
+                print(f"Property: {selected_room[8]}")
             print(f"Room code: {selected_room[1]}")
             print(f"Room name: {selected_room[2]}")
             print(f"Bed type: {selected_room[4]}")
@@ -254,35 +171,34 @@ def make_reservation():
             print(f"Number of children: {num_children}")
             print(f"Total cost of stay: ${total_cost} \n ")
 
-        cursor.close()
-        conn.close()
-    except mysql.connector.Error as err:
+        close_connection(conn, cursor)
+    except db.Error as err:
         print(f"Error: {err}")
     except Exception as e:
         print(f"Unexpected error: {e}")
 
+@metrics.operation("cancel_reservation")
 def cancel_reservation():
     try:
+        reservation_code = input("Enter the reservation code: ")
+
+        # Journal references (J<id>) are looked up in the local journal, no database needed
+        entry_id = journal.parse_reference(reservation_code) if journal.enabled() else None
+        if entry_id is not None:
+            cancel_journaled(entry_id)
+            return
+        if shards.enabled():
+            cancel_sharded(reservation_code)
+            return
+
         conn = db.get_db_connection()
         if conn is None:
             print("Failed to connect to the database.")
             return
-        cursor = conn.cursor()
 
-        reservation_code = input("Enter the reservation code: ")
-
-        # Query to check if the reservation exists
-        query = """
-        SELECT 
-            CODE, Room, CheckIn, Checkout, LastName, FirstName 
-        FROM 
-            lab7_reservations 
-        WHERE 
-            CODE = %s
-        """
-
-        cursor.execute(query, (reservation_code,))
-        reservation = cursor.fetchone()
+        # Check if the reservation exists
+        rows = statements.execute(conn, "reservation", (reservation_code,)).fetchall()
+        reservation = rows[0] if rows else None
 
         if reservation:
             # Confirm the reservation details
@@ -296,146 +212,174 @@ def cancel_reservation():
             confirm = input("Do you want to cancel this reservation? (yes/no): ")
             if confirm.lower() == 'yes':
                 # Delete the reservation
-                delete_query = "DELETE FROM lab7_reservations WHERE CODE = %s"
-                cursor.execute(delete_query, (reservation[0],))
-                conn.commit()
-                print("Reservation cancelled successfully.\n")
+                if journal.enabled():
+                    journal.get_journal().cancel(code=reservation[0], stay=reservation[1:4])
+                    print("Cancellation recorded; it will reach the database shortly.\n")
+                else:
+                    statements.execute(conn, "delete_reservation", (reservation[0],))
+                    conn.commit()
+                    events.reservation_removed(reservation[0])
+                    print("Reservation cancelled successfully.\n")
             else:
                 print("Reservation cancellation aborted.")
         else:
             print("No reservation found with the given code.")
 
-        cursor.close()
         conn.close()
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Error: {err}")
     except Exception as e:
         print(f"Unexpected error: {e}")
 
+def cancel_journaled(entry_id):
+    entry = journal.get_journal().entry(entry_id)
+    if entry is None or entry["kind"] != "book":
+        print("No reservation found with the given code.")
+        return
+    booked = entry["payload"]
+    print("\nReservation Details:")
+    print(f"Journal reference: {journal.reference(entry_id)} ({entry['status']})")
+    if entry["code"] is not None:
+        print(f"Reservation ID: {entry['code']}")
+    print(f"Room code: {booked['room']}")
+    print(f"Check-in date: {booked['checkin']}")
+    print(f"Check-out date: {booked['checkout']}")
+    print(f"Guest name: {booked['first_name']} {booked['last_name']}")
+    if entry["status"] == "rejected":
+        print(f"This booking was not accepted by the database: {entry['detail']}")
+        return
+
+    confirm = input("Do you want to cancel this reservation? (yes/no): ")
+    if confirm.lower() == 'yes':
+        journal.get_journal().cancel(code=entry["code"], entry=entry_id)
+        print("Cancellation recorded; it will reach the database shortly.\n")
+    else:
+        print("Reservation cancellation aborted.")
+
+def cancel_sharded(reservation_code):
+    # <shard>:<code>, or a bare code when only one shard has it
+    try:
+        found = shards.find_reservation(reservation_code)
+    except ValueError:
+        found = None
+    except LookupError as e:
+        print(e)
+        return
+    if found is None:
+        print("No reservation found with the given code.")
+        return
+    shard, reservation = found
+    print("\nReservation Details:")
+    print(f"Reservation ID: {shards.format_code(shard, reservation[0])}")
+    print(f"Room code: {reservation[1]}")
+    print(f"Check-in date: {reservation[2]}")
+    print(f"Check-out date: {reservation[3]}")
+    print(f"Guest name: {reservation[5]} {reservation[4]}")
+
+    confirm = input("Do you want to cancel this reservation? (yes/no): ")
+    if confirm.lower() == 'yes':
+        shards.cancel(shard, reservation[0])
+        print("Reservation cancelled successfully.\n")
+    else:
+        print("Reservation cancellation aborted.")
+
+@metrics.operation("detailed_reservation_info")
 def d_r_i(): 
     try:
-        conn = db.get_db_connection()
-        if conn is None:
+        # With shards every page is read from all of them at once and merged
+        sharded = shards.enabled()
+        conn = None if sharded else db.get_db_connection()
+        if conn is None and not sharded:
             print("Failed to connect to the database.")
             return
-        cursor = conn.cursor()
 
+        print("Leave a field blank to match anything. Names and rooms accept * and ? wildcards (e.g. Jo*).")
+        print("With no code, room, dates or name prefix (only patterns like *son, or nothing), every reservation is read.")
         first_name = input("Enter first name: ")
         last_name = input("Enter last name: ")
         reservation_code = input("Enter reservation code: ")
         room_code = input("Enter room code: ")
         begin_date = input("Enter begin date of stay (YYYY-MM-DD): ")
         end_date = input("Enter end date of stay (YYYY-MM-DD): ")
+        try:
+            if reservation_code:
+                shards.parse_code(reservation_code) if sharded else int(reservation_code)
+            for day in (begin_date, end_date):
+                if day:
+                    date.fromisoformat(day)
+        except ValueError:
+            print("Error: The reservation code must be a number and dates must be YYYY-MM-DD.")
+            if conn is not None:
+                conn.close()
+            return
 
-        # Query to find available rooms based on user input
-        query = f"""
-        SELECT 
-            CODE,
-            Room,
-            CheckIn,
-            Checkout,
-            Rate,
-            LastName,
-            Firstname,
-            Adults,
-            Kids,
-            RoomName
-        FROM
-             lab7_reservations
-        INNER JOIN lab7_rooms ON Room = RoomCode
-        WHERE
-            (FirstName LIKE '{first_name}' OR '{first_name}' = '')
-            AND (LastName LIKE '{last_name}' OR '{last_name}' = '')
-            AND (CODE LIKE '{reservation_code}' OR '{reservation_code}' = '')
-            AND (Room LIKE '{room_code}' OR '{room_code}' = '')
-            AND CheckIn = '{begin_date}'
-            AND CheckOut = '{end_date}'
-        """
-        cursor.execute(query)
-        reservations = cursor.fetchall()
-
-        if reservations:
-            print(f"{'CODE':<12}{'Room':<6}{'CheckIn':<12}{'CheckOut':<12}{'Rate':<9}{'LastName':<16}{'FirstName':<16}{'Adults':<12}{'Kids':<12}{'RoomName':<31}")
-            print("="*138)
+        # Stays overlapping the given dates, one page at a time
+        after = None if sharded else 0
+        found = False
+        while True:
+            if sharded:
+                reservations, after = shards.search(first_name, last_name, reservation_code, room_code, begin_date, end_date, after)
+            else:
+                reservations, after = search.search(conn, first_name, last_name, reservation_code, room_code, begin_date, end_date, after)
+            if not reservations:
+                break
+            if not found:
+                print(f"{'Shard':<16}" if sharded else "", end="")
+                print(f"{'CODE':<12}{'Room':<6}{'CheckIn':<12}{'CheckOut':<12}{'Rate':<9}{'LastName':<16}{'FirstName':<16}{'Adults':<12}{'Kids':<12}{'RoomName':<31}")
+                print("="*(154 if sharded else 138))
+                found = True
             for reservation in reservations:
-                print(f"{reservation[0]:<12}{reservation[1]:<6}{begin_date:<12}{end_date:<12}{reservation[4]:<9}{reservation[5]:<16}{reservation[6]:<16}{reservation[7]:<12}{reservation[8]:<12}{reservation[9]:<31}")
-        else:
+                if sharded:
+                    print(f"{reservation[0]:<16}", end="")
+                    reservation = reservation[1:]
+                print(f"{reservation[0]:<12}{reservation[1]:<6}{str(reservation[2]):<12}{str(reservation[3]):<12}{reservation[4]:<9}{reservation[5]:<16}{reservation[6]:<16}{reservation[7]:<12}{reservation[8]:<12}{reservation[9]:<31}")
+            if after is None or input("Show more results? (yes/no): ").lower() != 'yes':
+                break
+
+        if not found:
             print("Reservation not found.")
 
-        cursor.close()
-        conn.close()
-    except mysql.connector.Error as err:
+        if conn is not None:
+            conn.close()
+    except db.Error as err:
         print(f"Error: {err}")
     except Exception as e:
         print(f"Unexpected error: {e}")
 
+@metrics.operation("revenue")
 def revenue(): 
     try:
-        conn = db.get_db_connection()
-        if conn is None:
-            print("Failed to connect to the database.")
-            return
-        cursor = conn.cursor()
-
-        # Query to find available rooms based on user input
-        query = f"""
-        SELECT 
-            Room,
-            CheckIn,
-            Checkout,
-            Rate
-        FROM
-             lab7_reservations
-        WHERE YEAR(CheckIn) = YEAR(CURDATE())
-        ORDER BY Room
-        """
-        cursor.execute(query)
-        reservations = cursor.fetchall()
+        # This year's stays, by check-in date; with shards, from every shard holding this year at once
+        current_year = datetime.now().year
+        period = (date(current_year, 1, 1), date(current_year + 1, 1, 1))
+        if shards.enabled():
+            reservations = shards.fetch("reservations_checking_in", period, (current_year, current_year), by_property=True)
+        else:
+            conn = db.get_db_connection()
+            if conn is None:
+                print("Failed to connect to the database.")
+                return
+            reservations = statements.fetch(conn, "reservations_checking_in", period)
+            conn.close()
         if reservations:
-            monthly_revenue = {}
-
-            # Generate a list of months for the current year
-            current_year = datetime.now().year
-            months = [(current_year, month) for month in range(1, 13)]
-
-            # Initialize the revenue dictionary for each room and each month
-            for room in set(reservation[0] for reservation in reservations):
-                monthly_revenue[room] = {month: 0 for _, month in months}
-
-            # Function to generate dates between two dates
-            def daterange(start_date, end_date):
-                for n in range(int((end_date - start_date).days)):
-                    yield start_date + timedelta(n)
-
-            # Process each reservation
-            for reservation in reservations:
-                room = reservation[0]
-                checkin = reservation[1]
-                checkout = reservation[2]
-                rate = reservation[3]
-                
-                # Generate daily revenue
-                for single_date in daterange(checkin, checkout):
-                    year_month = (single_date.year, single_date.month)
-                    if single_date.year == current_year:
-                        monthly_revenue[room][year_month[1]] += rate
+            # Split each stay across month boundaries with the vectorized revenue engine
+            monthly_revenue = revenue_engine.monthly_revenue(reservations, current_year)
 
             # Print the results
-            print(f"{'CODE':<8}{'January':<10}{'February':<10}{'March':<10}{'April':<10}{'May':<10}{'June':<10}{'July':<10}{'August':<10}{'September':<10}{'October':<10}{'November':<10}{'December':<10}{'Total':<10}")
+            # Room labels carry the property with shards ("North/R0001")
+            width = max([5] + [len(str(room)) + 1 for room in monthly_revenue])
+            print(f"{'CODE':<{max(8, width)}}{'January':<10}{'February':<10}{'March':<10}{'April':<10}{'May':<10}{'June':<10}{'July':<10}{'August':<10}{'September':<10}{'October':<10}{'November':<10}{'December':<10}{'Total':<10}")
             print("="*137)
             for room, revenue in monthly_revenue.items():
                 total_revenue = sum(revenue[month] for month in range(1, 13))
-                print(f"{room:<5}", end="")
+                print(f"{room:<{width}}", end="")
                 for month in range(1, 13):
                     print(f"{revenue[month]:^10.0f}", end="")
                 print(f"{total_revenue:^11.0f}")
 
         else:
             print("No Reservations made this year.")
-
-        cursor.close()
-        conn.close()
-    except mysql.connector.Error as err:
+    except db.Error as err:
         print(f"Error: {err}")
     except Exception as e:
         print(f"Unexpected error: {e}")       
@@ -466,5 +410,12 @@ def main():
         else:
             print("Invalid choice. Please try again.")
 
+    # Push any journaled bookings and cancellations to the database before leaving
+    journal.stop()
+
+    # With INN_METRICS=1, INN_METRICS_FILE receives the statement/operation metrics and slow-query log
+    if metrics.enabled() and os.getenv("INN_METRICS_FILE"):
+        metrics.write(os.getenv("INN_METRICS_FILE"))
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,350 @@
+import inspect
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from functools import wraps
+
+import db
+
+# Query instrumentation. Once enabled (INN_METRICS=1 or metrics.enable()), every cursor handed out by
+# db.get_db_connection() records per-statement latency and rows, and the user operation it ran under
+# (see operation()) counts its database round trips. Statements slower than INN_SLOW_QUERY_MS go to a
+# slow-query log together with their EXPLAIN plan. dump_json() / dump_prometheus() export everything.
+
+SLOW_QUERY_MS = float(os.getenv("INN_SLOW_QUERY_MS", "100"))
+SLOW_LOG_SIZE = 100
+LABEL_LENGTH = 160
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r"\s+")
+_IN_LISTS = re.compile(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))+\s*\)")
+_EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE", "REPLACE")
+
+
+def fingerprint(sql):
+    # Same statement shape -> same key, whatever literals were inlined
+    # and however many values an IN (...) list was given
+    return _SPACES.sub(" ", _IN_LISTS.sub("(...)", _LITERALS.sub("?", sql))).strip()
+
+
+class Registry:
+    def __init__(self, slow_query_ms=SLOW_QUERY_MS, slow_log_size=SLOW_LOG_SIZE):
+        self.slow_query_ms = slow_query_ms
+        self.statements = {}  # fingerprint -> counters
+        self.operations = {}  # operation name -> counters
+        self.slow_log = deque(maxlen=slow_log_size)
+        self._lock = threading.Lock()
+
+    def record_statement(self, sql, seconds, rows, operation=None, error=False):
+        key = fingerprint(sql)
+        with self._lock:
+            stats = self.statements.get(key)
+            if stats is None:
+                stats = self.statements[key] = {"calls": 0, "errors": 0, "rows": 0, "seconds": 0.0, "max_seconds": 0.0}
+            stats["calls"] += 1
+            stats["errors"] += error
+            stats["rows"] += max(rows, 0)
+            stats["seconds"] += seconds
+            stats["max_seconds"] = max(stats["max_seconds"], seconds)
+        if operation is not None:
+            operation.round_trips += 1
+            operation.rows += max(rows, 0)
+            operation.db_seconds += seconds
+
+    def record_operation(self, operation):
+        with self._lock:
+            stats = self.operations.get(operation.name)
+            if stats is None:
+                stats = self.operations[operation.name] = {
+                    "calls": 0, "errors": 0, "seconds": 0.0, "db_seconds": 0.0, "round_trips": 0, "max_round_trips": 0, "rows": 0,
+                }
+            stats["calls"] += 1
+            stats["errors"] += operation.failed
+            stats["seconds"] += operation.seconds
+            stats["db_seconds"] += operation.db_seconds
+            stats["round_trips"] += operation.round_trips
+            stats["max_round_trips"] = max(stats["max_round_trips"], operation.round_trips)
+            stats["rows"] += operation.rows
+
+    def record_slow(self, sql, params, seconds, rows, operation, plan):
+        entry = {
+            "at": datetime.now().isoformat(timespec="seconds"),
+            "operation": operation.name if operation else None,
+            "ms": round(seconds * 1000, 3),
+            "rows": rows,
+            "sql": _SPACES.sub(" ", sql).strip(),
+            "params": [str(param) for param in params or ()],
+            "plan": plan,
+        }
+        with self._lock:
+            self.slow_log.append(entry)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "statements": {sql: dict(stats) for sql, stats in self.statements.items()},
+                "operations": {name: dict(stats) for name, stats in self.operations.items()},
+                "slow_queries": list(self.slow_log),
+                "result_cache": db.cache_stats(),
+            }
+
+    def clear(self):
+        with self._lock:
+            self.statements.clear()
+            self.operations.clear()
+            self.slow_log.clear()
+
+
+class Operation:
+    __slots__ = ("name", "round_trips", "rows", "db_seconds", "seconds", "failed")
+
+    def __init__(self, name):
+        self.name = name
+        self.round_trips = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.seconds = 0.0
+        self.failed = False
+
+
+registry = Registry()
+_current = ContextVar("inn_operation", default=None)
+_enabled = False
+
+
+class InstrumentedCursor:
+    # Times each statement from execute() until its rows are read (or the next statement / close),
+    # since an unbuffered MySQL cursor does most of its work inside the fetch calls
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+        self._pending = None  # [sql, params, seconds, rows, operation]
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def execute(self, sql, params=()):
+        self._finish()
+        operation = _current.get()
+        began = time.perf_counter()
+        try:
+            self._cursor.execute(sql, params)
+        except BaseException:
+            registry.record_statement(sql, time.perf_counter() - began, 0, operation, error=True)
+            raise
+        self._pending = [sql, params, time.perf_counter() - began, 0, operation]
+        if self._cursor.description is None:
+            # No result set (INSERT, DELETE, BEGIN...): finished already
+            self._pending[3] = self._cursor.rowcount
+            self._finish()
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._finish()
+        began = time.perf_counter()
+        error = True
+        try:
+            result = self._cursor.executemany(sql, seq_of_params)
+            error = False
+            return result
+        finally:
+            registry.record_statement(sql, time.perf_counter() - began, 0 if error else self._cursor.rowcount, _current.get(), error)
+
+    def _fetch(self, fetch, *args):
+        began = time.perf_counter()
+        try:
+            return fetch(*args)
+        finally:
+            if self._pending is not None:
+                self._pending[2] += time.perf_counter() - began
+
+    def fetchone(self):
+        row = self._fetch(self._cursor.fetchone)
+        if self._pending is not None:
+            if row is None:
+                self._finish()
+            else:
+                self._pending[3] += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            if not rows:
+                self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._fetch(self._cursor.fetchall)
+        if self._pending is not None:
+            self._pending[3] += len(rows)
+            self._finish()
+        return rows
+
+    def close(self):
+        try:
+            return self._cursor.close()
+        finally:
+            self._finish()
+
+    def _finish(self):
+        if self._pending is None:
+            return
+        sql, params, seconds, rows, operation = self._pending
+        self._pending = None
+        registry.record_statement(sql, seconds, rows, operation)
+        if seconds * 1000 >= registry.slow_query_ms:
+            registry.record_slow(sql, params, seconds, rows, operation, explain(self._connection, sql, params))
+
+
+def explain(connection, sql, params=()):
+    # Query plan as a list of rows (MySQL EXPLAIN / SQLite EXPLAIN QUERY PLAN); None if it can't be explained
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return None
+    cursor = None
+    try:
+        cursor = connection.raw.cursor()
+        cursor.execute(connection.backend.explain_prefix + connection.rename(sql), params)
+        columns = [column[0] for column in cursor.description or ()]
+        return [dict(zip(columns, (value if isinstance(value, (int, float)) or value is None else str(value) for value in row))) for row in cursor.fetchall()]
+    except (*db.Error, db.PoolError):
+        return None
+    finally:
+        if cursor is not None:
+            try:
+                cursor.close()
+            except db.Error:
+                pass
+
+
+def enable(slow_query_ms=None):
+    global _enabled
+    if slow_query_ms is not None:
+        registry.slow_query_ms = slow_query_ms
+    _enabled = True
+    db.set_cursor_wrapper(InstrumentedCursor)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    db.set_cursor_wrapper(None)
+
+
+def enabled():
+    return _enabled
+
+
+def operation(name):
+    # Decorator naming a user operation; statements run while it is active count as its round trips.
+    # Nested operations are folded into the outermost one. Works on generator functions too.
+    def decorator(func):
+        if inspect.isgeneratorfunction(func):
+            @wraps(func)
+            def generator(*args, **kwargs):
+                if not _enabled or _current.get() is not None:
+                    yield from func(*args, **kwargs)
+                    return
+                op = Operation(name)
+                rows = func(*args, **kwargs)
+                try:
+                    while True:
+                        # Re-entered on every next(), possibly from another thread
+                        token = _current.set(op)
+                        began = time.perf_counter()
+                        try:
+                            item = next(rows)
+                        except StopIteration:
+                            break
+                        except BaseException:
+                            op.failed = True
+                            raise
+                        finally:
+                            op.seconds += time.perf_counter() - began
+                            _current.reset(token)
+                        yield item
+                finally:
+                    rows.close()
+                    registry.record_operation(op)
+            return generator
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled or _current.get() is not None:
+                return func(*args, **kwargs)
+            op = Operation(name)
+            token = _current.set(op)
+            began = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except BaseException:
+                op.failed = True
+                raise
+            finally:
+                op.seconds = time.perf_counter() - began
+                _current.reset(token)
+                registry.record_operation(op)
+        return wrapper
+    return decorator
+
+
+def dump_json(indent=None):
+    return json.dumps(registry.snapshot(), indent=indent)
+
+
+def _label(value):
+    value = value if len(value) <= LABEL_LENGTH else value[:LABEL_LENGTH - 3] + "..."
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def dump_prometheus():
+    snapshot = registry.snapshot()
+    lines = []
+    series = [
+        ("inn_statement_calls_total", "counter", "Statements executed", "statements", "statement", "calls"),
+        ("inn_statement_errors_total", "counter", "Statements that raised", "statements", "statement", "errors"),
+        ("inn_statement_rows_total", "counter", "Rows returned or affected", "statements", "statement", "rows"),
+        ("inn_statement_seconds_total", "counter", "Time spent executing and fetching", "statements", "statement", "seconds"),
+        ("inn_statement_max_seconds", "gauge", "Slowest single execution", "statements", "statement", "max_seconds"),
+        ("inn_operation_calls_total", "counter", "User operations run", "operations", "operation", "calls"),
+        ("inn_operation_errors_total", "counter", "User operations that raised", "operations", "operation", "errors"),
+        ("inn_operation_seconds_total", "counter", "Wall time spent in user operations", "operations", "operation", "seconds"),
+        ("inn_operation_db_seconds_total", "counter", "Database time spent in user operations", "operations", "operation", "db_seconds"),
+        ("inn_operation_round_trips_total", "counter", "Statements issued by user operations", "operations", "operation", "round_trips"),
+        ("inn_operation_max_round_trips", "gauge", "Most statements issued by one call", "operations", "operation", "max_round_trips"),
+    ]
+    for metric, kind, description, section, label, field in series:
+        lines.append(f"# HELP {metric} {description}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for key, stats in sorted(snapshot[section].items()):
+            lines.append(f'{metric}{{{label}="{_label(key)}"}} {stats[field]}')
+    cache = db.cache_stats()
+    if cache is not None:
+        for field, kind, description in (("hits", "counter", "Reads served from the result cache"), ("misses", "counter", "Reads that went to the database"), ("entries", "gauge", "Cached results")):
+            metric = f"inn_result_cache_{field}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {kind}")
+            lines.append(f"{metric} {cache[field]}")
+    lines.append("# HELP inn_slow_queries Entries in the slow-query log")
+    lines.append("# TYPE inn_slow_queries gauge")
+    lines.append(f"inn_slow_queries {len(snapshot['slow_queries'])}")
+    return "\n".join(lines) + "\n"
+
+
+def write(path):
+    # .prom / .txt files get Prometheus text, anything else JSON
+    with open(path, "w") as out:
+        out.write(dump_prometheus() if path.endswith((".prom", ".txt")) else dump_json(indent=2))
+
+
+if os.getenv("INN_METRICS", "").lower() in ("1", "true", "yes"):
+    enable()
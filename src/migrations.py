@@ -0,0 +1,336 @@
+import argparse
+import re
+import sys
+from datetime import date, datetime
+
+import db
+import metrics
+import reports
+import reservation_store
+import search
+import shards
+import statements
+
+# Schema and indexes for both backends, applied in order and recorded in inn_schema_migrations so
+# each runs once per table set. check_plans() EXPLAINs every lookup the application runs and reports
+# the ones that read a whole table or, on SQLite, walk an index range that is open at one end (a
+# "rowid>?" walk or "CheckIn<?" reads everything on that side); run it against a database with
+# realistic data (python src/migrations.py --check), since planners happily scan tables of a few rows.
+#
+# The filters are plain comparisons on columns (the revenue reports use a CheckIn range rather than
+# YEAR(CheckIn)), so ordinary composite indexes serve them. An overlap test, CheckIn < end AND
+# Checkout > start, only bounds CheckIn from above; the lookups add CheckIn >= start minus the longest
+# stay (statements.MAX_STAY_NIGHTS, which --check also holds the stored stays to) to close the range.
+# Name and room searches are LIKE prefixes on NOCASE indexes (migrations 5 and 6).
+
+MIGRATIONS = [
+    (1, "create tables", {
+        "mysql": [
+            """
+            CREATE TABLE IF NOT EXISTS {rooms} (
+                RoomCode CHAR(5) PRIMARY KEY,
+                RoomName VARCHAR(30) NOT NULL,
+                Beds INT NOT NULL,
+                bedType VARCHAR(8) NOT NULL,
+                maxOcc INT NOT NULL,
+                basePrice DECIMAL(6,2) NOT NULL,
+                decor VARCHAR(20) NOT NULL,
+                UNIQUE (RoomName)
+            ) ENGINE=InnoDB
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS {reservations} (
+                CODE INT AUTO_INCREMENT PRIMARY KEY,
+                Room CHAR(5) NOT NULL,
+                CheckIn DATE NOT NULL,
+                Checkout DATE NOT NULL,
+                Rate DECIMAL(6,2) NOT NULL,
+                LastName VARCHAR(15) NOT NULL,
+                FirstName VARCHAR(15) NOT NULL,
+                Adults INT NOT NULL,
+                Kids INT NOT NULL,
+                FOREIGN KEY (Room) REFERENCES {rooms} (RoomCode)
+            ) ENGINE=InnoDB
+            """,
+        ],
+        "sqlite": [
+            """
+            CREATE TABLE IF NOT EXISTS {rooms} (
+                RoomCode CHAR(5) PRIMARY KEY,
+                RoomName VARCHAR(30) NOT NULL,
+                Beds INT NOT NULL,
+                bedType VARCHAR(8) NOT NULL,
+                maxOcc INT NOT NULL,
+                basePrice DECIMAL(6,2) NOT NULL,
+                decor VARCHAR(20) NOT NULL,
+                UNIQUE (RoomName)
+            )
+            """,
+            """
+            CREATE TABLE IF NOT EXISTS {reservations} (
+                CODE INTEGER PRIMARY KEY AUTOINCREMENT,
+                Room CHAR(5) NOT NULL,
+                CheckIn DATE NOT NULL,
+                Checkout DATE NOT NULL,
+                Rate DECIMAL(6,2) NOT NULL,
+                LastName VARCHAR(15) NOT NULL,
+                FirstName VARCHAR(15) NOT NULL,
+                Adults INT NOT NULL,
+                Kids INT NOT NULL,
+                FOREIGN KEY (Room) REFERENCES {rooms} (RoomCode)
+            )
+            """,
+        ],
+    }),
+    # Overlap checks for one room (find_conflict, overlapping_stays, the booking lock) seek on Room and
+    # range over CheckIn between the longest stay before the window and its end; Checkout rides along
+    # so the check never touches the table rows
+    (2, "index stays by room and dates", {
+        "all": ["CREATE INDEX {reservations}_room_dates ON {reservations} (Room, CheckIn, Checkout)"],
+    }),
+    # Revenue reads every stay in a CheckIn range; covering, so the reports are answered from the index
+    (3, "covering index for revenue", {
+        "all": ["CREATE INDEX {reservations}_checkin_revenue ON {reservations} (CheckIn, Checkout, Room, Rate)"],
+    }),
+    # MAX(maxOcc) becomes a single index lookup
+    (4, "index rooms by occupancy", {
+        "all": ["CREATE INDEX {rooms}_max_occupancy ON {rooms} (maxOcc)"],
+    }),
+    # Name searches are case-insensitive LIKE prefixes; SQLite only ranges an index over LIKE when the
+    # index is NOCASE, MySQL's default collation already is
+    (5, "index guest names", {
+        "mysql": [
+            "CREATE INDEX {reservations}_last_name ON {reservations} (LastName)",
+            "CREATE INDEX {reservations}_first_name ON {reservations} (FirstName)",
+        ],
+        "sqlite": [
+            "CREATE INDEX {reservations}_last_name ON {reservations} (LastName COLLATE NOCASE)",
+            "CREATE INDEX {reservations}_first_name ON {reservations} (FirstName COLLATE NOCASE)",
+        ],
+    }),
+    # Room patterns in searches the same way; on MySQL the room and dates index already serves them
+    (6, "index rooms for searches", {
+        "mysql": [],
+        "sqlite": ["CREATE INDEX {reservations}_room_nocase ON {reservations} (Room COLLATE NOCASE)"],
+    }),
+]
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS inn_schema_migrations (
+    tables VARCHAR(64) NOT NULL,
+    version INT NOT NULL,
+    name VARCHAR(100) NOT NULL,
+    applied VARCHAR(19) NOT NULL,
+    PRIMARY KEY (tables, version)
+)
+"""
+
+
+def _names(conn):
+    # Actual table names on this connection (a shard may keep its data under other names)
+    return {"rooms": conn.rename("lab7_rooms"), "reservations": conn.rename("lab7_reservations")}
+
+
+def applied(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(MIGRATIONS_TABLE)
+        cursor.execute("SELECT version FROM inn_schema_migrations WHERE tables = %s", (_names(conn)["reservations"],))
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+
+def migrate(conn):
+    # Apply the migrations this database hasn't had yet; returns the (version, name) pairs applied
+    names = _names(conn)
+    done = applied(conn)
+    ran = []
+    cursor = conn.cursor()
+    try:
+        for version, name, steps in MIGRATIONS:
+            if version in done:
+                continue
+            for statement in steps.get(conn.backend.name, steps.get("all", [])):
+                if conn.backend.name == "sqlite":
+                    statement = statement.replace("CREATE INDEX ", "CREATE INDEX IF NOT EXISTS ")
+                cursor.execute(statement.format(**names))
+            cursor.execute(
+                "INSERT INTO inn_schema_migrations (tables, version, name, applied) VALUES (%s, %s, %s, %s)",
+                (names["reservations"], version, name, datetime.now().isoformat(" ", timespec="seconds")),
+            )
+            conn.commit()
+            ran.append((version, name))
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    return ran
+
+
+def application_queries():
+    # (label, sql, params) for every lookup the application runs. The full-table reads that build the
+    # in-process indexes (availability, occupancy, room stats, reservation store) are
+    # left out: they read every row on purpose.
+    day, later = date(2024, 6, 1), date(2024, 6, 8)
+    params = {
+        "max_occupancy": (),
+        "room": ("A101",),
+        "reservation": (1,),
+        "find_conflict": ("A101",) + statements.overlap_params(day, later),
+        "overlapping_stays": ("A101",) + statements.overlap_params(day, later),
+        "room_stays": ("A101",),
+        "insert_reservation": None,
+        "delete_reservation": (1,),
+        "reservations_checking_in": (date(2024, 1, 1), date(2025, 1, 1)),
+        "reservations_overlapping": statements.overlap_params(date(2024, 1, 1), date(2025, 1, 1)),
+    }
+    queries = [(name, statements.SQL[name], params[name]) for name in statements.SQL if params.get(name) is not None]
+    queries.append(("lock_room", "SELECT RoomCode FROM lab7_rooms WHERE RoomCode = %s", ("A101",)))
+    queries.append(("reservation_store sync", reservation_store.SELECT_STAYS + " WHERE CODE > %s", (1,)))
+    queries.append(("reports: months", reports.SELECT_STAYS, statements.overlap_params(day, later)))
+    queries.append(("reports: rooms", reports.SELECT_STAYS + " AND Room IN (%s, %s)", statements.overlap_params(day, later) + ("A101", "B202")))
+    # The search shapes d_r_i produces
+    for label, filters in (
+        ("search: all", {}),
+        ("search: code", {"code": 1}),
+        ("search: room", {"room": "A1*"}),
+        ("search: dates", {"checkin": day, "checkout": later}),
+        ("search: room and dates", {"room": "A101", "checkin": day, "checkout": later}),
+        ("search: last name", {"last_name": "Smi*"}),
+        ("search: first name", {"first_name": "Jo*"}),
+        ("search: name suffix", {"last_name": "*son"}),
+    ):
+        conditions, values = search._conditions(
+            filters.get("code"), filters.get("room"), filters.get("checkin"), filters.get("checkout"),
+            filters.get("first_name"), filters.get("last_name"),
+        )
+        sql = search.SELECT_RESERVATIONS.format(conditions=" AND ".join(conditions))
+        queries.append((label, sql, tuple(values) + (0, search.PAGE_SIZE)))
+    return queries
+
+
+# SQLite reports a full read as "SCAN <table>", or as a bare "SEARCH <table>" with no index for MIN/MAX
+_SQLITE_SCAN = re.compile(r"(?:SCAN (?:TABLE )?(\w+)|SEARCH (?:TABLE )?(\w+)$)")
+# ... and the index constraints of a SEARCH in parentheses, e.g. (Room=? AND CheckIn>? AND CheckIn<?)
+_SQLITE_SEARCH = re.compile(r"SEARCH (?:TABLE )?(\w+) USING .*\((.*)\)$")
+_SQLITE_CONSTRAINT = re.compile(r"(\w+)(=|>=?|<=?)\?")
+
+# Lookups that are meant to read everything on one side of their bound: the store's sync fetches
+# every row past its watermark
+OPEN_RANGES = {"reservation_store sync"}
+# Searches no index can narrow: they page through the whole table by CODE. Documented as known full
+# scans (search.py, main.py's search prompt, server.py, README) and listed by --check, not failed
+FULL_WALKS = {"search: all", "search: name suffix"}
+
+
+def full_scans(backend, plan):
+    # Tables (or whole indexes) the plan reads from end to end
+    tables = []
+    for row in plan:
+        if backend == "sqlite":
+            match = _SQLITE_SCAN.match(row.get("detail", ""))
+            if match:
+                tables.append(match.group(1) or match.group(2))
+        elif row.get("type") in ("ALL", "index"):
+            tables.append(row.get("table"))
+    return tables
+
+
+def open_ranges(backend, plan):
+    # (table, column) for every index range the plan bounds at one end only. MySQL's EXPLAIN doesn't
+    # show the bounds of a range, so this only sees SQLite plans
+    ranges = []
+    if backend != "sqlite":
+        return ranges
+    for row in plan:
+        match = _SQLITE_SEARCH.match(row.get("detail", ""))
+        if not match:
+            continue
+        bounds = {}
+        for column, op in _SQLITE_CONSTRAINT.findall(match.group(2)):
+            bounds.setdefault(column, set()).add(op[0])
+        ranges.extend((match.group(1), column) for column, ops in bounds.items() if "=" not in ops and len(ops) == 1)
+    return ranges
+
+
+def longest_stay(conn):
+    # Nights in the longest stored stay (0 when there are none)
+    if conn.backend.name == "sqlite":
+        sql = "SELECT MAX(julianday(Checkout) - julianday(CheckIn)) FROM lab7_reservations"
+    else:
+        sql = "SELECT MAX(DATEDIFF(Checkout, CheckIn)) FROM lab7_reservations"
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql)
+        return int((cursor.fetchone() or [0])[0] or 0)
+    finally:
+        cursor.close()
+
+
+def check_plans(conn):
+    # [(label, problem)] for every application query that can't be explained, falls back to a full
+    # scan or reads an open-ended range, plus stored stays longer than the overlap lookups look back;
+    # empty when all is well
+    problems = []
+    for label, sql, params in application_queries():
+        plan = metrics.explain(conn, sql, params)
+        if plan is None:
+            problems.append((label, "could not be explained"))
+            continue
+        scanned = full_scans(conn.backend.name, plan)
+        if scanned:
+            problems.append((label, f"full scan of {', '.join(scanned)}"))
+        if label not in OPEN_RANGES | FULL_WALKS:
+            for table, column in open_ranges(conn.backend.name, plan):
+                problems.append((label, f"range over {table}.{column} is open at one end"))
+    nights = longest_stay(conn)
+    if nights > statements.MAX_STAY_NIGHTS:
+        problems.append(("stored stays", f"the longest is {nights} nights, over the {statements.MAX_STAY_NIGHTS} the overlap lookups look back"))
+    return problems
+
+
+def _run(conn, check):
+    applied_now = migrate(conn)
+    return applied_now, check_plans(conn) if check else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create the tables and indexes, then optionally check the query plans")
+    parser.add_argument("--db", help="SQLite file (default: the configured INN_DB_BACKEND, or every shard in INN_SHARDS)")
+    parser.add_argument("--check", action="store_true", help="EXPLAIN every application query and fail on full table scans")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(db.SQLiteBackend(args.db))
+    failed = False
+    try:
+        if shards.enabled() and not args.db:
+            results = [(f"{shard.name}: ", shard.run(_run, args.check)) for shard in shards.get_shards()]
+        else:
+            conn = db.get_db_connection()
+            if conn is None:
+                return 1
+            try:
+                results = [("", _run(conn, args.check))]
+            finally:
+                conn.close()
+    except (*db.Error, db.PoolError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    for prefix, (applied_now, problems) in results:
+        for version, name in applied_now:
+            print(f"{prefix}Applied {version}: {name}", file=sys.stderr)
+        for label, problem in problems:
+            print(f"Error: {prefix}{label}: {problem}", file=sys.stderr)
+        if args.check and not problems:
+            print(f"{prefix}All {len(application_queries())} application queries use an index", file=sys.stderr)
+        if args.check:
+            print(f"{prefix}Known full walks by CODE: {', '.join(sorted(FULL_WALKS))}", file=sys.stderr)
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
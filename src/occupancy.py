@@ -0,0 +1,209 @@
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+import events
+import reservation_store
+from availability import to_ordinal
+
+# Rooms x days occupancy bitmap, one bit per room-night packed eight nights to a byte (about 90 KB
+# per 100 rooms over five years). Flexible-date and calendar questions unpack only the days they
+# look at and answer them for every candidate room at once with array operations.
+
+HORIZON_DAYS = 730  # nights kept past today even when nothing is booked that far out
+LOAD_ROWS = 1024  # rooms expanded at a time while building the bitmap
+
+
+class OccupancyMatrix:
+    # Built from reservation_store.RoomStays; a room whose stays changed since (its version moved on)
+    # has its row redrawn from its own stays before the next read.
+    def __init__(self, stays):
+        self.rooms = {}  # RoomCode -> (RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor)
+        self.codes = []  # bitmap row -> RoomCode
+        self._rows = {}  # RoomCode -> bitmap row
+        self.stays = stays
+        self._versions = {}  # RoomCode -> RoomStays version its row was drawn from
+        self.first_day = date.today().toordinal()  # ordinal of the night in bit 0
+        self.bits = np.zeros((0, 0), dtype=np.uint8)
+        self.syncs = 0  # RoomStays.syncs when the rooms were read
+        self._lock = threading.RLock()
+
+    @property
+    def days(self):
+        return self.bits.shape[1] * 8
+
+    def load(self, cursor):
+        # (Re)read the rooms; get_matrix() calls it again once the store has caught up with the table.
+        # The first read draws every row, later ones only the rows of rooms added since.
+        cursor.execute("SELECT RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor FROM lab7_rooms ORDER BY RoomCode")
+        rooms = {room[0]: tuple(room) for room in cursor.fetchall()}
+        with self._lock:
+            first = not self.codes
+            added = [code for code in rooms if code not in self._rows]
+            for code in added:
+                self._rows[code] = len(self.codes)
+                self.codes.append(code)
+            self.rooms = rooms
+            self.syncs = self.stays.syncs
+            if first:
+                self._draw_all()
+            elif added:
+                self.bits = np.vstack([self.bits, np.zeros((len(added), self.bits.shape[1]), dtype=np.uint8)])
+                for code in added:
+                    self._draw(code)
+        return self
+
+    def use(self, stays):
+        # The stays were reloaded (reservation_store.reset()); redraw everything from the new ones
+        with self._lock:
+            self.stays = stays
+            self._draw_all()
+
+    def _draw_all(self):
+        # Every room's stays end to end, with the bitmap row each belongs to
+        self._versions = {code: self.stays.versions.get(code, 0) for code in self.codes}
+        parts = [self.stays.get(code) for code in self.codes]
+        checkins = np.concatenate([part[1] for part in parts] or [np.zeros(0, np.int32)]).astype(np.int64)
+        checkouts = np.concatenate([part[2] for part in parts] or [np.zeros(0, np.int32)]).astype(np.int64)
+        rows = np.repeat(np.arange(len(self.codes)), [len(part[0]) for part in parts])
+        keep = checkouts > checkins
+        rows, checkins, checkouts = rows[keep], checkins[keep], checkouts[keep]
+        today = date.today().toordinal()
+        self.first_day = int(min(checkins.min(), today)) if len(checkins) else today
+        last = int(max(checkouts.max(), today + HORIZON_DAYS)) if len(checkouts) else today + HORIZON_DAYS
+        days = -(-(last - self.first_day) // 8) * 8
+        self.bits = np.zeros((len(self.codes), days // 8), dtype=np.uint8)
+
+        # +1 at every check-in, -1 at every checkout, running sum > 0 means the night is taken.
+        # Done a block of rooms at a time so the int16 counts never cover the whole hotel at once.
+        for block in range(0, len(self.codes), LOAD_ROWS):
+            selected = (rows >= block) & (rows < block + LOAD_ROWS)
+            counts = np.zeros((min(LOAD_ROWS, len(self.codes) - block), days + 1), dtype=np.int16)
+            np.add.at(counts, (rows[selected] - block, checkins[selected] - self.first_day), 1)
+            np.add.at(counts, (rows[selected] - block, checkouts[selected] - self.first_day), -1)
+            occupied = np.cumsum(counts[:, :days], axis=1, dtype=np.int16) > 0
+            self.bits[block:block + len(counts)] = np.packbits(occupied, axis=1, bitorder="little")
+
+    def _grow(self, first, end):
+        # Widen the bitmap (in whole bytes) so nights [first, end) have bits
+        before = max(0, -(-(self.first_day - first) // 8))
+        after = max(0, -(-(end - (self.first_day + self.days)) // 8))
+        if before or after:
+            self.bits = np.pad(self.bits, ((0, 0), (before, after)))
+            self.first_day -= before * 8
+
+    def _draw(self, code):
+        # Redraw one room's row from its current stays
+        version = self.stays.versions.get(code, 0)
+        _, checkins, checkouts = self.stays.get(code)
+        keep = checkouts > checkins
+        checkins, checkouts = checkins[keep].astype(np.int64), checkouts[keep].astype(np.int64)
+        if len(checkins):
+            self._grow(int(checkins.min()), int(checkouts.max()))
+        counts = np.zeros(self.days + 1, dtype=np.int32)
+        np.add.at(counts, checkins - self.first_day, 1)
+        np.add.at(counts, checkouts - self.first_day, -1)
+        self.bits[self._rows[code]] = np.packbits(np.cumsum(counts[:self.days]) > 0, bitorder="little")
+        self._versions[code] = version
+
+    def _rows_for(self, codes):
+        # Bitmap rows for these rooms, redrawing the ones that changed since they were drawn
+        versions = self.stays.versions
+        for code in codes:
+            if self._versions.get(code, 0) != versions.get(code, 0):
+                self._draw(code)
+        return [self._rows[code] for code in codes]
+
+    def occupied(self, rows, first, end):
+        # Bool array (len(rows), end - first); nights outside the stored range count as free
+        result = np.zeros((len(rows), max(0, end - first)), dtype=bool)
+        low, high = max(first, self.first_day), min(end, self.first_day + self.days)
+        if low < high:
+            start_byte, end_byte = (low - self.first_day) // 8, -(-(high - self.first_day) // 8)
+            nights = np.unpackbits(self.bits[rows, start_byte:end_byte], axis=1, bitorder="little")
+            skip = low - self.first_day - start_byte * 8
+            result[:, low - first:high - first] = nights[:, skip:skip + high - low]
+        return result
+
+    def is_free(self, room, checkin, checkout):
+        checkin, checkout = to_ordinal(checkin), to_ordinal(checkout)
+        with self._lock:
+            return not self.occupied(self._rows_for([room]), checkin, checkout).any()
+
+    def nearest_windows(self, codes, checkin, nights, flex_days, earliest=None):
+        # For each room, the free run of `nights` nights starting closest to `checkin` within
+        # +/- flex_days (earlier start wins a tie). Returns {RoomCode: start ordinal}.
+        checkin = to_ordinal(checkin)
+        first = checkin - flex_days
+        if earliest is not None:
+            first = max(first, to_ordinal(earliest))
+        last_start = checkin + flex_days
+        if not codes or nights <= 0 or last_start < first:
+            return {}
+        with self._lock:
+            occupied = self.occupied(self._rows_for(codes), first, last_start + nights)
+        # Nights taken inside each candidate window [s, s + nights), via a running sum along the days
+        taken = np.zeros((len(codes), occupied.shape[1] + 1), dtype=np.int32)
+        np.cumsum(occupied, axis=1, out=taken[:, 1:])
+        busy = taken[:, nights:] - taken[:, :-nights]
+        distance = np.abs(np.arange(busy.shape[1]) + first - checkin)
+        score = np.where(busy == 0, distance, np.iinfo(np.int64).max)
+        best = score.argmin(axis=1)
+        found = score[np.arange(len(codes)), best] != np.iinfo(np.int64).max
+        return {code: first + int(start) for code, start, ok in zip(codes, best, found) if ok}
+
+    def suggest(self, checkin, checkout, guests, bed_type="Any", flex_days=7, limit=5, earliest=None):
+        # Alternatives when nothing matches exactly: rooms that hold the party, on the requested
+        # dates or the nearest free dates within +/- flex_days. Closest dates first, then rooms
+        # with the requested bed type, then the old size "similarity" (|maxOcc - guests| or |Beds - guests|).
+        checkin, checkout = to_ordinal(checkin), to_ordinal(checkout)
+        any_bed = bed_type.lower() == "any"
+        with self._lock:
+            candidates = [code for code, room in self.rooms.items() if room[4] >= guests]
+            starts = self.nearest_windows(candidates, checkin, checkout - checkin, flex_days, earliest)
+        ranked = sorted(
+            starts.items(),
+            key=lambda item: (
+                abs(item[1] - checkin),
+                not any_bed and self.rooms[item[0]][3].lower() != bed_type.lower(),
+                min(abs(self.rooms[item[0]][4] - guests), abs(self.rooms[item[0]][2] - guests)),
+                item[0],
+            ),
+        )
+        return [
+            (self.rooms[code], date.fromordinal(start), date.fromordinal(start + checkout - checkin))
+            for code, start in ranked[:limit]
+        ]
+
+    def calendar(self, first, end, codes=None):
+        # Free nights in [first, end) for each room: {RoomCode: [date, ...]}
+        first, end = to_ordinal(first), to_ordinal(end)
+        with self._lock:
+            codes = sorted(self.rooms) if codes is None else [code for code in codes if code in self._rows]
+            free = ~self.occupied(self._rows_for(codes), first, end)
+        return {code: [date.fromordinal(first + int(day)) for day in np.flatnonzero(row)] for code, row in zip(codes, free)}
+
+    def month_calendar(self, year, month, codes=None):
+        first = date(year, month, 1)
+        end = (first + timedelta(days=31)).replace(day=1)
+        return self.calendar(first, end, codes)
+
+
+def get_matrix(cursor):
+    stays = reservation_store.get_room_stays(cursor)
+    matrix = db.pool_cached("occupancy", lambda: OccupancyMatrix(stays).load(cursor))
+    if matrix.stays is not stays:
+        matrix.use(stays)
+    if matrix.syncs != stays.syncs:
+        matrix.load(cursor)
+    return matrix
+
+
+def reset():
+    db.pool_state().pop("occupancy", None)
+
+
+# Bookings and cancellations reach the bitmap through reservation_store.RoomStays
+events.subscribe(reset=reset)
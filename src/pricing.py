@@ -0,0 +1,42 @@
+from datetime import date
+
+import numpy as np
+
+# Weekend nights cost 110% of the base rate, kept as a ratio of integers so totals are exact
+WEEKEND_PERCENT = 110
+
+
+def _days(values):
+    # Dates, ISO strings or sequences of either -> datetime64[D]
+    if isinstance(values, (str, date)):
+        return np.datetime64(str(values)[:10], "D")
+    return np.array([str(value)[:10] for value in values], dtype="datetime64[D]")
+
+
+def night_counts(checkin, checkout):
+    # (weekday nights, weekend nights) for stays [checkin, checkout), counted without walking the days.
+    # Works element-wise when given sequences.
+    begin, end = _days(checkin), _days(checkout)
+    end = np.maximum(begin, end)
+    weekdays = np.busday_count(begin, end)  # Monday-Friday nights
+    return weekdays, (end - begin).astype(np.int64) - weekdays
+
+
+def _total(weekdays, weekends, base_rates):
+    # Price in integer hundredths of a cent, then round half up to cents once per stay.
+    # The old per-day float loop could drift a cent either way on long stays.
+    cents = np.rint(np.asarray(base_rates, dtype=np.float64) * 100).astype(np.int64)
+    hundredths = cents * (100 * weekdays + WEEKEND_PERCENT * weekends)
+    return (hundredths + 50) // 100 / 100
+
+
+def stay_cost(checkin, checkout, base_rate):
+    weekdays, weekends = night_counts(checkin, checkout)
+    return float(_total(weekdays, weekends, float(base_rate)))
+
+
+def quote_batch(checkins, checkouts, base_rates):
+    # Total cost for many (checkin, checkout, rate) combinations in one vectorized pass.
+    # Scalars broadcast, so one stay can be priced for every candidate room.
+    weekdays, weekends = night_counts(checkins, checkouts)
+    return _total(weekdays, weekends, base_rates)
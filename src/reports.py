@@ -0,0 +1,247 @@
+import argparse
+import csv
+import math
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+
+import numpy as np
+
+import db
+import revenue_engine
+import shards
+import statements
+
+# Occupancy, ADR (average daily rate: revenue per night sold) and revenue for any date range, as CSV
+# or Parquet. The range is cut into batches of months or of rooms, each tallied in a worker process
+# that streams its stays with fetchmany and keeps only a rooms x months array for its own batch, so
+# memory stays bounded however many years are covered. Revenue is split by night like View Revenue.
+#   python src/reports.py --start 2022-01-01 --end 2027-01-01 --by month --out occupancy.csv
+
+GROUPINGS = ("month", "room", "room-month")
+SPLITS = ("month", "room")
+MEASURES = ["available_nights", "sold_nights", "occupancy", "revenue", "adr"]
+CHUNK_SIZE = 5000
+TASKS_PER_PROCESS = 4  # smaller batches even out the work between processes
+
+# Params: statements.overlap_params(start, end), so a batch reads its own months and the longest stay
+# before them, not every stay since the first
+SELECT_STAYS = "SELECT Room, CheckIn, Checkout, Rate FROM lab7_reservations WHERE CheckIn < %s AND CheckIn >= %s AND Checkout > %s"
+SELECT_ROOMS = "SELECT RoomCode FROM lab7_rooms ORDER BY RoomCode"
+
+
+def _room_codes(conn):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(SELECT_ROOMS)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def tally(conn, rooms, start, end, only_rooms=False, chunk_size=CHUNK_SIZE):
+    # (nights sold, revenue in cents) for `rooms` over [start, end), each shaped (rooms, months);
+    # only_rooms restricts the query to those rooms, otherwise they must be all of them
+    index = {room: i for i, room in enumerate(rooms)}
+    months = len(revenue_engine.period_starts(start, end))
+    nights = np.zeros((len(rooms), months), dtype=np.int64)
+    cents = np.zeros((len(rooms), months), dtype=np.int64)
+    sql, params = SELECT_STAYS, list(statements.overlap_params(start, end))
+    if only_rooms:
+        sql += f" AND Room IN ({', '.join(['%s'] * len(rooms))})"
+        params += rooms
+    cursor = conn.cursor()
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            _, room_index, checkins, checkouts, rates = revenue_engine.stay_arrays(rows, index)
+            _, batch_nights, batch_cents = revenue_engine.period_totals(room_index, checkins, checkouts, rates, len(rooms), start, end)
+            nights += batch_nights
+            cents += batch_cents
+    finally:
+        cursor.close()
+    return nights, cents
+
+
+def _init_worker(sqlite_path):
+    if sqlite_path:
+        db.configure(db.SQLiteBackend(sqlite_path))
+
+
+def _run_task(shard_name, rooms, start, end, only_rooms, chunk_size):
+    if shard_name is not None:
+        return shards.get_shard(shard_name).run(tally, rooms, start, end, only_rooms, chunk_size)
+    conn = db.get_pool().get()
+    try:
+        return tally(conn, rooms, start, end, only_rooms, chunk_size)
+    finally:
+        conn.close()
+
+
+def _batches(items, count):
+    size = max(1, math.ceil(len(items) / count))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def plan(rooms_by_shard, start, end, split="month", tasks=TASKS_PER_PROCESS):
+    # [(shard name or None, rooms, first day, end day, only those rooms)]; month batches start on a
+    # month so they line up with the report's columns
+    if split not in SPLITS:
+        raise ValueError(f"Unknown split '{split}' (expected one of {', '.join(SPLITS)})")
+    months = revenue_engine.period_starts(start, end)
+    bounds = months + [end]
+    work = []
+    for shard, rooms in rooms_by_shard.items():
+        if split == "room":
+            work.extend((shard, batch, start, end, True) for batch in _batches(rooms, tasks))
+            continue
+        for batch in _batches(list(range(len(months))), tasks):
+            first, last = bounds[batch[0]], bounds[batch[-1] + 1]
+            # A stay overlapping the batch checks in at most a year before it (see shards._stay_years)
+            if shard is None or shards.get_shard(shard).holds_years(first.year - 1, (last - timedelta(days=1)).year):
+                work.append((shard, rooms, first, last, False))
+    return work
+
+
+def build(start, end, split="month", processes=None, chunk_size=CHUNK_SIZE, sqlite_path=None):
+    # (rooms, month starts, nights sold, revenue in cents) over every room, or every shard's rooms
+    if end <= start:
+        raise ValueError("End date must be after start date")
+    if shards.enabled():
+        rooms_by_shard = {shard.name: rooms for shard, rooms in shards.fan_out(_room_codes, shards.get_shards())}
+    else:
+        conn = db.get_pool().get()
+        try:
+            rooms_by_shard = {None: _room_codes(conn)}
+        finally:
+            conn.close()
+    # Report rows are rooms of a property (shards.room_key); year shards of one property share them
+    shard_of = {name: shards.get_shard(name) if name is not None else None for name in rooms_by_shard}
+    rooms = sorted({shards.room_key(shard_of[name], room) for name, shard_rooms in rooms_by_shard.items() for room in shard_rooms})
+    months = revenue_engine.period_starts(start, end)
+    processes = processes if processes is not None else os.cpu_count() or 1
+    work = plan(rooms_by_shard, start, end, split, max(1, processes) * TASKS_PER_PROCESS)
+
+    row = {room: i for i, room in enumerate(rooms)}
+    column = {day: i for i, day in enumerate(months)}
+    nights = np.zeros((len(rooms), len(months)), dtype=np.int64)
+    cents = np.zeros((len(rooms), len(months)), dtype=np.int64)
+
+    def add(task, result):
+        # Year shards of one property hold the same rooms, so their nights add up per room
+        name, task_rooms, first, _, _ = task
+        rows = [row[shards.room_key(shard_of[name], room)] for room in task_rooms]
+        columns = slice(column[first], column[first] + result[0].shape[1])
+        nights[rows, columns] += result[0]
+        cents[rows, columns] += result[1]
+
+    if processes <= 1:
+        _init_worker(sqlite_path)
+        for task in work:
+            add(task, _run_task(*task, chunk_size))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(sqlite_path,)) as executor:
+            futures = [(task, executor.submit(_run_task, *task, chunk_size)) for task in work]
+            for task, future in futures:
+                add(task, future.result())
+    return rooms, months, nights, cents
+
+
+def _measures(available, sold, cents):
+    available, sold, revenue = int(available), int(sold), int(cents) / 100
+    return [
+        available,
+        sold,
+        round(sold / available, 4) if available else 0.0,
+        round(revenue, 2),
+        round(revenue / sold, 2) if sold else 0.0,
+    ]
+
+
+def report_rows(rooms, months, nights, cents, end, by="month"):
+    # Header plus one row per month, per room or per room and month
+    if by not in GROUPINGS:
+        raise ValueError(f"Unknown grouping '{by}' (expected one of {', '.join(GROUPINGS)})")
+    days = np.diff([day.toordinal() for day in months] + [end.toordinal()])
+    labels = [f"{day:%Y-%m}" for day in months]
+    if by == "month":
+        yield ["month", "rooms"] + MEASURES
+        sold, revenue = nights.sum(axis=0), cents.sum(axis=0)
+        for i, label in enumerate(labels):
+            yield [label, len(rooms)] + _measures(days[i] * len(rooms), sold[i], revenue[i])
+    elif by == "room":
+        yield ["room"] + MEASURES
+        sold, revenue = nights.sum(axis=1), cents.sum(axis=1)
+        for r, room in enumerate(rooms):
+            yield [room] + _measures(days.sum(), sold[r], revenue[r])
+    else:
+        yield ["room", "month"] + MEASURES
+        for r, room in enumerate(rooms):
+            for i, label in enumerate(labels):
+                yield [room, label] + _measures(days[i], nights[r, i], cents[r, i])
+
+
+def write_csv(path, rows):
+    count = 0
+    with open(path, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(next(rows))
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+def write_parquet(path, rows):
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+    header, *body = rows
+    table = pyarrow.table({name: [row[i] for row in body] for i, name in enumerate(header)})
+    pyarrow.parquet.write_table(table, path)
+    return len(body)
+
+
+def write(path, rows):
+    # Format from the file extension; returns the number of data rows written
+    if path.endswith(".parquet"):
+        return write_parquet(path, list(rows))
+    return write_csv(path, rows)
+
+
+def main(argv=None):
+    this_year = date.today().year
+    parser = argparse.ArgumentParser(description="Write occupancy, ADR and revenue for a date range to CSV or Parquet")
+    parser.add_argument("--start", type=date.fromisoformat, default=date(this_year, 1, 1), help="first night (default: January 1st this year)")
+    parser.add_argument("--end", type=date.fromisoformat, default=date(this_year + 1, 1, 1), help="day after the last night")
+    parser.add_argument("--by", choices=GROUPINGS, default="month", help="one row per month, per room or per room and month")
+    parser.add_argument("--split", choices=SPLITS, default="month", help="hand the work to processes in batches of months or of rooms")
+    parser.add_argument("--processes", type=int, help="worker processes (default: CPU count; 1 runs in this process)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows fetched per round trip")
+    parser.add_argument("--out", help="output file, .csv or .parquet (default: report_<by>_<start>_<end>.csv)")
+    parser.add_argument("--db", help="SQLite file (default: the configured INN_DB_BACKEND)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(db.SQLiteBackend(args.db))
+    out = args.out or f"report_{args.by}_{args.start}_{args.end}.csv"
+    began = time.perf_counter()
+    try:
+        rooms, months, nights, cents = build(args.start, args.end, args.split, args.processes, args.chunk_size, args.db)
+        count = write(out, report_rows(rooms, months, nights, cents, args.end, args.by))
+    except (*db.Error, db.PoolError, ValueError, RuntimeError, OSError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    print(f"Wrote {count} rows to {out} in {time.perf_counter() - began:.2f}s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
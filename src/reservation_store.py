@@ -0,0 +1,540 @@
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+import availability
+import db
+import events
+import statements
+
+# Compact in-process copy of lab7_reservations: one NumPy array per column (int32 day ordinals,
+# a small integer per room, float rates) instead of a tuple of date/Decimal objects per row,
+# about 30 bytes a stay. The history can be written to a snapshot file and memory-mapped back,
+# so a new process skips the full table read and only catches up on what changed since.
+#
+# Snapshot layout: MAGIC, a little-endian uint32 header length, a JSON header (row count, room
+# codes, highest CODE, which database it came from, column dtypes and offsets), then each column's
+# raw bytes, 64-byte aligned.
+
+MAGIC = b"INNSNAP1"
+ALIGN = 64
+COLUMNS = (
+    ("code", "<i8"),
+    ("room", "<i4"),
+    ("checkin", "<i4"),
+    ("checkout", "<i4"),
+    ("rate", "<f8"),
+    ("adults", "<i2"),
+    ("kids", "<i2"),
+)
+SELECT_STAYS = "SELECT CODE, Room, CheckIn, Checkout, Rate, Adults, Kids FROM lab7_reservations"
+DEFAULT_SNAPSHOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservations.snapshot")
+IN_CHUNK = 500
+SYNC_INTERVAL = float(os.getenv("INN_SYNC_INTERVAL", "60"))  # seconds between catch-ups with other processes' writes
+
+
+class Stay:
+    # Record view of one row, built on access
+    __slots__ = ("code", "room", "checkin", "checkout", "rate", "adults", "kids")
+
+    def __init__(self, code, room, checkin, checkout, rate, adults, kids):
+        self.code = code
+        self.room = room
+        self.checkin = checkin
+        self.checkout = checkout
+        self.rate = rate
+        self.adults = adults
+        self.kids = kids
+
+    def __repr__(self):
+        return f"Stay({self.code}, {self.room!r}, {self.checkin}, {self.checkout}, {self.rate}, {self.adults}, {self.kids})"
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+class ReservationStore:
+    # Rows live in `base` (sorted by code; arrays or a read-only memory map) plus a small `tail`
+    # of rows added since, merged into base once it grows. Cancelled rows are masked, not moved.
+    TAIL_LIMIT = 65536
+
+    def __init__(self):
+        self.rooms = []  # room index -> RoomCode
+        self._room_index = {}
+        self.base = {name: np.zeros(0, dtype) for name, dtype in COLUMNS}
+        self._alive = np.zeros(0, dtype=bool)
+        self._tail = {name: [] for name, _ in COLUMNS}
+        self._tail_rows = {}  # code -> position in tail
+        self.watermark = 0  # highest CODE seen
+        self.source = None  # database the rows came from (see database_name())
+        self._pending = set()  # codes booked through this process, read from the table on next use
+        self.outdated = False  # another process changed the table; sync() on next use
+        self.synced = time.monotonic()  # when the rows last matched the table
+        self.syncs = 0  # catch-ups so far
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        with self._lock:
+            return int(self._alive.sum()) + len(self._tail_rows)
+
+    def _room(self, code):
+        index = self._room_index.get(code)
+        if index is None:
+            index = self._room_index[code] = len(self.rooms)
+            self.rooms.append(code)
+        return index
+
+    def _set_base(self, columns, rooms, watermark):
+        self.rooms = list(rooms)
+        self._room_index = {code: i for i, code in enumerate(self.rooms)}
+        self.base = columns
+        self._alive = np.ones(len(columns["code"]), dtype=bool)
+        self._tail = {name: [] for name, _ in COLUMNS}
+        self._tail_rows = {}
+        self.watermark = watermark
+
+    def load(self, cursor, chunk_size=50000):
+        # Full read of lab7_reservations into arrays, a chunk at a time
+        with self._lock:
+            chunks = {name: [] for name, _ in COLUMNS}
+            rooms = self.rooms or []
+            room_index = {code: i for i, code in enumerate(rooms)}
+            cursor.execute(SELECT_STAYS)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                codes, room_codes, checkins, checkouts, rates, adults, kids = zip(*rows)
+                for room in set(room_codes) - room_index.keys():
+                    room_index[room] = len(rooms)
+                    rooms.append(room)
+                chunks["code"].append(np.array(codes, dtype=np.int64))
+                chunks["room"].append(np.array([room_index[room] for room in room_codes], dtype=np.int32))
+                chunks["checkin"].append(np.array([availability.to_ordinal(day) for day in checkins], dtype=np.int32))
+                chunks["checkout"].append(np.array([availability.to_ordinal(day) for day in checkouts], dtype=np.int32))
+                chunks["rate"].append(np.array(rates, dtype=np.float64))
+                chunks["adults"].append(np.array(adults, dtype=np.int16))
+                chunks["kids"].append(np.array(kids, dtype=np.int16))
+            columns = {name: np.concatenate(chunks[name]) if chunks[name] else np.zeros(0, dtype) for name, dtype in COLUMNS}
+            order = np.argsort(columns["code"], kind="stable")
+            columns = {name: array[order] for name, array in columns.items()}
+            self._set_base(columns, rooms, int(columns["code"][-1]) if len(order) else 0)
+        return self
+
+    def add(self, code, room, checkin, checkout, rate, adults=0, kids=0):
+        with self._lock:
+            if self._find(code) is not None:
+                return
+            self._tail_rows[code] = len(self._tail["code"])
+            for name, value in zip(
+                ("code", "room", "checkin", "checkout", "rate", "adults", "kids"),
+                (code, self._room(room), availability.to_ordinal(checkin), availability.to_ordinal(checkout), float(rate), adults, kids),
+            ):
+                self._tail[name].append(value)
+            self.watermark = max(self.watermark, code)
+            if len(self._tail_rows) >= self.TAIL_LIMIT:
+                self.compact()
+
+    def announce(self, code):
+        with self._lock:
+            self._pending.add(code)
+
+    def fetch_pending(self, cursor):
+        with self._lock:
+            if self._pending:
+                codes, self._pending = sorted(self._pending), set()
+                self.fetch(cursor, codes)
+
+    def remove(self, code):
+        with self._lock:
+            self._pending.discard(code)
+            found = self._find(code)
+            if found is None:
+                return False
+            where, i = found
+            if where == "base":
+                self._alive[i] = False
+            else:
+                del self._tail_rows[code]
+            return True
+
+    def _find(self, code):
+        # ("base", row) or ("tail", position) for a live row, else None
+        codes = self.base["code"]
+        i = int(np.searchsorted(codes, code))
+        if i < len(codes) and codes[i] == code and self._alive[i]:
+            return "base", i
+        if code in self._tail_rows:
+            return "tail", self._tail_rows[code]
+        return None
+
+    def get(self, code):
+        with self._lock:
+            found = self._find(code)
+            if found is None:
+                return None
+            where, i = found
+            columns = self.base if where == "base" else self._tail
+            return Stay(
+                int(columns["code"][i]), self.rooms[int(columns["room"][i])],
+                date.fromordinal(int(columns["checkin"][i])), date.fromordinal(int(columns["checkout"][i])),
+                float(columns["rate"][i]), int(columns["adults"][i]), int(columns["kids"][i]),
+            )
+
+    def columns(self):
+        # Live rows as arrays (copies), base rows first in code order then the tail
+        with self._lock:
+            tail = np.array(sorted(self._tail_rows.values()), dtype=np.int64)
+            return {
+                name: np.concatenate([self.base[name][self._alive], np.asarray(self._tail[name], dtype=dtype)[tail]])
+                for name, dtype in COLUMNS
+            }
+
+    def stays(self):
+        # (code, RoomCode, checkin ordinal, checkout ordinal) for every live row; what the in-process
+        # indexes load from instead of re-reading the table
+        columns = self.columns()
+        rooms = self.rooms
+        return zip(
+            columns["code"].tolist(), [rooms[i] for i in columns["room"].tolist()],
+            columns["checkin"].tolist(), columns["checkout"].tolist(),
+        )
+
+    def __iter__(self):
+        columns = self.columns()
+        for code, room, checkin, checkout, rate, adults, kids in zip(*(columns[name].tolist() for name, _ in COLUMNS)):
+            yield Stay(code, self.rooms[room], date.fromordinal(checkin), date.fromordinal(checkout), rate, adults, kids)
+
+    def compact(self):
+        # Fold the tail and the cancelled rows into a fresh, code-sorted base
+        with self._lock:
+            columns = self.columns()
+            order = np.argsort(columns["code"], kind="stable")
+            self._set_base({name: array[order] for name, array in columns.items()}, self.rooms, self.watermark)
+
+    def save(self, path):
+        # Write a snapshot atomically (temp file + rename)
+        with self._lock:
+            self.compact()
+            header = {
+                "count": len(self.base["code"]), "rooms": self.rooms, "watermark": self.watermark, "source": self.source,
+                "created": datetime.now().isoformat(timespec="seconds"), "columns": {},
+            }
+            # Offsets depend on the header's own length, so lay it out with room to spare
+            offset = _align(len(MAGIC) + 4 + len(json.dumps(header)) + 64 * (len(COLUMNS) + 1))
+            for name, dtype in COLUMNS:
+                header["columns"][name] = {"dtype": dtype, "offset": offset}
+                offset = _align(offset + self.base[name].nbytes)
+            encoded = json.dumps(header).encode()
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as out:
+                out.write(MAGIC + len(encoded).to_bytes(4, "little") + encoded)
+                for name, dtype in COLUMNS:
+                    out.seek(header["columns"][name]["offset"])
+                    out.write(np.ascontiguousarray(self.base[name], dtype=dtype).tobytes())
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp, path)
+
+    def open_snapshot(self, path):
+        # Memory-map a snapshot; nothing is read until a column is touched
+        with open(path, "rb") as snapshot:
+            if snapshot.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a reservation snapshot")
+            header = json.loads(snapshot.read(int.from_bytes(snapshot.read(4), "little")))
+        count = header["count"]
+        columns = {
+            name: np.memmap(path, dtype=spec["dtype"], mode="r", offset=spec["offset"], shape=(count,)) if count else np.zeros(0, spec["dtype"])
+            for name, spec in header["columns"].items()
+        }
+        with self._lock:
+            self._set_base(columns, header["rooms"], header["watermark"])
+            self.source = header.get("source")
+        return self
+
+    def sync(self, cursor):
+        # Catch up with the table: rows past the watermark, then a row count to detect cancellations
+        # (or rows committed out of code order), which trigger a full CODE comparison. Returns the
+        # RoomCodes whose rows another process changed, or None, changing nothing, if the table was
+        # rebuilt since (its codes no longer reach the watermark).
+        with self._lock:
+            cursor.execute("SELECT MAX(CODE) FROM lab7_reservations")
+            highest = cursor.fetchone()[0]
+            if (highest or 0) < self.watermark:
+                return None
+            cursor.execute(SELECT_STAYS + " WHERE CODE > %s", (self.watermark,))
+            changed = set()
+            for row in cursor.fetchall():
+                # This process's own bookings already reached the indexes through events
+                if row[0] not in self._pending:
+                    changed.add(row[1])
+                self._pending.discard(row[0])
+                self.add(*row)
+            cursor.execute("SELECT COUNT(*) FROM lab7_reservations")
+            if cursor.fetchone()[0] != len(self):
+                changed |= self.reconcile(cursor)
+            self.synced = time.monotonic()
+            self.syncs += 1
+        return changed
+
+    def reconcile(self, cursor, chunk_size=100000):
+        # Make the live codes match the table's; returns the RoomCodes of the rows added or removed
+        cursor.execute("SELECT CODE FROM lab7_reservations")
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            chunks.append(np.array([row[0] for row in rows], dtype=np.int64))
+        in_table = np.concatenate(chunks) if chunks else np.zeros(0, np.int64)
+        with self._lock:
+            held = self.columns()["code"]
+            changed = set()
+            for code in np.setdiff1d(held, in_table).tolist():
+                changed.add(self.get(code).room)
+                self.remove(code)
+            return changed | self.fetch(cursor, np.setdiff1d(in_table, held).tolist())
+
+    def fetch(self, cursor, codes):
+        # Add the given reservation codes from the table; returns their RoomCodes
+        rooms = set()
+        for start in range(0, len(codes), IN_CHUNK):
+            chunk = codes[start:start + IN_CHUNK]
+            cursor.execute(SELECT_STAYS + f" WHERE CODE IN ({', '.join(['%s'] * len(chunk))})", chunk)
+            for row in cursor.fetchall():
+                self.add(*row)
+                rooms.add(row[1])
+        return rooms
+
+
+class RoomStays:
+    # Every live stay grouped by room: per RoomCode, NumPy arrays of reservation codes, check-in and
+    # checkout ordinals sorted by (check-in, checkout), cut straight from the store's columns. A
+    # booking or cancellation rewrites only its room's arrays and bumps that room's version; the
+    # indexes built on top (room_stats, ...) compare versions and rebuild just the rooms that moved.
+    # A room another process changed is marked stale and read back alone on the next refresh().
+    EMPTY = (np.zeros(0, np.int64), np.zeros(0, np.int32), np.zeros(0, np.int32))
+
+    def __init__(self):
+        self.rooms = {}  # RoomCode -> (codes, checkins, checkouts)
+        self.syncs = 0  # the store's catch-ups with the table; indexes re-read lab7_rooms when it moves on
+        self.versions = {}  # RoomCode -> changes so far
+        self.version = 0  # changes to any room
+        self._codes = np.zeros(0, np.int64)  # reservation codes at load time, sorted ...
+        self._code_rooms = np.zeros(0, np.int32)  # ... and their rooms, for cancellations (which only carry the code)
+        self._room_names = []
+        self._later = {}  # code -> RoomCode for stays added since
+        self._stale = set()
+        self._lock = threading.RLock()
+
+    def load(self, store):
+        columns = store.columns()
+        keep = columns["checkout"] >= columns["checkin"]
+        codes, rooms = columns["code"][keep], columns["room"][keep]
+        checkins, checkouts = columns["checkin"][keep], columns["checkout"][keep]
+        order = np.lexsort((checkouts, checkins, rooms))
+        codes, rooms, checkins, checkouts = codes[order], rooms[order], checkins[order], checkouts[order]
+        bounds = np.searchsorted(rooms, np.arange(len(store.rooms) + 1))
+        by_code = np.argsort(codes, kind="stable")
+        with self._lock:
+            for i, room in enumerate(store.rooms):
+                part = slice(bounds[i], bounds[i + 1])
+                self.rooms[room] = (codes[part], checkins[part], checkouts[part])
+            self._codes, self._code_rooms = codes[by_code], rooms[by_code]
+            self._room_names = list(store.rooms)
+        return self
+
+    def get(self, room):
+        with self._lock:
+            return self.rooms.get(room, self.EMPTY)
+
+    def _set(self, room, stays):
+        self.rooms[room] = stays
+        self.versions[room] = self.versions.get(room, 0) + 1
+        self.version += 1
+
+    def _room_of(self, code):
+        room = self._later.get(code)
+        if room is None:
+            i = int(np.searchsorted(self._codes, code))
+            if i < len(self._codes) and self._codes[i] == code:
+                room = self._room_names[self._code_rooms[i]]
+        return room
+
+    def add(self, code, room, checkin, checkout):
+        checkin, checkout = availability.to_ordinal(checkin), availability.to_ordinal(checkout)
+        with self._lock:
+            codes, checkins, checkouts = self.get(room)
+            if checkout < checkin or code in codes:
+                return
+            i = int(np.searchsorted(checkins, checkin, side="right"))
+            self._later[code] = room
+            self._set(room, (np.insert(codes, i, code), np.insert(checkins, i, checkin), np.insert(checkouts, i, checkout)))
+
+    def remove(self, code):
+        with self._lock:
+            room = self._room_of(code)
+            if room is None:
+                return
+            codes, checkins, checkouts = self.get(room)
+            found = np.flatnonzero(codes == code)
+            if len(found):
+                self._set(room, (np.delete(codes, found), np.delete(checkins, found), np.delete(checkouts, found)))
+
+    def invalidate(self, room):
+        with self._lock:
+            self._stale.add(room)
+
+    def refresh(self, cursor):
+        # Read back the rooms marked stale, one indexed query each
+        with self._lock:
+            stale, self._stale = self._stale, set()
+            for room in sorted(stale):
+                cursor.execute(statements.SQL["room_stays"], (room,))
+                stays = sorted(
+                    (availability.to_ordinal(checkin), availability.to_ordinal(checkout), code)
+                    for code, checkin, checkout in cursor.fetchall()
+                )
+                stays = [stay for stay in stays if stay[1] >= stay[0]]
+                for _, _, code in stays:
+                    self._later[code] = room
+                self._set(room, (
+                    np.array([stay[2] for stay in stays], np.int64),
+                    np.array([stay[0] for stay in stays], np.int32),
+                    np.array([stay[1] for stay in stays], np.int32),
+                ))
+
+
+def snapshot_path():
+    # INN_SNAPSHOT=path turns snapshots on ("1" for the default file next to the app); each shard
+    # gets its own file, suffixed with the shard name
+    path = os.getenv("INN_SNAPSHOT", "")
+    if path.lower() in ("", "0", "false", "no"):
+        return None
+    path = DEFAULT_SNAPSHOT if path.lower() in ("1", "true", "yes") else path
+    name = db.get_pool().name
+    return path if name is None else f"{path}.{name}"
+
+
+def database_name():
+    # Identifies the configured database, so a snapshot of another one is never used
+    backend = db.get_pool().backend
+    if backend.name == "sqlite":
+        return f"sqlite:{os.path.abspath(backend.path)}"
+    return f"mysql:{backend.params['host']}/{backend.params['database']}"
+
+
+def open_store(cursor, path=None, save=True):
+    # From the snapshot plus a catch-up when there is a usable one, else a full read (which then
+    # rewrites the snapshot unless save is False)
+    source = database_name()
+    if path and os.path.exists(path):
+        try:
+            store = ReservationStore().open_snapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"Error: ignoring reservation snapshot {path}: {e}")
+        else:
+            if store.source == source and store.sync(cursor) is not None:
+                return store
+    store = ReservationStore().load(cursor)
+    store.source = source
+    if path and save:
+        store.save(path)
+    return store
+
+
+def get_store(cursor):
+    # The current database's store, caught up with the table when another process changed a room
+    # or SYNC_INTERVAL has passed (rooms found changed are announced with events.room_changed, so
+    # RoomStays re-reads them), then with the bookings this process announced since the last call
+    store = db.pool_cached("reservation_store", lambda: open_store(cursor, snapshot_path()))
+    if store.outdated or time.monotonic() - store.synced >= SYNC_INTERVAL:
+        changed = store.sync(cursor)
+        if changed is None:
+            reset()
+            return get_store(cursor)
+        for room in sorted(changed):
+            events.room_changed(room)
+        store.outdated = False  # set again by those announcements, which are already handled
+    store.fetch_pending(cursor)
+    return store
+
+
+def get_room_stays(cursor):
+    # Every read of the indexes built on RoomStays comes through here, so they are at most
+    # SYNC_INTERVAL behind other processes
+    stays = db.pool_cached("room_stays", lambda: RoomStays().load(get_store(cursor)))
+    stays.syncs = get_store(cursor).syncs
+    stays.refresh(cursor)
+    return stays
+
+
+def reset():
+    # Drop the store; with a snapshot the next get_store() only catches up on what changed since it
+    state = db.pool_state()
+    state.pop("reservation_store", None)
+    state.pop("room_stays", None)
+
+
+def _added(code, room, checkin, checkout):
+    # The event has no rate or party size, so the store reads the row itself on next use
+    store, stays = db.pool_state().get("reservation_store"), db.pool_state().get("room_stays")
+    if store is not None:
+        store.announce(code)
+    if stays is not None:
+        stays.add(code, room, checkin, checkout)
+
+
+def _removed(code):
+    store, stays = db.pool_state().get("reservation_store"), db.pool_state().get("room_stays")
+    if store is not None:
+        store.remove(code)
+    if stays is not None:
+        stays.remove(code)
+
+
+def _room_changed(room):
+    store, stays = db.pool_state().get("reservation_store"), db.pool_state().get("room_stays")
+    if store is not None:
+        store.outdated = True
+    if stays is not None:
+        stays.invalidate(room)
+
+
+events.subscribe(_added, _removed, reset, _room_changed)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a memory-mappable snapshot of lab7_reservations")
+    parser.add_argument("--path", help="snapshot file (default INN_SNAPSHOT or src/reservations.snapshot)")
+    parser.add_argument("--db", help="SQLite file to read (default: the configured INN_DB_BACKEND)")
+    args = parser.parse_args(argv)
+
+    if args.db:
+        db.configure(db.SQLiteBackend(args.db))
+    conn = db.get_db_connection()
+    if conn is None:
+        return 1
+    try:
+        # Resolved only now, once --db has picked the database (and with it the pool's name)
+        path = args.path or snapshot_path() or DEFAULT_SNAPSHOT
+        store = open_store(conn.cursor(), path, save=False)
+        store.save(path)
+    except (*db.Error, OSError) as err:
+        print(f"Error: {err}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+    print(f"Wrote {len(store)} reservations to {path}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
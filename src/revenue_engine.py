@@ -0,0 +1,94 @@
+from datetime import date, timedelta
+
+import numpy as np
+
+PERIODS = ("day", "week", "month")
+
+
+def _ordinal(value):
+    if isinstance(value, str):
+        value = date.fromisoformat(value[:10])
+    return value.toordinal()
+
+
+def _next_period(day, period):
+    if period == "month":
+        return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+    return day + timedelta(days=7 if period == "week" else 1)
+
+
+def period_starts(start, end, period="month"):
+    # First day of every period that intersects [start, end); the first period is clipped to start
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}' (expected one of {', '.join(PERIODS)})")
+    starts = []
+    current = start
+    while current < end:
+        starts.append(current)
+        current = _next_period(current, period)
+    return starts
+
+
+def stay_arrays(reservations, rooms=None):
+    # (Room, CheckIn, Checkout, Rate) rows -> room labels plus parallel NumPy columns.
+    # Rates are kept in integer cents so sums are exact, like the Decimal arithmetic they replace.
+    # rooms ({room: row}) fixes the room rows up front, so several batches share one layout.
+    reservations = list(reservations)
+    if rooms is None:
+        labels, room_index = np.unique(np.array([row[0] for row in reservations], dtype=object), return_inverse=True)
+    else:
+        labels = rooms
+        room_index = np.fromiter((rooms[row[0]] for row in reservations), dtype=np.intp, count=len(reservations))
+    checkins = np.fromiter((_ordinal(row[1]) for row in reservations), dtype=np.int64, count=len(reservations))
+    checkouts = np.fromiter((_ordinal(row[2]) for row in reservations), dtype=np.int64, count=len(reservations))
+    cents = np.fromiter((round(float(row[3]) * 100) for row in reservations), dtype=np.int64, count=len(reservations))
+    return list(labels), room_index, checkins, checkouts, cents
+
+
+def period_totals(room_index, checkins, checkouts, cents, room_count, start, end, period="month"):
+    # (period starts, nights sold, revenue in cents), the counts shaped (room_count, periods). Each stay
+    # is clipped to [start, end) and walked period by period, adding rate x nights to every period it
+    # touches, so the cost follows the stays (and the periods they cross), never the days in the range.
+    starts = period_starts(start, end, period)
+    bounds = np.array([day.toordinal() for day in starts] + [end.toordinal()], dtype=np.int64)
+    lo = np.maximum(checkins, bounds[0])
+    hi = np.minimum(checkouts, bounds[-1])
+    keep = hi > lo
+    room_index, lo, hi, cents = room_index[keep], lo[keep], hi[keep], cents[keep]
+    column = np.searchsorted(bounds, lo, side="right") - 1
+
+    nights = np.zeros((room_count, len(starts)), dtype=np.int64)
+    revenue = np.zeros((room_count, len(starts)), dtype=np.int64)
+    while len(lo):
+        boundary = bounds[column + 1]
+        part = np.minimum(hi, boundary) - lo
+        np.add.at(nights, (room_index, column), part)
+        np.add.at(revenue, (room_index, column), part * cents)
+        more = hi > boundary
+        room_index, lo, hi, cents, column = room_index[more], boundary[more], hi[more], cents[more], column[more] + 1
+    return starts, nights, revenue
+
+
+def revenue_report(reservations, start, end, period="month", group_by="room"):
+    # group_by="room": {room: {period_start: amount}}; group_by="period": {period_start: amount}
+    if isinstance(start, str):
+        start = date.fromisoformat(start)
+    if isinstance(end, str):
+        end = date.fromisoformat(end)
+    if end <= start:
+        raise ValueError("End date must be after start date")
+    if group_by not in ("room", "period"):
+        raise ValueError(f"Unknown grouping '{group_by}' (expected 'room' or 'period')")
+    labels, room_index, checkins, checkouts, cents = stay_arrays(reservations)
+    if group_by == "period":
+        # Every stay in one row
+        starts, _, totals = period_totals(np.zeros_like(room_index), checkins, checkouts, cents, 1, start, end, period)
+        return {day: int(totals[0, i]) / 100 for i, day in enumerate(starts)}
+    starts, _, matrix = period_totals(room_index, checkins, checkouts, cents, len(labels), start, end, period)
+    return {room: {day: int(matrix[r, i]) / 100 for i, day in enumerate(starts)} for r, room in enumerate(labels)}
+
+
+def monthly_revenue(reservations, year):
+    # {room: {month number: amount}} for one calendar year, the shape revenue() prints
+    report = revenue_report(reservations, date(year, 1, 1), date(year + 1, 1, 1))
+    return {room: {day.month: amount for day, amount in months.items()} for room, months in report.items()}
@@ -0,0 +1,167 @@
+import threading
+from datetime import date
+
+import numpy as np
+
+import db
+import events
+import reservation_store
+from availability import to_ordinal
+
+POPULARITY_WINDOW = 180
+_CACHED_DATES = 8
+
+
+class RoomHistory:
+    # One room's stays as sorted NumPy arrays: check-ins (with the furthest checkout reached so far),
+    # checkouts (with their check-ins) and running sums of both. Occupied nights, the next free night
+    # and the last stay are each a searchsorted or two, however much history the room has.
+    def __init__(self, checkins, checkouts):
+        # checkins, checkouts: ordinals sorted by (checkin, checkout), as reservation_store.RoomStays keeps them
+        self.checkins = checkins
+        self.reach = np.maximum.accumulate(checkouts) if len(checkouts) else checkouts
+        order = np.lexsort((checkins, checkouts))
+        self.checkouts = checkouts[order]
+        self.checkout_checkins = checkins[order]
+        self.checkin_sums = np.concatenate([[0], np.cumsum(checkins, dtype=np.int64)])
+        self.checkout_sums = np.concatenate([[0], np.cumsum(self.checkouts, dtype=np.int64)])
+
+    def nights_before(self, day):
+        # Nights occupied before `day`: each stay checked in before it counts day - checkin, less
+        # day - checkout if it also checked out before it
+        started = int(np.searchsorted(self.checkins, day))
+        ended = int(np.searchsorted(self.checkouts, day))
+        return day * started - int(self.checkin_sums[started]) - (day * ended - int(self.checkout_sums[ended]))
+
+    def next_available(self, day):
+        # First night on or after `day` that no stay covers
+        while True:
+            i = int(np.searchsorted(self.checkins, day, side="right"))
+            if not i or self.reach[i - 1] <= day:
+                return day
+            day = int(self.reach[i - 1])
+
+    def last_stay(self, as_of):
+        i = int(np.searchsorted(self.checkouts, as_of, side="right"))
+        return (int(self.checkouts[i - 1]), int(self.checkout_checkins[i - 1])) if i else None
+
+
+class RoomStats:
+    # A RoomHistory per room, built from the shared reservation_store.RoomStays on first use and
+    # rebuilt only for the rooms whose stays changed since (their version moved on).
+    def __init__(self, stays):
+        self.rooms = {}
+        self.stays = stays
+        self._histories = {}  # room -> (RoomStays version it was built from, RoomHistory)
+        self._tables = {}  # (as_of, window) -> (RoomStays.version, rows)
+        self.syncs = 0  # RoomStays.syncs when the rooms were read
+        self._lock = threading.RLock()
+
+    def load(self, cursor):
+        # (Re)read the rooms; get_stats() calls it again once the store has caught up with the table
+        cursor.execute("SELECT RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor FROM lab7_rooms")
+        rooms = {room[0]: tuple(room) for room in cursor.fetchall()}
+        with self._lock:
+            self.rooms = rooms
+            self.syncs = self.stays.syncs
+            self._tables.clear()
+        return self
+
+    def use(self, stays):
+        # The stays were reloaded (reservation_store.reset()); start over from the new ones
+        with self._lock:
+            self.stays = stays
+            self._histories.clear()
+            self._tables.clear()
+
+    def history(self, room):
+        version = self.stays.versions.get(room, 0)
+        with self._lock:
+            built = self._histories.get(room)
+            if built is None or built[0] != version:
+                _, checkins, checkouts = self.stays.get(room)
+                built = self._histories[room] = (version, RoomHistory(checkins, checkouts))
+            return built[1]
+
+    def occupied_nights(self, room, first, end):
+        # Occupied nights in [first, end)
+        history = self.history(room)
+        return history.nights_before(to_ordinal(end)) - history.nights_before(to_ordinal(first))
+
+    def popularity(self, room, as_of, window=POPULARITY_WINDOW):
+        # Share of the last `window` nights before as_of that the room was occupied
+        as_of = to_ordinal(as_of)
+        return round(self.occupied_nights(room, as_of - window, as_of) / window, 2)
+
+    def next_available(self, room, as_of):
+        # First night on or after as_of when the room is free
+        return date.fromordinal(self.history(room).next_available(to_ordinal(as_of)))
+
+    def last_stay(self, room, as_of):
+        # (checkout, checkin) ordinals of the latest stay that checked out on or before as_of, or None
+        return self.history(room).last_stay(to_ordinal(as_of))
+
+    def recent_stay_length(self, room, as_of):
+        # Nights in the latest stay that checked out on or before as_of
+        stay = self.last_stay(room, as_of)
+        return stay[0] - stay[1] if stay else 0
+
+    def table(self, as_of, window=POPULARITY_WINDOW):
+        # list_rooms rows, most popular first; repeated reads for the same date are served from the
+        # cache until a booking or cancellation comes in
+        key = (to_ordinal(as_of), window)
+        with self._lock:
+            version = self.stays.version
+            cached = self._tables.get(key)
+            if cached is None or cached[0] != version:
+                rows = [
+                    room + (self.popularity(code, as_of, window), self.next_available(code, as_of), self.recent_stay_length(code, as_of))
+                    for code, room in self.rooms.items()
+                ]
+                rows.sort(key=lambda row: row[7], reverse=True)
+                if len(self._tables) >= _CACHED_DATES:
+                    self._tables.clear()
+                cached = self._tables[key] = (version, rows)
+            return cached[1]
+
+
+def combined_table(all_stats, as_of, window=POPULARITY_WINDOW):
+    # table() over several RoomStats that each hold part of the same rooms' history (shards split by year)
+    as_of = to_ordinal(as_of)
+    rooms = {}
+    for stats in all_stats:
+        for code, room in stats.rooms.items():
+            rooms.setdefault(code, room)
+    rows = []
+    for code, room in rooms.items():
+        nights = sum(stats.occupied_nights(code, as_of - window, as_of) for stats in all_stats)
+        # Move past every shard's stays until none of them pushes the date any later
+        day = as_of
+        while True:
+            later = max(stats.next_available(code, day).toordinal() for stats in all_stats)
+            if later == day:
+                break
+            day = later
+        stays = [stay for stay in (stats.last_stay(code, as_of) for stats in all_stats) if stay is not None]
+        last = max(stays) if stays else None
+        rows.append(room + (round(nights / window, 2), date.fromordinal(day), last[0] - last[1] if last else 0))
+    rows.sort(key=lambda row: row[7], reverse=True)
+    return rows
+
+
+def get_stats(cursor):
+    stays = reservation_store.get_room_stays(cursor)
+    stats = db.pool_cached("room_stats", lambda: RoomStats(stays).load(cursor))
+    if stats.stays is not stays:
+        stats.use(stays)
+    if stats.syncs != stays.syncs:
+        stats.load(cursor)
+    return stats
+
+
+def reset():
+    db.pool_state().pop("room_stats", None)
+
+
+# Bookings and cancellations reach the statistics through reservation_store.RoomStays
+events.subscribe(reset=reset)
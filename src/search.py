@@ -0,0 +1,79 @@
+from datetime import date
+
+import statements
+
+# Name and room patterns accept shell-style (* ?) or SQL-style (% _) wildcards and become LIKE filters
+# (case-insensitive on both backends). A pattern without wildcards matches the whole name, like the
+# old LIKE filter; "Jo*" or "A1*" is a prefix search answered from the name and room indexes (see
+# migrations.py), while a leading wildcard ("*son") has to look at every row the other filters leave.
+# Known full scan: with no criteria at all, or only patterns that start with a wildcard, a search
+# walks every reservation in CODE order (a page at a time, but the last page still reads them all).
+
+PAGE_SIZE = 50
+
+
+def normalize(pattern):
+    return (pattern or "").strip().lower().replace("%", "*").replace("_", "?")
+
+
+SELECT_RESERVATIONS = """
+SELECT CODE, Room, CheckIn, Checkout, Rate, LastName, FirstName, Adults, Kids, RoomName
+FROM lab7_reservations
+INNER JOIN lab7_rooms ON Room = RoomCode
+WHERE {conditions}
+ORDER BY CODE
+LIMIT %s
+"""
+
+
+def _like(pattern):
+    # Shell-style pattern -> SQL LIKE pattern
+    return normalize(pattern).replace("*", "%").replace("?", "_")
+
+
+def _conditions(code, room, checkin, checkout, first_name="", last_name=""):
+    # WHERE conditions and their params; the last condition is the keyset one, whose value (the CODE
+    # to start after) the caller appends
+    conditions, params = [], []
+    indexed = False
+    if code not in (None, ""):
+        conditions.append("CODE = %s")
+        params.append(int(code))
+        indexed = True
+    for column, pattern in (("FirstName", first_name), ("LastName", last_name), ("Room", room)):
+        if pattern:
+            conditions.append(f"{column} LIKE %s")
+            params.append(_like(pattern))
+            indexed = indexed or not _like(pattern).startswith(("%", "_"))
+    # Any stay overlapping [checkin, checkout), not just exact date matches
+    if checkin:
+        # Checkout isn't indexed for this; a stay still in on checkin checked in at most MAX_STAY_NIGHTS before
+        conditions.append("Checkout > %s AND CheckIn >= %s")
+        params += [date.fromisoformat(str(checkin)), statements.earliest_checkin(str(checkin))]
+    if checkout:
+        conditions.append("CheckIn < %s")
+        params.append(date.fromisoformat(str(checkout)))
+    indexed = indexed or bool(checkin or checkout)
+    # Walking CODE upwards reads rows until a page of matches turns up, fine when no index can narrow
+    # them down; otherwise the unary + keeps the planner from preferring that walk over the index
+    conditions.append("+CODE > %s" if indexed else "CODE > %s")
+    return conditions, params
+
+
+def search(conn, first_name="", last_name="", code="", room="", checkin=None, checkout=None, after=0, limit=PAGE_SIZE):
+    # One page of matches ordered by CODE, starting after reservation code `after` (keyset pagination).
+    # Returns (rows, next_after); next_after is None on the last page.
+    # Statement text only depends on which filters are present, so each shape is prepared once per connection.
+    conditions, params = _conditions(code, room, checkin, checkout, first_name, last_name)
+    params.append(after)
+    sql = SELECT_RESERVATIONS.format(conditions=" AND ".join(conditions))
+    rows = statements.execute_sql(conn, sql, params + [limit]).fetchall()
+    return rows, (rows[-1][0] if len(rows) == limit else None)
+
+
+def iter_search(conn, first_name="", last_name="", code="", room="", checkin=None, checkout=None, page_size=500):
+    # Every match, one page at a time, without holding the full result in memory
+    after = 0
+    while after is not None:
+        rows, after = search(conn, first_name, last_name, code, room, checkin, checkout, after, page_size)
+        yield from rows
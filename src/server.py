@@ -0,0 +1,287 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from decimal import Decimal
+from functools import partial
+from urllib.parse import parse_qsl, urlsplit
+
+import db
+import journal
+import metrics
+import service
+
+# JSON over HTTP/1.1 for the menu operations:
+#   GET    /rooms?as_of=YYYY-MM-DD
+#   GET    /availability?checkin=&checkout=&bed_type=&guests=&room=
+#   GET    /alternatives?checkin=&checkout=&guests=&bed_type=&flex_days=7&limit=5
+#   GET    /calendar?month=YYYY-MM&room=
+#   POST   /reservations            {"first_name", "last_name", "room", "checkin", "checkout", "adults", "kids", "property"}   (property: with INN_SHARDS, when several have the room)
+#   DELETE /reservations/<code>     (<code> may be a J<id> journal reference when INN_JOURNAL=1, <shard>:<code> with INN_SHARDS)
+#   GET    /journal/<id>            status of a journaled booking or cancellation
+#   GET    /reservations?first_name=&last_name=&code=&room=&checkin=&checkout=   (streamed as JSON lines; with no code,
+#          room, dates or name prefix, e.g. only last_name=*son, it reads every reservation)
+#   GET    /revenue?start=&end=&period=month|week|day&group_by=room|period
+#   GET    /metrics?format=prometheus|json   (query metrics; needs --metrics or INN_METRICS=1)
+# Connections are kept alive; database calls run on a thread pool no larger than the connection pool.
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+STREAM_BATCH = 200
+WRITE_TIMEOUT = float(os.getenv("INN_SERVER_WRITE_TIMEOUT", "30"))  # seconds a streaming client may stall
+
+REASONS = {200: "OK", 201: "Created", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class StreamAborted(Exception):
+    pass
+
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value):
+    return json.dumps(value, default=_json_default)
+
+
+class Server:
+    def __init__(self, workers=None):
+        self.workers = workers or db.get_pool().max_size
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="db")
+        self.routes = {
+            ("GET", "/rooms"): self.list_rooms,
+            ("GET", "/availability"): self.find_rooms,
+            ("GET", "/alternatives"): self.alternatives,
+            ("GET", "/calendar"): self.calendar,
+            ("POST", "/reservations"): self.reserve,
+            ("DELETE", "/reservations"): self.cancel,
+            ("GET", "/reservations"): self.search,
+            ("GET", "/revenue"): self.revenue,
+            ("GET", "/journal"): self.journal_entry,
+            ("GET", "/metrics"): self.metrics,
+        }
+
+    async def run_db(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    # Handlers return (status, body) or stream the response themselves and return None
+
+    async def list_rooms(self, query, body, writer, argument):
+        return 200, await self.run_db(service.list_rooms, query.get("as_of"))
+
+    async def find_rooms(self, query, body, writer, argument):
+        return 200, await self.run_db(
+            service.find_rooms, query.get("checkin"), query.get("checkout"), query.get("bed_type", "Any"),
+            query.get("guests", 1), query.get("room", "Any"),
+        )
+
+    async def alternatives(self, query, body, writer, argument):
+        return 200, await self.run_db(
+            service.alternatives, query.get("checkin"), query.get("checkout"), query.get("guests", 1),
+            query.get("bed_type", "Any"), query.get("flex_days", 7), query.get("limit", 5),
+        )
+
+    async def calendar(self, query, body, writer, argument):
+        return 200, await self.run_db(service.calendar, query.get("month"), query.get("room"))
+
+    async def reserve(self, query, body, writer, argument):
+        if not isinstance(body, dict):
+            raise HTTPError(400, "Expected a JSON object")
+        try:
+            args = {key: body[key] for key in ("first_name", "last_name", "room", "checkin", "checkout")}
+        except KeyError as e:
+            raise HTTPError(400, f"Missing field {e}")
+        return 201, await self.run_db(service.reserve, adults=body.get("adults", 1), kids=body.get("kids", 0), property=body.get("property"), **args)
+
+    async def cancel(self, query, body, writer, argument):
+        if argument is None:
+            raise HTTPError(405, "DELETE needs a reservation code: /reservations/<code>")
+        return 200, await self.run_db(service.cancel, argument)
+
+    async def search(self, query, body, writer, argument):
+        filters = {key: query[key] for key in ("first_name", "last_name", "code", "room", "checkin", "checkout") if key in query}
+        # Fetch the first page before sending headers so bad input still gets a proper error status.
+        # Every page is a separate call with its own connection; only the position is kept in between.
+        rows, after = await self.run_db(service.search_page, limit=STREAM_BATCH, **filters)
+        await self.start_stream(writer)
+        try:
+            while True:
+                if rows:
+                    await self.send_chunk(writer, "".join(_dumps(row) + "\n" for row in rows).encode())
+                if after is None:
+                    break
+                rows, after = await self.run_db(service.search_page, after=after, limit=STREAM_BATCH, **filters)
+        except (service.ServiceError, *db.Error) as e:
+            # Headers are already out; all we can do is cut the stream short
+            raise StreamAborted(str(e))
+        await self.send_chunk(writer, b"")
+
+    async def journal_entry(self, query, body, writer, argument):
+        if argument is None:
+            raise HTTPError(404, "GET needs a journal reference: /journal/<id>")
+        return 200, await self.run_db(service.journal_entry, argument)
+
+    async def revenue(self, query, body, writer, argument):
+        return 200, await self.run_db(
+            service.revenue, query.get("start"), query.get("end"), query.get("period", "month"), query.get("group_by", "room"),
+        )
+
+    async def metrics(self, query, body, writer, argument):
+        if not metrics.enabled():
+            raise HTTPError(404, "Metrics are disabled; start the server with --metrics")
+        if query.get("format") == "json":
+            return 200, metrics.registry.snapshot()
+        data = metrics.dump_prometheus().encode()
+        writer.write(
+            f"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data
+        )
+        await writer.drain()
+
+    async def start_stream(self, writer):
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n")
+        await writer.drain()
+
+    async def send_chunk(self, writer, data):
+        writer.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        try:
+            await asyncio.wait_for(writer.drain(), WRITE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise StreamAborted(f"client stopped reading for {WRITE_TIMEOUT}s; stream closed")
+
+    async def respond(self, writer, status, payload, keep_alive):
+        data = _dumps(payload).encode()
+        headers = (
+            f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(headers.encode() + data)
+        await writer.drain()
+
+    async def read_request(self, reader):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise HTTPError(413, "Request headers too large")
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, version = lines[0].split(" ", 2)
+        except ValueError:
+            raise HTTPError(400, "Malformed request line")
+        headers = {}
+        for line in lines[1:]:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length", 0) or 0)
+        except ValueError:
+            raise HTTPError(400, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise HTTPError(413, "Request body too large")
+        raw = await reader.readexactly(length) if length else b""
+        keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+        return method.upper(), target, raw, keep_alive
+
+    async def dispatch(self, method, target, raw, writer, keep_alive):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        path, argument = url.path.rstrip("/") or "/", None
+        if (method, path) not in self.routes and path.count("/") == 2:
+            path, argument = path.rsplit("/", 1)
+        handler = self.routes.get((method, path))
+        if handler is None:
+            known = any(route_path == path for _, route_path in self.routes)
+            raise HTTPError(405 if known else 404, f"No route for {method} {url.path}")
+        try:
+            body = json.loads(raw) if raw else None
+        except ValueError:
+            raise HTTPError(400, "Body is not valid JSON")
+        result = await handler(query, body, writer, argument)
+        if result is not None:
+            await self.respond(writer, result[0], result[1], keep_alive)
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                keep_alive = False
+                try:
+                    request = await self.read_request(reader)
+                    if request is None:
+                        break
+                    method, target, raw, keep_alive = request
+                    await self.dispatch(method, target, raw, writer, keep_alive)
+                except HTTPError as e:
+                    await self.respond(writer, e.status, {"error": str(e)}, keep_alive)
+                except service.ServiceError as e:
+                    await self.respond(writer, e.status, {"error": str(e)}, keep_alive)
+                except db.Error as e:
+                    await self.respond(writer, 500, {"error": f"Database error: {e}"}, keep_alive)
+                except StreamAborted as e:
+                    print(f"Error: {e}", file=sys.stderr)
+                    # Drop whatever is still buffered for a client that isn't reading
+                    writer.transport.abort()
+                    break
+                except Exception as e:
+                    print(f"Unexpected error: {e}", file=sys.stderr)
+                    await self.respond(writer, 500, {"error": "Internal server error"}, False)
+                    break
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8365, unix_path=None):
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle, path=unix_path, limit=MAX_HEADER_BYTES)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER_BYTES, backlog=1024)
+            where = f"http://{host}:{port}"
+        print(f"Serving reservations on {where}", file=sys.stderr)
+        async with server:
+            await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the reservation operations as JSON over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("INN_SERVER_PORT", "8365")))
+    parser.add_argument("--unix", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--pool-size", type=int, default=int(os.getenv("INN_DB_POOL_SIZE", "10")), help="database connections (and worker threads)")
+    parser.add_argument("--metrics", action="store_true", help="record query metrics and serve them at /metrics")
+    parser.add_argument("--slow-query-ms", type=float, help="slow-query log threshold (default INN_SLOW_QUERY_MS or 100)")
+    args = parser.parse_args(argv)
+
+    if args.metrics or args.slow_query_ms is not None:
+        metrics.enable(args.slow_query_ms)
+    db.configure(max_size=args.pool_size)
+    try:
+        asyncio.run(Server(args.pool_size).serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        journal.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
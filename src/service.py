@@ -0,0 +1,316 @@
+from contextlib import contextmanager
+from datetime import date, timedelta
+
+import db
+import availability
+import booking
+import events
+import journal
+import metrics
+import occupancy
+import pricing
+import revenue_engine
+import room_stats
+import search as search_index
+import shards
+import statements
+
+# Non-interactive versions of the menu operations in main.py; they return plain data and raise
+# ServiceError instead of printing, so they can sit behind the network front-end in server.py.
+# With INN_SHARDS set they read from every relevant shard at once and book in the owning one (shards.py).
+
+ROOM_FIELDS = ("RoomCode", "RoomName", "Beds", "bedType", "maxOcc", "basePrice", "decor")
+MAX_REVENUE_DAYS = 3660  # ten years; a daily report over that is still only 3660 columns per room
+RESERVATION_FIELDS = ("CODE", "Room", "CheckIn", "Checkout", "Rate", "LastName", "FirstName", "Adults", "Kids", "RoomName")
+
+
+class ServiceError(Exception):
+    status = 400
+
+
+class NotFound(ServiceError):
+    status = 404
+
+
+class Conflict(ServiceError):
+    status = 409
+
+
+class Unavailable(ServiceError):
+    status = 503
+
+
+def _date(value, name):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value))
+    except ValueError:
+        raise ServiceError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def _int(value, name):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ServiceError(f"{name} must be a whole number")
+
+
+@contextmanager
+def _connection():
+    conn = db.get_db_connection()
+    if conn is None:
+        raise Unavailable("Failed to connect to the database.")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+@metrics.operation("list_rooms")
+def list_rooms(as_of=None):
+    as_of = _date(as_of, "as_of") if as_of else date.today()
+    fields = ROOM_FIELDS + ("popularity", "next_available", "recent_stay_length")
+    if shards.enabled():
+        rows = shards.room_table(as_of)
+        fields += ("property",)
+    else:
+        with _connection() as conn:
+            rows = room_stats.get_stats(conn.cursor()).table(as_of)
+    return [dict(zip(fields, row)) for row in rows]
+
+
+@metrics.operation("find_rooms")
+def find_rooms(checkin, checkout, bed_type="Any", guests=1, room="Any"):
+    checkin, checkout = _date(checkin, "checkin"), _date(checkout, "checkout")
+    if checkout <= checkin:
+        raise ServiceError("checkout must be after checkin")
+    fields = ROOM_FIELDS
+    if shards.enabled():
+        rooms = shards.free_rooms(checkin, checkout, bed_type, _int(guests, "guests"), room)
+        fields += ("property",)
+    else:
+        with _connection() as conn:
+            rooms = availability.get_index(conn.cursor()).free_rooms(checkin, checkout, bed_type, _int(guests, "guests"), room)
+    quotes = pricing.quote_batch(checkin, checkout, [row[5] for row in rooms]) if rooms else []
+    return [dict(zip(fields, row), total_cost=float(quote)) for row, quote in zip(rooms, quotes)]
+
+
+@metrics.operation("alternatives")
+def alternatives(checkin, checkout, guests=1, bed_type="Any", flex_days=7, limit=5):
+    # Rooms for the party on the requested dates or the nearest free dates within +/- flex_days
+    checkin, checkout = _date(checkin, "checkin"), _date(checkout, "checkout")
+    if checkout <= checkin:
+        raise ServiceError("checkout must be after checkin")
+    flex_days, limit = _int(flex_days, "flex_days"), _int(limit, "limit")
+    if not 0 <= flex_days <= 366:
+        raise ServiceError("flex_days must be between 0 and 366")
+    fields = ROOM_FIELDS
+    if shards.enabled():
+        suggestions = shards.suggest(checkin, checkout, _int(guests, "guests"), bed_type, flex_days, limit)
+        fields += ("property",)
+    else:
+        with _connection() as conn:
+            suggestions = occupancy.get_matrix(conn.cursor()).suggest(checkin, checkout, _int(guests, "guests"), bed_type, flex_days, limit)
+    quotes = pricing.quote_batch([start for _, start, _ in suggestions], [end for _, _, end in suggestions], [room[5] for room, _, _ in suggestions]) if suggestions else []
+    return [
+        dict(zip(fields, room), checkin=start, checkout=end, total_cost=float(quote))
+        for (room, start, end), quote in zip(suggestions, quotes)
+    ]
+
+
+@metrics.operation("calendar")
+def calendar(month=None, room=None):
+    # Free nights per room for one month ("YYYY-MM", default this month)
+    try:
+        year, number = map(int, str(month).split("-")) if month else (date.today().year, date.today().month)
+        date(year, number, 1)
+    except ValueError:
+        raise ServiceError("month must be YYYY-MM")
+    if shards.enabled():
+        free = shards.month_calendar(year, number, [room] if room else None)
+    else:
+        with _connection() as conn:
+            free = occupancy.get_matrix(conn.cursor()).month_calendar(year, number, [room] if room else None)
+    return {code: [day.isoformat() for day in days] for code, days in free.items()}
+
+
+@metrics.operation("reserve")
+def reserve(first_name, last_name, room, checkin, checkout, adults=1, kids=0, property=None):
+    # `property` picks the property's room when shards hold several with that RoomCode
+    checkin, checkout = _date(checkin, "checkin"), _date(checkout, "checkout")
+    adults, kids = _int(adults, "adults"), _int(kids, "kids")
+    if checkout <= checkin:
+        raise ServiceError("checkout must be after checkin")
+    if (checkout - checkin).days > statements.MAX_STAY_NIGHTS:
+        raise ServiceError(f"a stay can be at most {statements.MAX_STAY_NIGHTS} nights")
+    if adults < 0 or kids < 0 or adults + kids == 0:
+        raise ServiceError("invalid number of guests")
+    if shards.enabled():
+        return _reserve_sharded(first_name, last_name, room, checkin, checkout, adults, kids, property or None)
+    with _connection() as conn:
+        index = availability.get_index(conn.cursor())
+        details = index.rooms.get(room)
+        if details is None:
+            raise NotFound(f"Unknown room {room}")
+        if adults + kids > details[4]:
+            raise ServiceError(f"Room {room} holds at most {details[4]} guests")
+        total_cost = pricing.stay_cost(checkin, checkout, details[5])
+        try:
+            if journal.enabled():
+                # Confirmed from the local journal; CODE arrives later (see journal_entry)
+                entry_id = journal.get_journal().book(room, checkin, checkout, total_cost, last_name, first_name, adults, kids)
+                code, entry = None, journal.reference(entry_id)
+            else:
+                code, _ = booking.book(conn, room, checkin, checkout, total_cost, last_name, first_name, adults, kids)
+                entry = None
+        except booking.RoomUnavailable as e:
+            raise Conflict(str(e))
+    return {
+        "CODE": code, "journal": entry, "Room": room, "RoomName": details[1], "bedType": details[3], "CheckIn": checkin, "Checkout": checkout,
+        "FirstName": first_name, "LastName": last_name, "Adults": adults, "Kids": kids, "total_cost": total_cost,
+    }
+
+
+def _room(conn, room):
+    return availability.get_index(conn.cursor()).rooms.get(room)
+
+
+def _reserve_sharded(first_name, last_name, room, checkin, checkout, adults, kids, property):
+    try:
+        home = shards.owner(room, checkin, property)
+    except LookupError as e:
+        raise ServiceError(str(e))
+    details = home.run(_room, room) if home is not None else None
+    if details is None:
+        raise NotFound(f"Unknown room {room} for {checkin.year}")
+    if adults + kids > details[4]:
+        raise ServiceError(f"Room {room} holds at most {details[4]} guests")
+    total_cost = pricing.stay_cost(checkin, checkout, details[5])
+    try:
+        shard, code = shards.book(room, checkin, checkout, total_cost, last_name, first_name, adults, kids, home.property)
+    except booking.RoomUnavailable as e:
+        raise Conflict(str(e))
+    return {
+        "CODE": shards.format_code(shard, code), "journal": None, "Room": room, "RoomName": details[1], "bedType": details[3], "CheckIn": checkin,
+        "Checkout": checkout, "FirstName": first_name, "LastName": last_name, "Adults": adults, "Kids": kids, "total_cost": total_cost,
+        "property": shard.property,
+    }
+
+
+@metrics.operation("cancel")
+def cancel(code):
+    entry_id = journal.parse_reference(code) if journal.enabled() else None
+    if entry_id is not None:
+        return _cancel_journaled(entry_id)
+    if shards.enabled():
+        return _cancel_sharded(code)
+    code = _int(code, "code")
+    with _connection() as conn:
+        rows = statements.execute(conn, "reservation", (code,)).fetchall()
+        if not rows:
+            raise NotFound("No reservation found with the given code.")
+        reservation = rows[0]
+        if journal.enabled():
+            journal.get_journal().cancel(code=code, stay=reservation[1:4])
+        else:
+            statements.execute(conn, "delete_reservation", (code,))
+            conn.commit()
+            events.reservation_removed(code)
+    return dict(zip(("CODE", "Room", "CheckIn", "Checkout", "LastName", "FirstName"), reservation))
+
+
+def _cancel_sharded(code):
+    try:
+        found = shards.find_reservation(code)
+    except ValueError:
+        raise ServiceError("code must be a reservation code, optionally <shard>:<code>")
+    except LookupError as e:
+        raise ServiceError(str(e))
+    if found is None:
+        raise NotFound("No reservation found with the given code.")
+    shard, reservation = found
+    shards.cancel(shard, reservation[0])
+    return dict(zip(("CODE", "Room", "CheckIn", "Checkout", "LastName", "FirstName"), (shards.format_code(shard, reservation[0]),) + tuple(reservation[1:])))
+
+
+def _cancel_journaled(entry_id):
+    entry = journal.get_journal().entry(entry_id)
+    if entry is None or entry["kind"] != "book":
+        raise NotFound("No reservation found with the given code.")
+    if entry["status"] == "rejected":
+        raise Conflict(f"Booking {journal.reference(entry_id)} was not accepted: {entry['detail']}")
+    journal.get_journal().cancel(code=entry["code"], entry=entry_id)
+    booked = entry["payload"]
+    return {
+        "CODE": entry["code"], "journal": journal.reference(entry_id), "Room": booked["room"], "CheckIn": booked["checkin"],
+        "Checkout": booked["checkout"], "LastName": booked["last_name"], "FirstName": booked["first_name"],
+    }
+
+
+def journal_entry(reference):
+    # Status of a journaled write: pending, applied (with the reservation CODE) or rejected
+    entry_id = journal.parse_reference(reference)
+    if entry_id is None:
+        entry_id = _int(reference, "journal reference")
+    if not journal.enabled():
+        raise NotFound("The local journal is not enabled")
+    entry = journal.get_journal().entry(entry_id)
+    if entry is None:
+        raise NotFound(f"No journal entry {reference}")
+    return dict(entry, id=journal.reference(entry_id))
+
+
+@metrics.operation("search")
+def search_page(first_name="", last_name="", code="", room="", checkin=None, checkout=None, after=None, limit=500):
+    # One page of matches plus the position to continue from (None on the last page). Each page
+    # checks a connection out and back in, so a slow reader never holds one between pages.
+    checkin = _date(checkin, "checkin") if checkin else None
+    checkout = _date(checkout, "checkout") if checkout else None
+    if shards.enabled():
+        if code not in (None, ""):
+            try:
+                shards.parse_code(code)
+            except ValueError:
+                raise ServiceError("code must be a reservation code, optionally <shard>:<code>")
+        # CODE comes back as <shard>:<code>
+        rows, after = shards.search(first_name, last_name, code, room, checkin, checkout, after, limit)
+        return [dict(zip(RESERVATION_FIELDS, (f"{row[0]}:{row[1]}",) + row[2:])) for row in rows], after
+    if code not in (None, ""):
+        code = _int(code, "code")
+    with _connection() as conn:
+        rows, after = search_index.search(conn, first_name, last_name, code, room, checkin, checkout, after or 0, limit)
+    return [dict(zip(RESERVATION_FIELDS, row)) for row in rows], after
+
+
+def search(first_name="", last_name="", code="", room="", checkin=None, checkout=None, page_size=500):
+    # Generator of every match, one page at a time
+    after = None
+    while True:
+        rows, after = search_page(first_name, last_name, code, room, checkin, checkout, after, page_size)
+        yield from rows
+        if after is None:
+            return
+
+
+@metrics.operation("revenue")
+def revenue(start=None, end=None, period="month", group_by="room"):
+    start = _date(start, "start") if start else date(date.today().year, 1, 1)
+    end = _date(end, "end") if end else date(start.year + 1, 1, 1)
+    if end <= start:
+        raise ServiceError("end must be after start")
+    if (end - start).days > MAX_REVENUE_DAYS:
+        raise ServiceError(f"start to end can span at most {MAX_REVENUE_DAYS} days")
+    if shards.enabled():
+        # Stays checking in the year before start can still overlap it
+        reservations = shards.fetch("reservations_overlapping", statements.overlap_params(start, end), (start.year - 1, (end - timedelta(days=1)).year), by_property=True)
+    else:
+        with _connection() as conn:
+            reservations = statements.fetch(conn, "reservations_overlapping", statements.overlap_params(start, end))
+    try:
+        report = revenue_engine.revenue_report(reservations, start, end, period, group_by)
+    except ValueError as e:
+        raise ServiceError(str(e))
+    if group_by == "period":
+        return {day.isoformat(): amount for day, amount in report.items()}
+    return {room: {day.isoformat(): amount for day, amount in periods.items()} for room, periods in report.items()}
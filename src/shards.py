@@ -0,0 +1,386 @@
+import contextvars
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+import db
+import availability
+import booking
+import events
+import occupancy
+import room_stats
+import search as search_index
+import statements
+
+# Sharded deployments: several properties and/or spans of years, each in its own database or its own
+# pair of tables. INN_SHARDS names a JSON file listing the shards, e.g.
+#   [{"name": "north", "property": "North Lodge", "years": [2024, null], "backend": "mysql", "database": "north"},
+#    {"name": "north-2023", "property": "North Lodge", "years": [null, 2023], "backend": "sqlite", "path": "north_2023.db"},
+#    {"name": "south", "property": "South Inn", "backend": "mysql", "database": "inn",
+#     "tables": {"lab7_rooms": "south_rooms", "lab7_reservations": "south_reservations"}}]
+# MySQL settings not given fall back to the HP_* variables. A reservation lives in the shard whose
+# lab7_rooms has its room and whose years hold its check-in year. Reads fan out on a thread pool to
+# the shards that can hold matching rows and merge the results; a booking writes to the owning shard
+# only. Each shard keeps its own in-process caches (see db.pool_cached). Reservation codes are only
+# unique within a shard, so they are shown as <shard>:<code>; a bare code is accepted when one shard has
+# it. Two properties may both have a room 101, so room statistics, revenue, free rooms and calendars are
+# merged per property and RoomCode (room_key), room rows carry their property, and a booking names the
+# property when its RoomCode exists at more than one.
+
+THREADS = int(os.getenv("INN_SHARD_THREADS", "8"))
+
+
+class Shard:
+    def __init__(self, name, pool, property=None, years=None):
+        self.name = name
+        self.pool = pool
+        self.property = property
+        self.first_year, self.last_year = years or (None, None)
+
+    def __repr__(self):
+        return f"Shard({self.name!r})"
+
+    def holds_years(self, first=None, last=None):
+        # Whether stays checking in some time in [first, last] (None = open) can be in this shard
+        return (first is None or self.last_year is None or self.last_year >= first) and (
+            last is None or self.first_year is None or self.first_year <= last
+        )
+
+    def run(self, func, *args):
+        # func(conn, *args) on one of this shard's connections, with the shard's caches current
+        with db.using(self.pool):
+            conn = self.pool.get()
+            try:
+                return func(conn, *args)
+            finally:
+                conn.close()
+
+
+def load(path):
+    with open(path) as config:
+        entries = json.load(config)
+    shards = []
+    for entry in entries:
+        entry = dict(entry)
+        name = entry.pop("name")
+        kind = entry.pop("backend", "mysql")
+        if kind == "sqlite":
+            backend = db.SQLiteBackend(entry.pop("path", None))
+        else:
+            backend = db.get_backend(kind)
+            backend.params.update({key: entry.pop(key) for key in ("host", "user", "password", "database") if key in entry})
+        pool = db.new_pool(backend, name=name, tables=entry.pop("tables", None))
+        shards.append(Shard(name, pool, entry.pop("property", None), entry.pop("years", None)))
+    if len({shard.name for shard in shards}) != len(shards):
+        raise ValueError(f"{path}: shard names must be unique")
+    return shards
+
+
+_shards = None
+_executor = None
+_lock = threading.Lock()
+
+
+def enabled():
+    return bool(os.getenv("INN_SHARDS"))
+
+
+def get_shards():
+    global _shards
+    with _lock:
+        if _shards is None:
+            _shards = load(os.environ["INN_SHARDS"])
+        return _shards
+
+
+def get_shard(name):
+    for shard in get_shards():
+        if shard.name == name:
+            return shard
+    return None
+
+
+def _forget_shards_after_fork():
+    # Like db's pool: a forked child (e.g. a reports.py worker) opens its own shard pools and threads
+    global _shards, _executor, _lock
+    _shards = None
+    _executor = None
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_shards_after_fork)
+
+
+def shards_for_years(first=None, last=None):
+    return [shard for shard in get_shards() if shard.holds_years(first, last)]
+
+
+def _submit(shard, func, *args):
+    # The caller's context goes along so metrics count the statements against its operation
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="shard")
+    return _executor.submit(contextvars.copy_context().run, shard.run, func, *args)
+
+
+def fan_out(func, shards, *args):
+    # [(shard, func(conn, *args))] with every shard queried at once; the first error is raised
+    shards = list(shards)
+    if len(shards) == 1:
+        return [(shards[0], shards[0].run(func, *args))]
+    futures = [(shard, _submit(shard, func, *args)) for shard in shards]
+    return [(shard, future.result()) for shard, future in futures]
+
+
+def format_code(shard, code):
+    return f"{shard.name}:{code}"
+
+
+def parse_code(value):
+    # "north:12" -> ("north", 12), "12" -> (None, 12); ValueError if there is no number
+    name, _, code = str(value).strip().rpartition(":")
+    return name or None, int(code)
+
+
+def _stay_years(checkin, checkout):
+    # Years whose shards can hold a stay overlapping [checkin, checkout): ones checking in the year
+    # before may still be in the house
+    checkin, checkout = _date(checkin), _date(checkout)
+    return checkin.year - 1, (checkout - timedelta(days=1)).year
+
+
+def _date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def max_occupancy():
+    return max((rows[0][0] or 0 for _, rows in fan_out(statements.fetch, get_shards(), "max_occupancy")), default=0)
+
+
+def room_key(shard, room):
+    # A room is its property and RoomCode: year shards of one property share their rooms, while
+    # another property may reuse the codes. Shards without a property count as one property.
+    return room if shard is None or shard.property is None else f"{shard.property}/{room}"
+
+
+def fetch(name, params=(), years=(None, None), by_property=False):
+    # Rows of a named read (statements.SQL) from every shard holding those years, concatenated.
+    # by_property replaces each row's leading Room with room_key(), so totals per room keep the
+    # properties apart.
+    rows = []
+    for shard, shard_rows in fan_out(statements.fetch, shards_for_years(*years), name, params):
+        if by_property:
+            shard_rows = [(room_key(shard, row[0]),) + tuple(row[1:]) for row in shard_rows]
+        rows.extend(shard_rows)
+    return rows
+
+
+def _stats(conn):
+    return room_stats.get_stats(conn.cursor())
+
+
+def room_table(as_of):
+    # list_rooms rows over every shard, each with its property appended; year shards of one property
+    # are combined per room
+    by_property = {}
+    for shard, stats in fan_out(_stats, get_shards()):
+        by_property.setdefault(shard.property, []).append(stats)
+    rows = [
+        row + (property,)
+        for property, all_stats in by_property.items()
+        for row in room_stats.combined_table(all_stats, as_of)
+    ]
+    rows.sort(key=lambda row: row[7], reverse=True)
+    return rows
+
+
+def _free_rooms(conn, checkin, checkout, bed_type, guests, room_code):
+    index = availability.get_index(conn.cursor())
+    return set(index.rooms), index.free_rooms(checkin, checkout, bed_type, guests, room_code)
+
+
+def free_rooms(checkin, checkout, bed_type="Any", guests=0, room_code="Any"):
+    # Rooms owned for the check-in year and free in every shard of their property that holds part of
+    # the stay's dates, each with its property appended
+    year = _date(checkin).year
+    offered, busy = {}, set()
+    for shard, (rooms, free) in fan_out(_free_rooms, shards_for_years(*_stay_years(checkin, checkout)), checkin, checkout, bed_type, guests, room_code):
+        busy |= {room_key(shard, code) for code in rooms - {room[0] for room in free}}
+        if shard.holds_years(year, year):
+            for room in free:
+                offered.setdefault(room_key(shard, room[0]), room + (shard.property,))
+    return sorted((room for key, room in offered.items() if key not in busy), key=lambda room: (room[0], room[-1] or ""))
+
+
+def _suggest(conn, checkin, checkout, guests, bed_type, flex_days, limit, earliest):
+    return occupancy.get_matrix(conn.cursor()).suggest(checkin, checkout, guests, bed_type, flex_days, limit, earliest)
+
+
+def suggest(checkin, checkout, guests, bed_type="Any", flex_days=7, limit=5, earliest=None):
+    # OccupancyMatrix.suggest() over the shards owning the check-in year, closest dates first, each
+    # room with its property appended. Stays crossing into another shard's years are re-checked when booked.
+    year = _date(checkin).year
+    checkin_day = _date(checkin).toordinal()
+    suggestions = [
+        (room + (shard.property,), start, end)
+        for shard, found in fan_out(_suggest, shards_for_years(year, year), checkin, checkout, guests, bed_type, flex_days, limit, earliest)
+        for room, start, end in found
+    ]
+    suggestions.sort(key=lambda suggestion: abs(suggestion[1].toordinal() - checkin_day))
+    return suggestions[:limit]
+
+
+def _month_calendar(conn, year, month, codes):
+    return occupancy.get_matrix(conn.cursor()).month_calendar(year, month, codes)
+
+
+def month_calendar(year, month, codes=None):
+    # Free nights per room_key() for one month; a room held by several shards of its property is free
+    # where all of them agree
+    free = {}
+    for shard, calendar in fan_out(_month_calendar, shards_for_years(year - 1, year), year, month, codes):
+        for code, days in calendar.items():
+            key = room_key(shard, code)
+            free[key] = sorted(set(free[key]) & set(days)) if key in free else days
+    return free
+
+
+def _rooms(conn):
+    return availability.get_index(conn.cursor()).rooms
+
+
+def owner(room, checkin, property=None):
+    # The shard of `property` a stay in `room` checking in on `checkin` belongs to, or None. Without a
+    # property the RoomCode must exist at only one; LookupError otherwise.
+    year = _date(checkin).year
+    found = [
+        shard for shard, rooms in fan_out(_rooms, shards_for_years(year, year))
+        if room in rooms and (property is None or shard.property == property)
+    ]
+    properties = sorted({str(shard.property) for shard in found})
+    if len(properties) > 1:
+        raise LookupError(f"Room {room} exists at {', '.join(properties)}; choose the property")
+    return found[0] if found else None
+
+
+def book(room, checkin, checkout, rate, last_name, first_name, adults, kids, property=None):
+    # Book in the owning shard of `property` (see owner()); returns (shard, code). Raises LookupError
+    # when no shard owns the room for that year or the property is ambiguous, booking.RoomUnavailable
+    # when the stay overlaps another.
+    booking.check_stay(checkin, checkout)
+    home = owner(room, checkin, property)
+    if home is None:
+        raise LookupError(f"No shard holds room {room} for {_date(checkin).year}")
+    # Shards of the same property for neighbouring years can hold stays overlapping this one
+    others = [
+        shard for shard, rooms in fan_out(_rooms, shards_for_years(*_stay_years(checkin, checkout)))
+        if shard is not home and shard.property == home.property and room in rooms
+    ]
+    try:
+        if not others:
+            code, _ = home.run(booking.book, room, checkin, checkout, rate, last_name, first_name, adults, kids)
+        else:
+            code = _book_across(home, others, room, checkin, checkout, rate, last_name, first_name, adults, kids)
+    except booking.RoomUnavailable:
+        # Another process got there first; these shards' caches missed it, for this room
+        for shard in [home] + others:
+            with db.using(shard.pool):
+                events.room_changed(room)
+        raise
+    return home, code
+
+
+def _book_across(home, others, room, checkin, checkout, rate, last_name, first_name, adults, kids):
+    # Lock the room in every shard involved, always in name order so two desks can't deadlock,
+    # and only insert once none of them has an overlapping stay
+    conns = []
+    with booking.room_lock(room):
+        try:
+            for shard in sorted([home] + others, key=lambda shard: shard.name):
+                conn = shard.pool.get()
+                conns.append(conn)
+                cursor = conn.cursor()
+                shard.pool.backend.lock_room(cursor, room)
+                cursor.close()
+                if statements.execute(conn, "find_conflict", (room,) + statements.overlap_params(checkin, checkout)).fetchall():
+                    raise booking.RoomUnavailable(f"Room {room} is already booked between {checkin} and {checkout}")
+                if shard is home:
+                    home_conn = conn
+            code = statements.execute(
+                home_conn, "insert_reservation", (room, checkin, checkout, rate, last_name, first_name, adults, kids),
+            ).lastrowid
+            home_conn.commit()
+        finally:
+            for conn in conns:
+                conn.close()
+    # Like booking.book(), announce the new stay to the home shard's caches
+    with db.using(home.pool):
+        events.reservation_added(code, room, checkin, checkout)
+    return code
+
+
+def find_reservation(value):
+    # (shard, reservation row) for "<shard>:<code>", or for a bare code found in exactly one shard.
+    # None when there is no such reservation; LookupError when a bare code is in several shards.
+    name, code = parse_code(value)
+    shards = get_shards() if name is None else [shard for shard in get_shards() if shard.name == name]
+    found = [(shard, rows[0]) for shard, rows in fan_out(lambda conn: statements.execute(conn, "reservation", (code,)).fetchall(), shards) if rows]
+    if len(found) > 1:
+        raise LookupError(f"Reservation {code} exists in {', '.join(shard.name for shard, _ in found)}; enter it as <shard>:{code}")
+    return found[0] if found else None
+
+
+def _cancel(conn, code):
+    statements.execute(conn, "delete_reservation", (code,))
+    conn.commit()
+    events.reservation_removed(code)
+
+
+def cancel(shard, code):
+    shard.run(_cancel, code)
+
+
+def _search_page(conn, first_name, last_name, code, room, checkin, checkout, after, limit):
+    return search_index.search(conn, first_name, last_name, code, room, checkin, checkout, after, limit)
+
+
+def search(first_name="", last_name="", code="", room="", checkin=None, checkout=None, after=None, limit=search_index.PAGE_SIZE):
+    # One page of matches over the shards, ordered by (CODE, shard). `after` is the position the
+    # previous page returned ({shard name: last CODE seen}). Returns (rows, next_after); rows are
+    # (shard name,) + search row and next_after is None on the last page.
+    if after is None:
+        name = None
+        if code not in (None, ""):
+            name, code = parse_code(code)
+        years = (_date(checkin).year - 1 if checkin else None, _date(checkout).year if checkout else None)
+        after = {shard.name: 0 for shard in shards_for_years(*years) if name is None or shard.name == name}
+    elif code not in (None, ""):
+        code = parse_code(code)[1]
+    shards = [get_shard(name) for name in after]
+    futures = [
+        (shard, _submit(shard, _search_page, first_name, last_name, code, room, checkin, checkout, after[shard.name], limit))
+        for shard in shards
+    ]
+    pages = [(shard, future.result()) for shard, future in futures]
+    merged = sorted(
+        ((row[0], shard.name, row) for shard, (rows, _) in pages for row in rows), key=lambda item: item[:2],
+    )[:limit]
+    next_after = {}
+    for shard, (rows, more) in pages:
+        used = [row for _, name, row in merged if name == shard.name]
+        if more is not None or len(used) < len(rows):
+            next_after[shard.name] = used[-1][0] if used else after[shard.name]
+    return [(name,) + tuple(row) for _, name, row in merged], next_after or None
+
+
+def iter_search(first_name="", last_name="", code="", room="", checkin=None, checkout=None, page_size=500):
+    after = None
+    while True:
+        rows, after = search(first_name, last_name, code, room, checkin, checkout, after, page_size)
+        yield from rows
+        if after is None:
+            return
@@ -0,0 +1,86 @@
+# Named, parameterized statements. Each one is prepared once per pooled connection (a MySQL
+# server-side prepared statement, or a cached compiled statement on SQLite) and reused by every
+# later call on that connection. User input only ever travels as a bound parameter.
+
+from datetime import date, timedelta
+
+# Longest stay a booking may have. Overlap lookups rely on it to bound CheckIn from below as well as
+# above, so the index range they read covers a few weeks of a room's stays, not its whole history.
+MAX_STAY_NIGHTS = 365
+
+SQL = {
+    "max_occupancy": "SELECT MAX(maxOcc) FROM lab7_rooms",
+    "room": "SELECT RoomCode, RoomName, Beds, bedType, maxOcc, basePrice, decor FROM lab7_rooms WHERE RoomCode = %s",
+    "reservation": """
+        SELECT CODE, Room, CheckIn, Checkout, LastName, FirstName
+        FROM lab7_reservations
+        WHERE CODE = %s
+    """,
+    # Overlap lookups take (..., end, earliest check-in, start); see overlap_params()
+    "find_conflict": """
+        SELECT CODE FROM lab7_reservations
+        WHERE Room = %s AND CheckIn < %s AND CheckIn >= %s AND Checkout > %s
+        LIMIT 1
+    """,
+    # Every stay overlapping a room's dates, with the guest, so a replayed journal entry can spot itself
+    "overlapping_stays": """
+        SELECT CODE, CheckIn, Checkout, LastName, FirstName FROM lab7_reservations
+        WHERE Room = %s AND CheckIn < %s AND CheckIn >= %s AND Checkout > %s
+    """,
+    # One room's stays, to re-read a room another process booked into
+    "room_stays": "SELECT CODE, CheckIn, Checkout FROM lab7_reservations WHERE Room = %s",
+    "insert_reservation": """
+        INSERT INTO lab7_reservations (Room, CheckIn, Checkout, Rate, LastName, FirstName, Adults, Kids)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    """,
+    "delete_reservation": "DELETE FROM lab7_reservations WHERE CODE = %s",
+    # Stays checking in within [start, end); a plain range on CheckIn instead of YEAR(CheckIn) = ...
+    "reservations_checking_in": """
+        SELECT Room, CheckIn, Checkout, Rate
+        FROM lab7_reservations
+        WHERE CheckIn >= %s AND CheckIn < %s
+        ORDER BY Room
+    """,
+    # Stays overlapping [start, end) (params: overlap_params(start, end))
+    "reservations_overlapping": """
+        SELECT Room, CheckIn, Checkout, Rate
+        FROM lab7_reservations
+        WHERE CheckIn < %s AND CheckIn >= %s AND Checkout > %s
+    """,
+}
+
+
+def to_date(value):
+    return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+
+def earliest_checkin(start):
+    # No stay checking in before this can still be in the house on `start`
+    return to_date(start) - timedelta(days=MAX_STAY_NIGHTS)
+
+
+def overlap_params(start, end):
+    # (end, earliest check-in, start) for the statements finding stays that overlap [start, end)
+    return end, earliest_checkin(start), start
+
+
+# Reads whose results are worth keeping in the pool's result cache (see db.ResultCache)
+CACHED = {"max_occupancy", "reservations_checking_in", "reservations_overlapping"}
+
+
+def fetch(conn, name, params=()):
+    # All rows of a named read, served from the result cache when it is one of CACHED
+    return conn.query(SQL[name], params, cache=name in CACHED)
+
+
+def execute(conn, name, params=()):
+    # Runs a named statement on a pooled connection and returns its (shared) cursor; fetch the
+    # results before running anything else on the connection, and don't close the cursor
+    return execute_sql(conn, SQL[name], params)
+
+
+def execute_sql(conn, sql, params=()):
+    # Same for statements assembled at runtime from a fixed set of shapes (see search.py)
+    cursor = conn.prepared(sql)
+    cursor.execute(sql, params)
+    return cursor
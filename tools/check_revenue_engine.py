@@ -0,0 +1,65 @@
+# Checks revenue_engine.monthly_revenue against the night-by-night loop revenue() used before it, on
+# random stays: python tools/check_revenue_engine.py [--stays 20000]
+import argparse
+import os
+import random
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import revenue_engine
+
+
+def baseline_monthly_revenue(reservations, year):
+    # The night-by-night loop revenue() used before this engine, kept as the reference for check()
+    monthly = {room: {month: 0 for month in range(1, 13)} for room in set(row[0] for row in reservations)}
+    for room, checkin, checkout, rate in reservations:
+        for n in range((checkout - checkin).days):
+            night = checkin + timedelta(n)
+            if night.year == year:
+                monthly[room][night.month] += rate
+    return monthly
+
+
+def random_stays(count, year, rooms=66, seed=0):
+    # Stays around `year`, some crossing into the years either side, with Decimal rates like MySQL returns
+    rng = random.Random(seed)
+    first = date(year - 1, 11, 1)
+    stays = []
+    for _ in range(count):
+        checkin = first + timedelta(days=rng.randint(0, 500))
+        checkout = checkin + timedelta(days=rng.randint(1, 30))
+        stays.append((f"R{rng.randint(1, rooms):04d}", checkin, checkout, Decimal(rng.randint(5000, 40000)) / 100))
+    return stays
+
+
+def check(count=20000, year=2024, seed=0):
+    # Rooms/months where monthly_revenue differs from the baseline loop, compared in cents; [] when they match
+    stays = random_stays(count, year, seed=seed)
+    fast, slow = revenue_engine.monthly_revenue(stays, year), baseline_monthly_revenue(stays, year)
+    if set(fast) != set(slow):
+        return [(room, None) for room in set(fast) ^ set(slow)]
+    return [
+        (room, month) for room in slow for month in range(1, 13)
+        if round(fast[room][month] * 100) != slow[room][month] * 100
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check monthly_revenue against the night-by-night loop on random stays")
+    parser.add_argument("--stays", type=int, default=20000)
+    parser.add_argument("--year", type=int, default=2024)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    mismatches = check(args.stays, args.year, args.seed)
+    for room, month in mismatches[:20]:
+        print(f"Error: {room} month {month} differs from the baseline loop")
+    if not mismatches:
+        print(f"monthly_revenue matches the baseline loop on {args.stays} stays")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())